@@ -1,9 +1,13 @@
 #!/bin/sh
 # Backup the geochron database to /var/local/geochron/backup<DATE>.gz
+# and the image store to /var/local/geochron/image_store
 # To restore, use:
 # gunzip -c /var/local/geochron/backup20211202.gz | docker-compose exec -T db psql -U geochron -f-
-mkdir -p /var/local/geochron
+# cp -a /var/local/geochron/image_store/. user_upload/image_store/
+mkdir -p /var/local/geochron/image_store
 cd `dirname $0`
 docker-compose exec -T db pg_dump -c -U geochron | gzip -c > /var/local/geochron/backup`date +%Y%m%d`.gz
+# image files never change once stored, so only new ones are copied
+cp -a -n user_upload/image_store/. /var/local/geochron/image_store/
 # delete backups more than a week old
-find /var/local/geochron/ -mtime +7 -delete
+find /var/local/geochron/ -maxdepth 1 -name 'backup*.gz' -mtime +7 -delete
@@ -1,8 +1,10 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.postgres.forms import SimpleArrayField
 from ftc.models import (
     Project, Sample, Grain, FissionTrackNumbering, TutorialResult,
     GrainPoint, GrainPointCategory, TutorialPage, ContainedTrack,
-    Region
+    Region, PackedGrainPoints, UploadJob, Job, GrainSummary, SampleSummary
 )
 
 class GrainInline(admin.TabularInline):
@@ -35,6 +37,10 @@ class GrainPointInline(admin.TabularInline):
     model = GrainPoint
     extra = 0
 
+class PackedGrainPointsInline(admin.StackedInline):
+    model = PackedGrainPoints
+    extra = 0
+
 class ContainedTrackInline(admin.TabularInline):
     model = ContainedTrack
     extra = 0
@@ -43,7 +49,7 @@ class ContainedTrackInline(admin.TabularInline):
 class FissionTrackNumberingAdmin(admin.ModelAdmin):
     list_display = ('id', 'grain', 'ft_type', 'worker', 'result', 'create_date', 'analyst')
     list_filter = ['grain', 'grain__sample', 'grain__sample__in_project']
-    inlines = [GrainPointInline, ContainedTrackInline]
+    inlines = [GrainPointInline, PackedGrainPointsInline, ContainedTrackInline]
 
 @admin.register(TutorialResult)
 class TutorialResultAdmin(admin.ModelAdmin):
@@ -53,9 +59,21 @@ class TutorialResultAdmin(admin.ModelAdmin):
 class GrainPointCategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'description')
 
+class RegionForm(forms.ModelForm):
+    vertices = SimpleArrayField(
+        SimpleArrayField(forms.IntegerField(), min_length=2, max_length=2),
+        delimiter='|',
+        help_text='x,y pairs in pixels separated by |'
+    )
+
+    class Meta:
+        model = Region
+        fields = '__all__'
+
 @admin.register(Region)
 class RegionAdmin(admin.ModelAdmin):
-    list_display = ['id', 'grain', 'result']
+    form = RegionForm
+    list_display = ['id', 'grain', 'result', 'area_pixels']
     list_filter = ['grain__sample', 'grain__sample__in_project', 'grain', 'result']
 
 admin.site.register(Grain, admin.ModelAdmin)
@@ -65,3 +83,21 @@ admin.site.register(TutorialPage, admin.ModelAdmin)
 admin.site.register(ContainedTrack, admin.ModelAdmin)
 
 admin.site.register(GrainPoint, admin.ModelAdmin)
+
+@admin.register(UploadJob)
+class UploadJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'status', 'queued', 'started', 'finished')
+    list_filter = ['status', 'user']
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'task', 'owner', 'status', 'attempts', 'created', 'finished')
+    list_filter = ['status', 'task']
+
+@admin.register(GrainSummary)
+class GrainSummaryAdmin(admin.ModelAdmin):
+    list_display = ('grain', 'ns', 'ni', 'result_count', 'contributor_count', 'updated')
+
+@admin.register(SampleSummary)
+class SampleSummaryAdmin(admin.ModelAdmin):
+    list_display = ('sample', 'grain_count', 'ns', 'ni', 'result_count', 'contributor_count', 'updated')
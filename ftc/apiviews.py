@@ -2,10 +2,13 @@ from django.contrib.auth.models import User
 from django.core.exceptions import (
     ObjectDoesNotExist, MultipleObjectsReturned, PermissionDenied
 )
+from django.db import IntegrityError, transaction
 from django.db.models.aggregates import Max
 from django.forms import ValidationError
-from django.http import Http404
+from django.http import FileResponse, Http404
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.datastructures import MultiValueDict
 import json
 import logging
 import numbers
@@ -16,14 +19,18 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import exception_handler
 
+from ftc.count_export import EXPORT_FORMATS, ExportUnavailable, export_counts
+from ftc.grain_archive import archive_files
+from ftc.jobs import enqueue
 from ftc.load_rois import get_rois, get_rois_user, get_roiss
 from ftc.models import (
     Project, Sample, Grain, Image, FissionTrackNumbering,
-    Transform2D, GrainPoint, GrainPointCategory, ContainedTrack,
-    Region, Vertex
+    Transform2D, ContainedTrack, Job
 )
 from ftc.parse_image_name import parse_upload_name
-from ftc.save_rois_regions import save_rois_regions
+from ftc.save_rois_regions import save_regions, save_rois_regions
+from ftc.summaries import delete_updating_summaries, refresh_summaries
+from ftc.tasks import delete_object
 from ftc import views
 
 
@@ -47,12 +54,62 @@ def models_owned(model_class, request):
     return qs.none()
 
 
+def job_accepted(job):
+    """
+    Returns a 202 response telling the client where to find out how
+    the queued `job` is getting on.
+    """
+    url = reverse('api_job_info', args=[job.pk])
+    return Response(
+        { 'job': job.pk, 'url': url },
+        status=202,
+        headers={ 'Location': url }
+    )
+
+
 class RetrieveUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         return models_owned(self.model, self.request)
 
+    def destroy(self, request, *args, **kwargs):
+        """
+        With ?background=true the deletion is queued as a job.
+        """
+        if request.query_params.get('background') not in ('true', '1'):
+            return super().destroy(request, *args, **kwargs)
+        instance = self.get_object()
+        job = enqueue(
+            delete_object,
+            owner=request.user,
+            model=instance._meta.label,
+            pk=instance.pk
+        )
+        return job_accepted(job)
+
+    def perform_destroy(self, instance):
+        delete_updating_summaries(
+            type(instance).objects.filter(pk=instance.pk)
+        )
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ['id', 'task', 'status', 'attempts', 'max_attempts',
+            'created', 'started', 'finished', 'run_after', 'result', 'error']
+
+    status = serializers.CharField(source='get_status_display')
+
+
+class JobInfoView(generics.RetrieveAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = JobSerializer
+
+    def get_queryset(self):
+        return models_owned(Job, self.request)
+
 
 class ListCreateView(generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated]
@@ -178,6 +235,31 @@ def get_sample_object(id_or_name, request) -> Sample:
     return vals.first()
 
 
+@api_view()
+@permission_classes([IsAuthenticated])
+def get_sample_inventory(request, sample):
+    """
+    Lists the grains of a sample with the index, fission track type
+    and content hash of each of their images, without loading any
+    image data, so that a client can tell what it needs to upload.
+    """
+    s = get_sample_object(sample, request)
+    grains = {
+        id: { 'id': id, 'index': index, 'images': [] }
+        for (id, index) in s.grain_set.order_by('index').values_list('id', 'index')
+    }
+    images = Image.objects.filter(grain__sample=s).order_by(
+        'grain', 'ft_type', 'index'
+    ).values('id', 'grain', 'index', 'ft_type', 'sha256')
+    for image in images:
+        grains[image.pop('grain')]['images'].append(image)
+    return Response({
+        'id': s.pk,
+        'sample_name': s.sample_name,
+        'grains': list(grains.values()),
+    })
+
+
 class SampleInfoView(RetrieveUpdateDeleteView):
     model = Sample
     serializer_class = SampleSerializer
@@ -189,6 +271,27 @@ class SampleInfoView(RetrieveUpdateDeleteView):
         return obj
 
 
+def make_transform(rois_transform, transform=None):
+    """
+    Saves and returns the Transform2D described by the `mica_transform`
+    of a rois.json file, or returns None if it does not describe one.
+    If `transform` (a grain's existing Transform2D) is given it is
+    updated rather than a new one being made.
+    """
+    if rois_transform and type(rois_transform) is list and len(rois_transform) == 2:
+        if transform is None:
+            transform = Transform2D()
+        transform.x0 = rois_transform[0][0]
+        transform.y0 = rois_transform[0][1]
+        transform.t0 = rois_transform[0][2]
+        transform.x1 = rois_transform[1][0]
+        transform.y1 = rois_transform[1][1]
+        transform.t1 = rois_transform[1][2]
+        transform.save()
+        return transform
+    return None
+
+
 class GrainSerializer(serializers.ModelSerializer):
     class Meta:
         model = Grain
@@ -203,45 +306,50 @@ class GrainSerializer(serializers.ModelSerializer):
     image_width = serializers.IntegerField(required=False, read_only=False)
     image_height = serializers.IntegerField(required=False, read_only=False)
 
+    def read_rois(self):
+        data = self.initial_data['rois'].read()
+        return json.loads(data.decode('utf-8'))
+
+    @staticmethod
+    def rois_fields(rois, grain=None):
+        """
+        Returns the Grain fields set from the rois.json object `rois`,
+        reusing the Transform2D of `grain` (if given) for its mica
+        transform.
+        """
+        region_first = rois['regions'][0]
+        transform = make_transform(
+            rois.get('mica_transform'),
+            grain.mica_transform_matrix if grain is not None else None
+        )
+        return {
+            'image_width': rois['image_width'],
+            'image_height': rois['image_height'],
+            'scale_x': rois.get('scale_x'),
+            'scale_y': rois.get('scale_y'),
+            'stage_x': rois.get('stage_x'),
+            'stage_y': rois.get('stage_y'),
+            'mica_stage_x': rois.get('mica_stage_x'),
+            'mica_stage_y': rois.get('mica_stage_y'),
+            'shift_x': region_first['shift'][0] if region_first else 0,
+            'shift_y': region_first['shift'][1] if region_first else 0,
+            'mica_transform_matrix': transform,
+        }
+
     def do_create(self, request, sample_id):
         sample = get_sample_object(sample_id, request)
         if (not request.user.is_superuser and
             sample.get_owner() != request.user):
             raise exceptions.PermissionDenied
-        data = self.initial_data['rois'].read()
-        rois_json = data.decode('utf-8')
-        rois = json.loads(rois_json)
+        rois = self.read_rois()
         index = self.validated_data.get('index')
         if index == None:
             max_index = sample.grain_set.aggregate(Max('index'))['index__max'] or 0
             index = max_index + 1
-        region_first = rois['regions'][0]
-        transform = None
-        rois_transform = rois.get('mica_transform')
-        if rois_transform and type(rois_transform) is list and len(rois_transform) == 2:
-            transform = Transform2D(
-                x0=rois_transform[0][0],
-                y0=rois_transform[0][1],
-                t0=rois_transform[0][2],
-                x1=rois_transform[1][0],
-                y1=rois_transform[1][1],
-                t1=rois_transform[1][2]
-            )
-            transform.save()
         grain = self.save(
             index = index,
             sample = sample,
-            image_width=rois['image_width'],
-            image_height=rois['image_height'],
-            scale_x=rois.get('scale_x'),
-            scale_y=rois.get('scale_y'),
-            stage_x=rois.get('stage_x'),
-            stage_y=rois.get('stage_y'),
-            mica_stage_x=rois.get('mica_stage_x'),
-            mica_stage_y=rois.get('mica_stage_y'),
-            shift_x=region_first['shift'][0] if region_first else 0,
-            shift_y=region_first['shift'][1] if region_first else 0,
-            mica_transform_matrix=transform
+            **self.rois_fields(rois)
         )
         save_rois_regions(rois, grain)
 
@@ -254,7 +362,23 @@ class GrainSerializer(serializers.ModelSerializer):
             kwargs['sample'] = sample
             if not request.user.is_superuser and sample.get_owner() != request.user:
                 raise exceptions.PermissionDenied
-        self.save(**kwargs)
+        # A new rois.json file replaces the grain's regions
+        rois = None
+        old_sample_id = self.instance.sample_id
+        old_transform = self.instance.mica_transform_matrix
+        with transaction.atomic():
+            if 'rois' in self.initial_data:
+                rois = self.read_rois()
+                kwargs.update(self.rois_fields(rois, self.instance))
+            grain = self.save(**kwargs)
+            if rois is not None:
+                grain.region_set.filter(result__isnull=True).delete()
+                save_rois_regions(rois, grain)
+                if old_transform is not None and grain.mica_transform_matrix is None:
+                    # Nothing else refers to it (and deleting it
+                    # earlier would have deleted the grain too)
+                    old_transform.delete()
+            refresh_summaries([grain.pk], [old_sample_id])
 
 
 class SampleGrainListView(ListCreateView):
@@ -300,6 +424,47 @@ class SampleGrainInfoView(RetrieveUpdateDeleteView):
         return obj
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_grain_from_archive(request, sample):
+    """
+    Creates a grain in the sample from the zip or tar file `archive`
+    containing its rois.json, stack images and _metadata.xml files,
+    and returns a summary of it. `index` is the grain's index
+    (default is the next unused one).
+    """
+    s = get_sample_object(sample, request)
+    if not request.user.is_superuser and s.get_owner() != request.user:
+        raise exceptions.PermissionDenied
+    if 'archive' not in request.FILES:
+        raise exceptions.ValidationError({ 'archive': ['No archive uploaded'] })
+    data = {}
+    if 'index' in request.data:
+        data['grain_index'] = request.data['index']
+    try:
+        uploads = archive_files(request.FILES['archive'])
+        form = views.GrainForm(data, MultiValueDict({ 'uploads': uploads }))
+        if not form.is_valid():
+            raise exceptions.ValidationError(
+                { k: list(v) for (k, v) in form.errors.items() }
+            )
+        form.next_grain_number(s)
+        grain = form.save_new()
+    except ValidationError as e:
+        raise exceptions.ValidationError(e.messages)
+    except IntegrityError:
+        raise exceptions.ValidationError(
+            ['Sample {0} already has a grain {1}'.format(s.pk, form.grain_index)]
+        )
+    return Response({
+        **GrainSerializer(grain).data,
+        'region_count': grain.region_set.count(),
+        'images': ImageSerializer(
+            grain.image_set.order_by('ft_type', 'index'), many=True
+        ).data,
+    }, status=201)
+
+
 class GrainListView(ListCreateView):
     serializer_class = GrainSerializer
     model = Grain
@@ -322,6 +487,12 @@ def get_image(request, pk):
     return views.get_image(request, pk)
 
 
+@api_view()
+@permission_classes([IsAuthenticated])
+def get_grain_image_bundle(request, grain, ft_type):
+    return views.get_grain_image_bundle(request, grain, ft_type)
+
+
 @api_view()
 @permission_classes([IsAuthenticated])
 def get_grain_rois(request, pk):
@@ -340,7 +511,7 @@ def get_grain_rois_user(request, pk, user):
     return Response(get_rois_user(grain, user_obj))
 
 
-def request_roiss(request):
+def request_roiss_grains(request):
     gq = Grain.objects.all()
     if 'grains[]' in request.GET:
         gq = gq.filter(
@@ -354,11 +525,10 @@ def request_roiss(request):
         gq = gq.filter(
             sample__in_project__in=request.GET.getlist('projects[]')
         )
-    return get_roiss(gq.prefetch_related(
-        'sample__in_project',
-        'region_set__vertex_set',
-        'mica_transform_matrix'
-    ))
+    return gq.select_related('mica_transform_matrix').order_by('pk')
+
+def request_roiss(request):
+    return get_roiss(request_roiss_grains(request))
 
 @api_view()
 @permission_classes([IsAuthenticated])
@@ -369,8 +539,10 @@ class ImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Image
         fields = [
-            'id', 'grain', 'format', 'ft_type', 'index', 'light_path', 'focus'
+            'id', 'grain', 'format', 'ft_type', 'index', 'light_path', 'focus',
+            'sha256', 'size', 'width', 'height'
         ]
+        read_only_fields = ['sha256', 'size', 'width', 'height']
         extra_kwargs = {
             'name': { 'write_only': True }
         }
@@ -437,7 +609,7 @@ class ImageInfoView(RetrieveUpdateDeleteView):
             kwargs['ft_type'] = info['ft_type']
             kwargs['index'] = info['index']
             kwargs['format'] = info['format']
-            kwargs['data'] = serializer.initial_data['data'].read().decode('utf-8')
+            kwargs['data'] = serializer.initial_data['data'].read()
         serializer.save(**kwargs)
 
 
@@ -502,8 +674,7 @@ class FissionTrackNumberingSerializerBase(serializers.ModelSerializer):
         if not region_qs.exists():
             return None
         return [
-            [[vertex.x, vertex.y]
-            for vertex in region.vertex_set.all()]
+            [[x, y] for (x, y) in region.vertices]
             for region in region_qs
         ]
 
@@ -594,17 +765,11 @@ class FissionTrackNumberingSerializerBase(serializers.ModelSerializer):
             **delete_params
         ).delete()
         ftn = FissionTrackNumbering.objects.create(**validated_data)
-        for point in points:
-            point["category"] = GrainPointCategory.objects.get(
-                name=point.get("category", "track")
-            )
-            GrainPoint.objects.create(result=ftn, **point)
+        ftn.addGrainPointsFromGrainPoints(points)
         for ct in contained_tracks:
             ContainedTrack.objects.create(result=ftn, **ct)
-        for reg in regions:
-            region = Region.objects.create(grain=ftn.grain, result=ftn)
-            for v in reg:
-                Vertex.objects.create(region=region, x=v[0], y=v[1])
+        save_regions(ftn.grain, regions, ftn)
+        refresh_summaries([ftn.grain_id])
         return ftn
 
 
@@ -633,31 +798,67 @@ class FissionTrackNumberingSerializerGps(FissionTrackNumberingSerializerBase):
 
     def get_grainpoints(self, obj):
         return [
-            { k: v for (k, v) in gp.items() if k not in ['id', 'result_id'] }
-            for gp in obj.grainpoint_set.values()
+            {
+                'x_pixels': gp['x_pixels'],
+                'y_pixels': gp['y_pixels'],
+                'category_id': gp['category'],
+                'comment': gp['comment']
+            }
+            for gp in obj.points()
         ]
 
+def filter_counts(params):
+    """
+    Returns the results selected by the query parameters all, sample,
+    grain and user.
+    """
+    qs = FissionTrackNumbering.objects.all()
+    if 'all' not in params:
+        qs = qs.filter(result__gte=0)
+    if 'sample' in params:
+        sample = params['sample']
+        if sample.isnumeric():
+            qs = qs.filter(grain__sample=sample)
+        else:
+            qs = qs.filter(grain__sample__sample_name=sample)
+    if 'grain' in params:
+        qs = qs.filter(grain__index=params['grain'])
+    if 'user' in params:
+        qs = qs.filter(worker__username=params['user'])
+    return qs
+
+
 class FissionTrackNumberingView(generics.ListCreateAPIView):
     serializer_class = FissionTrackNumberingSerializerGps
     model = FissionTrackNumbering
 
     def get_queryset(self):
-        params = self.request.query_params
-        qs = self.model.objects.all()
-        if 'all' not in params:
-            qs = qs.filter(result__gte=0)
-        if 'sample' in params:
-            sample = params['sample']
-            if sample.isnumeric():
-                qs = qs.filter(grain__sample=sample)
-            else:
-                qs = qs.filter(grain__sample__sample_name=sample)
-        if 'grain' in params:
-            qs = qs.filter(grain__index=params['grain'])
-        if 'user' in params:
-            qs = qs.filter(worker__username=params['user'])
+        qs = filter_counts(self.request.query_params)
         return qs.order_by('grain__sample', 'grain__index').select_related('worker')
 
 
 class FissionTrackNumberingViewLatLngs(FissionTrackNumberingView):
     serializer_class = FissionTrackNumberingSerializerLatLngs
+
+
+@api_view()
+@permission_classes([IsAuthenticated])
+def get_count_export(request, export_format):
+    """
+    Returns the results selected as for api/count/ as columnar files;
+    see ftc.count_export.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise Http404
+    try:
+        (fh, writer) = export_counts(
+            filter_counts(request.query_params), export_format
+        )
+    except ExportUnavailable as e:
+        return Response({ 'error': str(e) }, status=501)
+    return FileResponse(
+        fh,
+        as_attachment=True,
+        filename='counts.' + writer.extension,
+        content_type=writer.content_type
+    )
@@ -0,0 +1,278 @@
+"""
+Exports counting results as columnar files: an .npz file of NumPy
+arrays, or a zip of Parquet files (which needs the optional pyarrow
+package). There are four tables:
+
+results: one row per FissionTrackNumbering
+grains: the grains of those results
+points: each marker of those results, from GrainPoint or PackedGrainPoints
+contained_tracks: each ContainedTrack of those results
+
+The rows are read from the database in batches and written to a
+temporary file, so memory use does not depend on the size of the
+export.
+"""
+from datetime import datetime, timezone
+from ftc.models import ContainedTrack, Grain, GrainPoint, PackedGrainPoints
+import array
+import itertools
+import shutil
+import struct
+import sys
+import tempfile
+import zipfile
+
+EXPORT_BATCH_SIZE = 10000
+# Packed results hold many points each, so fewer are read at once
+PACKED_BATCH_SIZE = 100
+
+class ExportUnavailable(Exception):
+    pass
+
+def batches(rows, size=EXPORT_BATCH_SIZE):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+def packed_point_rows(packed):
+    for (result_id, xs, ys, categories, category_index, comments) in packed:
+        for (i, (x, y, c)) in enumerate(zip(xs, ys, category_index)):
+            yield (result_id, x, y, categories[c], comments.get(str(i), ''))
+
+def export_tables(results):
+    """
+    Yields (name, columns, batches) for each table of the export of
+    the FissionTrackNumbering queryset `results`. `columns` is a list
+    of (name, type), where type is 'int32', 'int64', 'float64',
+    'string' or 'timestamp'; string and float columns can have None in
+    them. `batches` yields lists of row tuples.
+    """
+    yield ('results', [
+        ('result_id', 'int64'),
+        ('grain_id', 'int64'),
+        ('sample_id', 'int64'),
+        ('sample_name', 'string'),
+        ('index', 'int32'),
+        ('ft_type', 'string'),
+        ('worker', 'string'),
+        ('analyst', 'string'),
+        ('count', 'int32'),
+        ('create_date', 'timestamp'),
+    ], batches(results.order_by('pk').values_list(
+        'pk', 'grain_id', 'grain__sample_id', 'grain__sample__sample_name',
+        'grain__index', 'ft_type', 'worker__username', 'analyst', 'result',
+        'create_date'
+    ).iterator(chunk_size=EXPORT_BATCH_SIZE)))
+    yield ('grains', [
+        ('grain_id', 'int64'),
+        ('sample_id', 'int64'),
+        ('sample_name', 'string'),
+        ('project_name', 'string'),
+        ('index', 'int32'),
+        ('image_width', 'int32'),
+        ('image_height', 'int32'),
+        ('scale_x', 'float64'),
+        ('scale_y', 'float64'),
+        ('stage_x', 'float64'),
+        ('stage_y', 'float64'),
+        ('mica_stage_x', 'float64'),
+        ('mica_stage_y', 'float64'),
+        ('shift_x', 'int32'),
+        ('shift_y', 'int32'),
+    ], batches(Grain.objects.filter(
+        pk__in=results.values('grain_id')
+    ).order_by('pk').values_list(
+        'pk', 'sample_id', 'sample__sample_name',
+        'sample__in_project__project_name', 'index', 'image_width',
+        'image_height', 'scale_x', 'scale_y', 'stage_x', 'stage_y',
+        'mica_stage_x', 'mica_stage_y', 'shift_x', 'shift_y'
+    ).iterator(chunk_size=EXPORT_BATCH_SIZE)))
+    yield ('points', [
+        ('result_id', 'int64'),
+        ('x_pixels', 'int32'),
+        ('y_pixels', 'int32'),
+        ('category', 'string'),
+        ('comment', 'string'),
+    ], batches(itertools.chain(
+        GrainPoint.objects.filter(
+            result__in=results
+        ).order_by('result_id', 'pk').values_list(
+            'result_id', 'x_pixels', 'y_pixels', 'category_id', 'comment'
+        ).iterator(chunk_size=EXPORT_BATCH_SIZE),
+        packed_point_rows(PackedGrainPoints.objects.filter(
+            result__in=results
+        ).order_by('result_id').values_list(
+            'result_id', 'x_pixels', 'y_pixels', 'categories',
+            'category_index', 'comments'
+        ).iterator(chunk_size=PACKED_BATCH_SIZE))
+    )))
+    yield ('contained_tracks', [
+        ('result_id', 'int64'),
+        ('x1_pixels', 'int32'),
+        ('y1_pixels', 'int32'),
+        ('z1_level', 'int32'),
+        ('x2_pixels', 'int32'),
+        ('y2_pixels', 'int32'),
+        ('z2_level', 'int32'),
+    ], batches(ContainedTrack.objects.filter(
+        result__in=results
+    ).order_by('result_id', 'pk').values_list(
+        'result_id', 'x1_pixels', 'y1_pixels', 'z1_level',
+        'x2_pixels', 'y2_pixels', 'z2_level'
+    ).iterator(chunk_size=EXPORT_BATCH_SIZE)))
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def npy_header(descr, length):
+    """
+    Returns the header of a version 1.0 .npy file holding a
+    one-dimensional array of `length` elements of type `descr`.
+    """
+    header = "{{'descr': '{0}', 'fortran_order': False, 'shape': ({1},), }}".format(
+        descr, length
+    )
+    # numpy pads the header so that the data is 64-byte aligned
+    padding = 63 - (10 + len(header)) % 64
+    header = (header + ' ' * padding + '\n').encode('latin1')
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header
+
+class NpyColumn:
+    """
+    A column of an .npz export, kept in a temporary file until its
+    length is known. Strings are stored as int32 indices into an array
+    of the distinct values (-1 for None), nulls in float columns as
+    NaN and timestamps as microseconds since 1970 (UTC).
+    """
+    TYPECODES = {
+        'int32': ('i', '<i4'),
+        'int64': ('q', '<i8'),
+        'float64': ('d', '<f8'),
+        'timestamp': ('q', '<M8[us]'),
+        'string': ('i', '<i4'),
+    }
+
+    def __init__(self, kind):
+        self.kind = kind
+        (self.typecode, self.descr) = self.TYPECODES[kind]
+        self.file = tempfile.TemporaryFile()
+        self.length = 0
+        self.values = {}
+
+    def convert(self, v):
+        if self.kind == 'float64':
+            return float('nan') if v is None else v
+        if self.kind == 'timestamp':
+            return (v - EPOCH) // EPOCH.resolution
+        if self.kind == 'string':
+            if v is None:
+                return -1
+            return self.values.setdefault(v, len(self.values))
+        return v
+
+    def extend(self, vs):
+        a = array.array(self.typecode, (self.convert(v) for v in vs))
+        if sys.byteorder == 'big':
+            a.byteswap()
+        self.file.write(a.tobytes())
+        self.length += len(a)
+
+    def write(self, zip_file, name):
+        with zip_file.open(name + '.npy', 'w', force_zip64=True) as out:
+            out.write(npy_header(self.descr, self.length))
+            self.file.seek(0)
+            shutil.copyfileobj(self.file, out)
+        self.file.close()
+        if self.kind == 'string':
+            width = max([1] + [len(v) for v in self.values])
+            with zip_file.open(name + '.values.npy', 'w') as out:
+                out.write(npy_header('<U{0}'.format(width), len(self.values)))
+                for v in self.values:
+                    out.write(v.ljust(width, '\0').encode('utf-32-le'))
+
+class NpzWriter:
+    """
+    Writes each table's columns as arrays named <table>.<column> in an
+    .npz file, as numpy.load reads them. String columns are indices
+    into a <table>.<column>.values array.
+    """
+    content_type = 'application/octet-stream'
+    extension = 'npz'
+
+    def __init__(self, fh):
+        self.zip = zipfile.ZipFile(fh, 'w', zipfile.ZIP_STORED)
+
+    def write_table(self, name, columns, rows):
+        npys = [NpyColumn(kind) for (_, kind) in columns]
+        for batch in rows:
+            for (npy, vs) in zip(npys, zip(*batch)):
+                npy.extend(vs)
+        for ((column, _), npy) in zip(columns, npys):
+            npy.write(self.zip, name + '.' + column)
+
+    def close(self):
+        self.zip.close()
+
+class ParquetWriter:
+    """
+    Writes each table as <table>.parquet in a zip file.
+    """
+    content_type = 'application/zip'
+    extension = 'parquet.zip'
+
+    def __init__(self, fh):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ExportUnavailable(
+                'Parquet export needs the pyarrow package to be installed'
+            )
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.zip = zipfile.ZipFile(fh, 'w', zipfile.ZIP_STORED)
+
+    def arrow_type(self, kind):
+        if kind == 'timestamp':
+            return self.pa.timestamp('us', tz='UTC')
+        return getattr(self.pa, kind)()
+
+    def write_table(self, name, columns, rows):
+        schema = self.pa.schema([
+            (column, self.arrow_type(kind)) for (column, kind) in columns
+        ])
+        with self.zip.open(name + '.parquet', 'w', force_zip64=True) as out:
+            with self.pq.ParquetWriter(out, schema) as writer:
+                for batch in rows:
+                    writer.write_batch(self.pa.record_batch(
+                        [list(vs) for vs in zip(*batch)], schema=schema
+                    ))
+
+    def close(self):
+        self.zip.close()
+
+EXPORT_FORMATS = {
+    'npz': NpzWriter,
+    'parquet': ParquetWriter,
+}
+
+def export_counts(results, format):
+    """
+    Returns a temporary file holding the export of the
+    FissionTrackNumbering queryset `results` in `format` (a key of
+    EXPORT_FORMATS), and the writer class used.
+    """
+    cls = EXPORT_FORMATS[format]
+    fh = tempfile.TemporaryFile()
+    try:
+        writer = cls(fh)
+        for (name, columns, rows) in export_tables(results):
+            writer.write_table(name, columns, rows)
+        writer.close()
+    except Exception:
+        fh.close()
+        raise
+    fh.seek(0)
+    return (fh, cls)
@@ -35,7 +35,7 @@ def get_image_size_from_handle(input, size):
         width = int(w)
         height = int(h)
     elif ((size >= 24) and data.startswith(b'\211PNG\r\n\032\n')
-            and (data[12:16] == 'IHDR')):
+            and (data[12:16] == b'IHDR')):
         # PNGs
         w, h = struct.unpack(">LL", data[16:24])
         width = int(w)
@@ -0,0 +1,93 @@
+import tarfile
+import zipfile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.forms import ValidationError
+from geochron.settings import (
+    GRAIN_ARCHIVE_MAX_FILES, GRAIN_ARCHIVE_SIZE_LIMIT, IMAGE_UPLOAD_SIZE_LIMIT
+)
+
+def _member_file(path, size, read):
+    """
+    Returns an uploaded file for an archive member at `path`, or None
+    if it should be ignored. `read` is called to get its contents.
+    """
+    parts = path.replace('\\', '/').split('/')
+    # Ignore hidden files, and the resource forks macOS adds to zips
+    if any(p.startswith('.') or p == '__MACOSX' for p in parts if p):
+        return None
+    name = parts[-1]
+    if IMAGE_UPLOAD_SIZE_LIMIT < size:
+        raise ValidationError(
+            "File '%(fn)s' is too large",
+            params={'fn': name},
+            code='file-too-large'
+        )
+    return SimpleUploadedFile(name, read())
+
+def _check_totals(count, size):
+    """
+    Raises ValidationError if an archive with `count` files totalling
+    `size` bytes is too big, so that an archive that unpacks to much
+    more than was uploaded is refused.
+    """
+    if GRAIN_ARCHIVE_MAX_FILES < count:
+        raise ValidationError(
+            "The archive has more than %(max)s files",
+            params={'max': GRAIN_ARCHIVE_MAX_FILES},
+            code='archive-too-many-files'
+        )
+    if GRAIN_ARCHIVE_SIZE_LIMIT < size:
+        raise ValidationError(
+            "The archive's files are too large",
+            code='archive-too-large'
+        )
+
+def _archive_members(fh):
+    if zipfile.is_zipfile(fh):
+        fh.seek(0)
+        with zipfile.ZipFile(fh) as z:
+            infos = [info for info in z.infolist() if not info.is_dir()]
+            # A zip lists its members' sizes, so check before reading any
+            _check_totals(len(infos), sum(info.file_size for info in infos))
+            for info in infos:
+                yield (
+                    info.filename,
+                    info.file_size,
+                    lambda info=info: z.read(info)
+                )
+        return
+    fh.seek(0)
+    count = 0
+    size = 0
+    with tarfile.open(fileobj=fh, mode='r|*') as tar:
+        for member in tar:
+            if member.isfile():
+                count += 1
+                size += member.size
+                _check_totals(count, size)
+                yield (
+                    member.name,
+                    member.size,
+                    lambda member=member: tar.extractfile(member).read()
+                )
+
+def archive_files(fh):
+    """
+    Returns a list of the files in the zip or tar (optionally
+    compressed) archive `fh` as uploaded files named without their
+    directories, so that they can be given to ftc.views.GrainForm.
+    Tar archives are read in one pass.
+    """
+    files = []
+    try:
+        for (path, size, read) in _archive_members(fh):
+            f = _member_file(path, size, read)
+            if f is not None:
+                files.append(f)
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError) as e:
+        raise ValidationError(
+            "Could not read the archive: %(message)s",
+            params={'message': str(e)},
+            code='bad-archive'
+        )
+    return files
@@ -0,0 +1,195 @@
+import hashlib
+import io
+import os
+import tempfile
+from functools import cache
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from ftc.get_image_size import get_image_size_from_handle
+
+class FileSystemImageStore:
+    """
+    Stores image files in a directory, each named by the SHA-256 hash
+    of its content, so identical images are only stored once.
+
+    Files are never changed once written. Files are not removed when
+    the images referring to them are deleted, because other images
+    may share the same content.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def name(self, sha256):
+        """
+        Returns the path of the file relative to the store's root
+        """
+        return '/'.join([sha256[:2], sha256[2:4], sha256])
+
+    def path(self, sha256):
+        return os.path.join(self.root, self.name(sha256))
+
+    def exists(self, sha256):
+        return os.path.isfile(self.path(sha256))
+
+    def put(self, data):
+        """
+        Stores `data` (bytes) if it is not already stored and returns
+        its SHA-256 hash as a hex string.
+        """
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.path(sha256)
+        if not os.path.isfile(path):
+            self._write(path, data)
+        return sha256
+
+    def _write(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file and rename it so that no
+        # partly-written file is ever visible under its final name
+        (fd, tmp) = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(data)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def modified(self, sha256):
+        """
+        Returns the time (in seconds since the epoch) that the content
+        was first stored.
+        """
+        return os.path.getmtime(self.path(sha256))
+
+    def open(self, sha256):
+        """
+        Returns a binary file object for the stored content.
+        """
+        return open(self.path(sha256), 'rb')
+
+    def get(self, sha256):
+        with self.open(sha256) as fh:
+            return fh.read()
+
+    # Tiles made from an image (see ftc.image_tiles) are kept under
+    # tiles/ in the same tree, so they can be served the same way.
+
+    def tile_name(self, sha256, z, x, y):
+        """
+        Returns the path of a tile relative to the store's root
+        """
+        return '/'.join([
+            'tiles', sha256[:2], sha256[2:4], sha256,
+            str(z), str(x), '{0}.jpg'.format(y)
+        ])
+
+    def tile_path(self, sha256, z, x, y):
+        return os.path.join(self.root, self.tile_name(sha256, z, x, y))
+
+    def put_tile(self, sha256, z, x, y, data):
+        self._write(self.tile_path(sha256, z, x, y), data)
+
+    def _tile_levels_path(self, sha256):
+        return os.path.join(
+            self.root, 'tiles', sha256[:2], sha256[2:4], sha256, 'levels'
+        )
+
+    def set_tile_levels(self, sha256, levels):
+        """
+        Records that all the tiles for the image have been written,
+        with `levels` being the zoom level of the full-size tiles.
+        """
+        self._write(self._tile_levels_path(sha256), str(levels).encode())
+
+    def tile_levels(self, sha256):
+        """
+        Returns the zoom level of the full-size tiles for the image, or
+        None if its tiles have not all been written.
+        """
+        try:
+            with open(self._tile_levels_path(sha256), 'rb') as fh:
+                return int(fh.read())
+        except (OSError, ValueError):
+            return None
+
+    def open_tile(self, sha256, z, x, y):
+        return open(self.tile_path(sha256, z, x, y), 'rb')
+
+
+@cache
+def _image_store(cls, root):
+    return import_string(cls)(root)
+
+def get_image_store():
+    """
+    Returns the store configured by the IMAGE_STORE and
+    IMAGE_STORE_ROOT settings.
+    """
+    return _image_store(settings.IMAGE_STORE, settings.IMAGE_STORE_ROOT)
+
+def image_metadata(data):
+    """
+    Stores `data` (the bytes of an image file) in the image store and
+    returns a dict of the Image fields describing it: `sha256`, `size`,
+    `width` and `height` (the last two None if the format is not
+    recognized).
+    """
+    try:
+        dimensions = get_image_size_from_handle(io.BytesIO(data), len(data))
+    except Exception:
+        dimensions = None
+    (width, height) = dimensions if dimensions else (None, None)
+    return {
+        'sha256': get_image_store().put(data),
+        'size': len(data),
+        'width': width,
+        'height': height,
+    }
+
+def move_blobs_to_store(connection, batch_size=100, progress=None):
+    """
+    Moves image file contents still held in the old `data` column of
+    the ftc_image table into the image store, filling in the `sha256`,
+    `size`, `width` and `height` columns and clearing `data`.
+
+    This works on the table directly because the Image model no longer
+    has a `data` field. It is run by migration 0032, which then drops
+    the column, and by the move_images_to_store command, which can
+    do the work beforehand in batches while the site is running.
+
+    `progress`, if given, is called with the running total after each
+    batch. Returns the number of images moved, or None if the `data`
+    column no longer exists.
+    """
+    with connection.cursor() as cursor:
+        columns = connection.introspection.get_table_description(
+            cursor, 'ftc_image'
+        )
+    if 'data' not in [c.name for c in columns]:
+        return None
+    count = 0
+    while True:
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT id, data FROM ftc_image'
+                    ' WHERE data IS NOT NULL ORDER BY id LIMIT %s FOR UPDATE',
+                    [batch_size]
+                )
+                rows = cursor.fetchall()
+                for (pk, data) in rows:
+                    m = image_metadata(bytes(data))
+                    cursor.execute(
+                        'UPDATE ftc_image SET sha256 = %s, size = %s,'
+                        ' width = %s, height = %s, data = NULL WHERE id = %s',
+                        [m['sha256'], m['size'], m['width'], m['height'], pk]
+                    )
+        if not rows:
+            return count
+        count += len(rows)
+        if progress:
+            progress(count)
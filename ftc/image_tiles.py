@@ -0,0 +1,108 @@
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from django.conf import settings
+from django.db import connection, transaction
+from PIL import Image as PilImage
+from ftc.image_store import get_image_store
+
+# Tiles are square JPEGs of this many pixels a side (except at the
+# right and bottom edges, where they are cut short to fit the image)
+TILE_SIZE = 256
+TILE_QUALITY = 85
+
+logger = logging.getLogger(__name__)
+
+def tile_levels_for(width, height):
+    """
+    Returns the zoom level at which an image of the given size is
+    shown full size. Each level below that halves the image's width
+    and height (rounding up), down to level 0 which fits in one tile.
+    """
+    levels = 0
+    while TILE_SIZE << levels < max(width, height):
+        levels += 1
+    return levels
+
+def make_tiles(sha256):
+    """
+    Writes the tile pyramid of the stored image with hash `sha256`
+    to the image store in z/x/y layout (y counting down from the top),
+    unless it is already there. Returns the zoom level of the
+    full-size tiles.
+    """
+    store = get_image_store()
+    levels = store.tile_levels(sha256)
+    if levels is not None:
+        return levels
+    with store.open(sha256) as fh:
+        im = PilImage.open(fh)
+        im.load()
+    if im.mode not in ('RGB', 'L'):
+        im = im.convert('RGB')
+    levels = tile_levels_for(*im.size)
+    for z in range(levels, -1, -1):
+        if z != levels:
+            im = im.reduce(2)
+        (width, height) = im.size
+        for x in range(0, (width + TILE_SIZE - 1) // TILE_SIZE):
+            for y in range(0, (height + TILE_SIZE - 1) // TILE_SIZE):
+                tile = im.crop((
+                    x * TILE_SIZE,
+                    y * TILE_SIZE,
+                    min((x + 1) * TILE_SIZE, width),
+                    min((y + 1) * TILE_SIZE, height)
+                ))
+                buf = io.BytesIO()
+                tile.save(buf, 'JPEG', quality=TILE_QUALITY)
+                store.put_tile(sha256, z, x, y, buf.getvalue())
+    store.set_tile_levels(sha256, levels)
+    return levels
+
+def build_tiles(sha256):
+    """
+    Makes the tiles for the stored image with hash `sha256` and marks
+    every Image with that content as having them. Returns the zoom
+    level of the full-size tiles, or None if the image could not be
+    read.
+    """
+    from ftc.models import Image
+    try:
+        levels = make_tiles(sha256)
+    except Exception as e:
+        logger.warning('Could not make tiles for image %s: %s', sha256, e)
+        return None
+    Image.objects.filter(sha256=sha256).update(tile_levels=levels)
+    return levels
+
+def _build_tiles_in_background(sha256):
+    try:
+        build_tiles(sha256)
+    finally:
+        connection.close()
+
+@cache
+def _executor():
+    # One thread, so that a big upload does not starve the web workers
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix='tiles')
+
+def schedule_tiles(sha256):
+    """
+    Arranges for the tiles of the stored image with hash `sha256` to
+    be made once the current transaction commits: in a background
+    thread if the IMAGE_TILES setting is 'background', by a job worker
+    if it is 'queue', straight away if it is 'immediate' or not at all
+    if it is 'off'.
+    """
+    mode = settings.IMAGE_TILES
+    if mode == 'queue':
+        from ftc.jobs import enqueue
+        from ftc.tasks import make_image_tiles
+        enqueue(make_image_tiles, sha256=sha256)
+    elif mode == 'background':
+        transaction.on_commit(
+            lambda: _executor().submit(_build_tiles_in_background, sha256)
+        )
+    elif mode == 'immediate':
+        transaction.on_commit(lambda: build_tiles(sha256))
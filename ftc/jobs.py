@@ -0,0 +1,155 @@
+"""
+A job queue kept in the Job table. Views call enqueue() to have a
+task run later, and the runworkers command claims and runs the jobs,
+several workers sharing the queue through SELECT ... FOR UPDATE SKIP
+LOCKED. Tasks are functions registered with the @task decorator
+(see ftc.tasks), whose arguments and result must be JSON-serializable.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from ftc.models import Job
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+def task(f):
+    """
+    Registers `f` as a task that jobs can run.
+    """
+    TASKS[f.__name__] = f
+    return f
+
+def enqueue(f, owner=None, **args):
+    """
+    Queues a job to call the task `f` with keyword arguments `args`,
+    returning the Job. The job can be run once the current transaction
+    commits.
+    """
+    return Job.objects.create(
+        task=f.__name__,
+        args=args,
+        owner=owner,
+        max_attempts=settings.JOB_MAX_ATTEMPTS
+    )
+
+def retry_delay(attempts):
+    """
+    Seconds to wait before trying a job again after `attempts` tries.
+    """
+    return settings.JOB_RETRY_DELAY * 2 ** (attempts - 1)
+
+def claim_job():
+    """
+    Marks the next job that is ready to run as running and returns it,
+    or returns None if there is no such job. A running job whose worker
+    has not sent a heartbeat for JOB_TIMEOUT seconds is run again, or
+    fails if it has used all its attempts.
+    """
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            job = Job.objects.select_for_update(skip_locked=True).filter(
+                Q(status='Q', run_after__lte=now)
+                | Q(status='R', heartbeat__lt=now - timedelta(seconds=settings.JOB_TIMEOUT))
+            ).order_by('run_after', 'pk').first()
+            if job is None:
+                return None
+            if job.status == 'R' and job.max_attempts <= job.attempts:
+                job.status = 'F'
+                job.error = 'Timed out'
+                job.finished = now
+                job.save(update_fields=['status', 'error', 'finished'])
+                continue
+            job.status = 'R'
+            job.attempts += 1
+            job.started = now
+            job.heartbeat = now
+            job.save(update_fields=['status', 'attempts', 'started', 'heartbeat'])
+            return job
+
+class Heartbeat(threading.Thread):
+    """
+    Updates the heartbeat of the running job with ID `job_id` every
+    JOB_TIMEOUT/4 seconds until stop() is called, so that claim_job()
+    does not give a slow job to another worker. It runs in a thread of
+    its own, and so in its own connection, so that the updates are not
+    held back by the job's transaction.
+    """
+    def __init__(self, job_id):
+        super().__init__(daemon=True)
+        self.job_id = job_id
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(settings.JOB_TIMEOUT / 4):
+                Job.objects.filter(pk=self.job_id, status='R').update(
+                    heartbeat=timezone.now()
+                )
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def run_job(job):
+    """
+    Runs the claimed `job` in a transaction, recording its result, or
+    its error and when it should next be tried.
+    """
+    from ftc import tasks  # registers the tasks
+    f = TASKS.get(job.task)
+    attempts_left = job.attempts < job.max_attempts
+    heartbeat = Heartbeat(job.pk)
+    heartbeat.start()
+    try:
+        if f is None:
+            attempts_left = False
+            raise LookupError('No such task {0}'.format(job.task))
+        with transaction.atomic():
+            job.result = f(**job.args)
+        job.status = 'D'
+        job.error = ''
+    except Exception as e:
+        logger.exception('Job %d (%s) failed', job.pk, job.task)
+        job.error = '{0}: {1}'.format(type(e).__name__, e)
+        if attempts_left:
+            job.status = 'Q'
+            job.run_after = timezone.now() + timedelta(
+                seconds=retry_delay(job.attempts)
+            )
+        else:
+            job.status = 'F'
+    finally:
+        heartbeat.stop()
+    if job.status != 'Q':
+        job.finished = timezone.now()
+    job.save(update_fields=[
+        'status', 'result', 'error', 'run_after', 'finished'
+    ])
+
+def work(burst=False, interval=1, stopping=lambda: False):
+    """
+    Claims and runs jobs until `stopping()` returns True or, if
+    `burst`, until no job is ready to run. Waits `interval` seconds
+    between looks at an empty queue. Returns the number of jobs run.
+    """
+    count = 0
+    while not stopping():
+        job = claim_job()
+        if job is None:
+            if burst:
+                break
+            time.sleep(interval)
+            continue
+        run_job(job)
+        count += 1
+    return count
@@ -13,14 +13,13 @@ def load_rois_from_regions(grain: Grain, ft_type: str, matrix, regions: RegionOf
             shift_y = grain.shift_y / w
     rois = list()
     for _index, item in enumerate(regions.queryset()):
-        vertices = item.vertex_set.order_by('id')
         latlng = list()
         # only 'Induced Fission Tracks' will shift coordinates
         # positive sx or sy mean move along the image positive axis directions
         #TODO: combine this logic with similar in ftc.views.MicaDetailView
-        for vertex in vertices:
-            lat = (h - vertex.y) / w
-            lng = vertex.x / w
+        for (x, y) in item.vertices:
+            lat = (h - y) / w
+            lng = x / w
             if ft_type == 'I':
                 if matrix:
                     x = lng - 0.5
@@ -40,14 +39,10 @@ def indent(spaces, text):
     lines = text.split('\n')
     return spaces + ('\n' + spaces).join(lines)
 
-def rois_vertex(vertex):
-    return [vertex.x, vertex.y]
-
 def rois_region(region, grain):
-    vertices = region.vertex_set.order_by('id')
     return {
         "shift": [grain.shift_x, grain.shift_y],
-        "vertices": list(map(rois_vertex, vertices))
+        "vertices": [[x, y] for (x, y) in region.vertices]
     }
 
 def transform2d_as_matrix(transform):
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from ftc.models import Region
+from ftc.roi_geometry import polygon_area
+
+class Command(BaseCommand):
+    help = 'Calculate and store the area of every ROI region that does not have one stored'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='recalculate the areas of all regions, not just those without a stored area'
+        )
+        parser.add_argument(
+            '--batch-size',
+            dest='batch_size',
+            type=int,
+            default=1000,
+            help='number of regions to update per query (default 1000)'
+        )
+
+    def handle(self, *args, **options):
+        regions = Region.objects.order_by('id')
+        if not options['all']:
+            regions = regions.filter(area_pixels__isnull=True)
+        batch_size = options['batch_size']
+        count = 0
+        batch = []
+        for region in regions.iterator(chunk_size=batch_size):
+            region.area_pixels = polygon_area(region.vertices)
+            batch.append(region)
+            if batch_size <= len(batch):
+                Region.objects.bulk_update(batch, ['area_pixels'])
+                count += len(batch)
+                batch = []
+        Region.objects.bulk_update(batch, ['area_pixels'])
+        count += len(batch)
+        self.stdout.write('Stored the area of {0} regions'.format(count))
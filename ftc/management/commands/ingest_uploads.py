@@ -0,0 +1,160 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from ftc.upload_jobs import (
+    COMMIT_FILE, queue_drop, requeue_interrupted, run_upload_job
+)
+import os
+import signal
+import threading
+import time
+
+def poll_waiter(path, interval):
+    return lambda: time.sleep(interval)
+
+def inotify_waiter(path, interval):
+    """
+    Returns a function that waits until something is created in or
+    moved into `path` or one of its subdirectories, or until
+    `interval` seconds have passed.
+    """
+    try:
+        from inotify_simple import INotify, flags
+    except ImportError:
+        raise CommandError(
+            'The inotify backend needs the inotify_simple package'
+            ' (pip install inotify_simple)'
+        )
+    inotify = INotify()
+    mask = flags.CREATE | flags.MOVED_TO
+    def wait():
+        # user directories can appear at any time, so watch them afresh
+        inotify.add_watch(path, mask)
+        for name in os.listdir(path):
+            if os.path.isdir(os.path.join(path, name)):
+                inotify.add_watch(os.path.join(path, name), mask)
+        inotify.read(timeout=int(interval * 1000))
+    return wait
+
+WAITERS = {
+    'poll': poll_waiter,
+    'inotify': inotify_waiter,
+}
+
+class Command(BaseCommand):
+    help = ('Watch for uploads, queueing each <input>/<user>/ directory'
+        ' that gets a do_commit file for a pool of workers to import'
+        ' as in upload_projects. The state of each upload is kept in'
+        ' the UploadJob table')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-i',
+            '--input',
+            default='/code/user_upload/',
+            help='directory containing a directory for each user (default /code/user_upload/)'
+        )
+        parser.add_argument(
+            '--backend',
+            choices=WAITERS.keys(),
+            default='poll',
+            help='how to watch for uploads (default poll)'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='seconds between checks for uploads (default 5)'
+        )
+        parser.add_argument(
+            '-w',
+            '--workers',
+            type=int,
+            default=2,
+            help='number of uploads to import at once (default 2)'
+        )
+        parser.add_argument(
+            '-j',
+            '--jobs',
+            type=int,
+            default=4,
+            help='number of image files each worker reads at once (default 4)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            dest='batch_size',
+            type=int,
+            default=100,
+            help='number of images to read and insert at a time (default 100)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='import whatever is waiting, then exit'
+        )
+
+    def handle(self, *args, **options):
+        path = os.path.normpath(options['input'])
+        if not os.path.isdir(path):
+            raise CommandError('No such directory {0}'.format(path))
+        wait = WAITERS[options['backend']](path, options['interval'])
+        self.jobs = options['jobs']
+        self.batch_size = options['batch_size']
+        pool = ThreadPoolExecutor(max_workers=options['workers'])
+        futures = [
+            pool.submit(self.run_job, job_id)
+            for job_id in requeue_interrupted()
+        ]
+        if not options['once'] and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+        self.stdout.write('Watching {0} for uploads'.format(path))
+        try:
+            while True:
+                for job in self.scan(path):
+                    futures.append(pool.submit(self.run_job, job.pk))
+                if options['once']:
+                    break
+                wait()
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping; unstarted uploads stay queued')
+        pool.shutdown(wait=True, cancel_futures=not options['once'])
+        if options['once']:
+            failed = [
+                job for job in (f.result() for f in futures)
+                if job is not None and job.status == 'F'
+            ]
+            if failed:
+                raise CommandError('{0} uploads could not be imported'.format(len(failed)))
+
+    def stop(self, signum, frame):
+        raise KeyboardInterrupt()
+
+    def scan(self, path):
+        """
+        Queues and returns a job for each user directory with a
+        commit file.
+        """
+        jobs = []
+        for name in sorted(os.listdir(path)):
+            user_dir = os.path.join(path, name)
+            commit = os.path.join(user_dir, COMMIT_FILE)
+            if not os.path.isfile(commit):
+                continue
+            try:
+                user = User.objects.get(username=name)
+            except User.DoesNotExist:
+                self.stderr.write('Ignoring upload for unknown user {0}'.format(name))
+                os.rename(commit, commit + '.unknown-user')
+                continue
+            job = queue_drop(user_dir, user)
+            self.stdout.write('Queued upload {0} from {1}'.format(job.pk, name))
+            jobs.append(job)
+        return jobs
+
+    def run_job(self, job_id):
+        job = run_upload_job(job_id, self.jobs, self.batch_size)
+        if job is not None:
+            self.stdout.write('Upload {0} from {1}: {2}'.format(
+                job.pk, job.user.username, job.get_status_display()
+            ))
+        return job
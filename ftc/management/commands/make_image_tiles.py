@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from ftc.image_tiles import build_tiles
+from ftc.models import Image
+
+class Command(BaseCommand):
+    help = ('Make the tile pyramids that the counting viewer loads images'
+        ' from, for every image that does not have them yet')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='check every image, not just those not marked as having tiles'
+        )
+
+    def handle(self, *args, **options):
+        images = Image.objects.all()
+        if not options['all']:
+            images = images.filter(tile_levels__isnull=True)
+        hashes = images.order_by('sha256').values_list(
+            'sha256', flat=True
+        ).distinct()
+        count = 0
+        failed = 0
+        for sha256 in hashes.iterator():
+            if build_tiles(sha256) is None:
+                failed += 1
+            else:
+                count += 1
+        self.stdout.write('Made tiles for {0} image files'.format(count))
+        if failed:
+            self.stderr.write('{0} image files could not be read'.format(failed))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from ftc.image_store import move_blobs_to_store
+
+class Command(BaseCommand):
+    help = ('Move image files out of the database into the image store.'
+        ' Run this after migration 0031_image_store and before'
+        ' 0032_remove_image_data to keep the second migration short')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            dest='batch_size',
+            type=int,
+            default=100,
+            help='number of images to move per transaction (default 100)'
+        )
+
+    def handle(self, *args, **options):
+        count = move_blobs_to_store(
+            connection,
+            options['batch_size'],
+            lambda n: self.stdout.write('Moved {0} images'.format(n))
+        )
+        if count is None:
+            self.stdout.write('All images are already in the image store')
+        else:
+            self.stdout.write('Moved {0} images to the image store'.format(count))
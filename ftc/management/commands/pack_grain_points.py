@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ftc.models import FissionTrackNumbering, PackedGrainPoints
+
+class Command(BaseCommand):
+    help = 'Convert results whose points are stored as GrainPoint rows to packed storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            dest='batch_size',
+            type=int,
+            default=100,
+            help='number of results to convert per transaction (default 100)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        results = FissionTrackNumbering.objects.filter(
+            grainpoint__isnull=False,
+            packed_points__isnull=True
+        ).distinct().order_by('id')
+        count = 0
+        while True:
+            with transaction.atomic():
+                batch = list(results[:batch_size])
+                PackedGrainPoints.objects.bulk_create([
+                    PackedGrainPoints.from_grain_points(ftn)
+                    for ftn in batch
+                ])
+            if not batch:
+                break
+            count += len(batch)
+        self.stdout.write('Packed the points of {0} results'.format(count))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from ftc.summaries import rebuild_summaries
+
+class Command(BaseCommand):
+    help = ('Recalculate the GrainSummary and SampleSummary of every grain'
+        ' and sample from their results and regions, reporting those that'
+        ' were missing or out of date')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='only report summaries that are missing or out of date, failing if there are any'
+        )
+        parser.add_argument(
+            '--batch-size',
+            dest='batch_size',
+            type=int,
+            default=500,
+            help='number of samples to recalculate at a time (default 500)'
+        )
+
+    def handle(self, *args, **options):
+        (grains, samples) = rebuild_summaries(
+            check=options['check'],
+            batch_size=options['batch_size']
+        )
+        if grains:
+            self.stdout.write('Grain summaries out of date: {0}'.format(
+                ', '.join(map(str, grains))
+            ))
+        if samples:
+            self.stdout.write('Sample summaries out of date: {0}'.format(
+                ', '.join(map(str, samples))
+            ))
+        if options['check']:
+            if grains or samples:
+                raise CommandError('{0} grain and {1} sample summaries are out of date'.format(
+                    len(grains), len(samples)
+                ))
+            self.stdout.write('All summaries are up to date')
+        else:
+            self.stdout.write('Updated {0} grain and {1} sample summaries'.format(
+                len(grains), len(samples)
+            ))
@@ -0,0 +1,87 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+from ftc.jobs import work
+import multiprocessing
+import signal
+
+def worker(burst, interval):
+    """
+    Runs jobs until the queue is empty (if `burst`) or until
+    interrupted, finishing the current job first. Returns the number
+    of jobs run.
+    """
+    stop = []
+    def request_stop(signum, frame):
+        stop.append(signum)
+    handlers = {
+        s: signal.signal(s, request_stop)
+        for s in (signal.SIGINT, signal.SIGTERM)
+    }
+    try:
+        return work(burst, interval, lambda: bool(stop))
+    finally:
+        for (s, h) in handlers.items():
+            signal.signal(s, h)
+
+def worker_process(burst, interval):
+    try:
+        worker(burst, interval)
+    finally:
+        connections.close_all()
+
+class Command(BaseCommand):
+    help = ('Run the jobs that have been queued in the Job table, such'
+        ' as making image tiles (with IMAGE_TILES=queue) and deleting'
+        ' projects, samples and grains in the background')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-w',
+            '--workers',
+            type=int,
+            default=2,
+            help='number of worker processes (default 2)'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1,
+            help='seconds to wait before looking again at an empty queue (default 1)'
+        )
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help='exit once there are no jobs ready to run'
+        )
+
+    def handle(self, *args, **options):
+        burst = options['burst']
+        interval = options['interval']
+        if options['workers'] <= 1:
+            count = worker(burst, interval)
+            self.stdout.write('Ran {0} jobs'.format(count))
+            return
+        # The workers must not share this process's connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=worker_process, args=(burst, interval))
+            for _ in range(options['workers'])
+        ]
+        for p in processes:
+            p.start()
+        previous = signal.signal(signal.SIGTERM, self.stop)
+        try:
+            for p in processes:
+                p.join()
+        except KeyboardInterrupt:
+            for p in processes:
+                p.terminate()
+            for p in processes:
+                p.join()
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+        self.stdout.write('Workers finished')
+
+    def stop(self, signum, frame):
+        raise KeyboardInterrupt()
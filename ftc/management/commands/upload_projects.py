@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from ftc.project_import import ProjectImporter
+import os
+
+class Command(BaseCommand):
+    help = ('Import the projects under <input>/<user>/, each a directory'
+        ' of samples, each a directory of Grain<nn> directories holding'
+        ' rois.json and the image files. Each sample is imported in one'
+        ' transaction')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-i',
+            '--input',
+            default='/code/user_upload/',
+            help='directory containing a directory for each user (default /code/user_upload/)'
+        )
+        parser.add_argument(
+            '-u',
+            '--user',
+            default='john',
+            help='name of the user who will own the projects (default john)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            dest='batch_size',
+            type=int,
+            default=100,
+            help='number of images to read and insert at a time (default 100)'
+        )
+        parser.add_argument(
+            '-j',
+            '--jobs',
+            type=int,
+            default=4,
+            help='number of image files to read at once (default 4)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('No such user {0}'.format(options['user']))
+        src = os.path.join(os.path.normpath(options['input']), user.username)
+        with ThreadPoolExecutor(max_workers=options['jobs']) as pool:
+            importer = ProjectImporter(
+                pool, self.stdout, self.stderr, options['batch_size']
+            )
+            failed = importer.import_projects(src, user)
+        if failed:
+            raise CommandError('{0} samples could not be imported'.format(len(failed)))
+        self.stdout.write('finished')
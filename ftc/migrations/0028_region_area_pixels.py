@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-17 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ftc', '0027_region_result'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='region',
+            name='area_pixels',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.5 on 2026-10-17 18:49
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+from ftc.roi_geometry import polygon_area
+
+def pack_vertices(apps, schema_editor):
+    Region = apps.get_model("ftc", "Region")
+    Vertex = apps.get_model("ftc", "Vertex")
+    db_alias = schema_editor.connection.alias
+    by_region = {}
+    vertices = Vertex.objects.using(db_alias).order_by(
+        'region_id', 'id'
+    ).values_list('region_id', 'x', 'y')
+    for (region_id, x, y) in vertices.iterator():
+        by_region.setdefault(region_id, []).append([x, y])
+    regions = []
+    for region in Region.objects.using(db_alias).all():
+        region.vertices = by_region.get(region.pk, [])
+        region.area_pixels = polygon_area(region.vertices)
+        regions.append(region)
+    Region.objects.using(db_alias).bulk_update(
+        regions, ['vertices', 'area_pixels'], batch_size=1000
+    )
+
+def unpack_vertices(apps, schema_editor):
+    Region = apps.get_model("ftc", "Region")
+    Vertex = apps.get_model("ftc", "Vertex")
+    db_alias = schema_editor.connection.alias
+    Vertex.objects.using(db_alias).bulk_create([
+        Vertex(region=region, x=x, y=y)
+        for region in Region.objects.using(db_alias).order_by('id')
+        for (x, y) in region.vertices
+    ], batch_size=1000)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ftc', '0028_region_area_pixels'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='region',
+            name='vertices',
+            field=django.contrib.postgres.fields.ArrayField(base_field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=2), blank=True, default=list, size=None),
+        ),
+        migrations.RunPython(pack_vertices, unpack_vertices),
+        migrations.DeleteModel(
+            name='Vertex',
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.5 on 2026-10-17 18:55
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ftc', '0029_region_vertices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackedGrainPoints',
+            fields=[
+                ('result', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='packed_points', serialize=False, to='ftc.fissiontracknumbering')),
+                ('x_pixels', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+                ('y_pixels', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None)),
+                ('categories', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=20), default=list, size=None)),
+                ('category_index', django.contrib.postgres.fields.ArrayField(base_field=models.SmallIntegerField(), default=list, size=None)),
+                ('comments', models.JSONField(default=dict)),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ftc', '0030_packed_grain_points'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='sha256',
+            field=models.CharField(db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='size',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='width',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='height',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='data',
+            field=models.BinaryField(null=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations, models
+from ftc.image_store import get_image_store, move_blobs_to_store
+
+def move_blobs(apps, schema_editor):
+    move_blobs_to_store(schema_editor.connection)
+
+def restore_blobs(apps, schema_editor):
+    Image = apps.get_model("ftc", "Image")
+    db_alias = schema_editor.connection.alias
+    store = get_image_store()
+    for image in Image.objects.using(db_alias).filter(data__isnull=True).iterator():
+        image.data = store.get(image.sha256)
+        image.save(update_fields=['data'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ftc', '0031_image_store'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_blobs, restore_blobs),
+        migrations.RemoveField(
+            model_name='image',
+            name='data',
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='sha256',
+            field=models.CharField(db_index=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='size',
+            field=models.IntegerField(),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-17 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ftc', '0032_remove_image_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='tile_levels',
+            field=models.SmallIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.5 on 2026-10-17 20:30
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ftc', '0035_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GrainSummary',
+            fields=[
+                ('grain', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='ftc.grain')),
+                ('ns', models.IntegerField(blank=True, null=True)),
+                ('ni', models.IntegerField(blank=True, null=True)),
+                ('result_count', models.IntegerField(default=0)),
+                ('contributor_count', models.IntegerField(default=0)),
+                ('roi_area_pixels', models.FloatField(default=0)),
+                ('roi_area_micron2', models.FloatField(blank=True, null=True)),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SampleSummary',
+            fields=[
+                ('sample', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='ftc.sample')),
+                ('grain_count', models.IntegerField(default=0)),
+                ('counted_grain_count', models.IntegerField(default=0)),
+                ('ns', models.IntegerField(default=0)),
+                ('ni', models.IntegerField(default=0)),
+                ('result_count', models.IntegerField(default=0)),
+                ('contributor_count', models.IntegerField(default=0)),
+                ('roi_area_micron2', models.FloatField(blank=True, null=True)),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
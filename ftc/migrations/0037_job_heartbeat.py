@@ -0,0 +1,25 @@
+# Generated by Django 5.1.5 on 2026-10-17 20:47
+
+from django.db import migrations, models
+from django.db.models import F
+
+def started_as_heartbeat(apps, schema_editor):
+    # so that jobs already running can still be reclaimed
+    Job = apps.get_model("ftc", "Job")
+    db_alias = schema_editor.connection.alias
+    Job.objects.using(db_alias).filter(status='R').update(heartbeat=F('started'))
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ftc', '0036_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(started_as_heartbeat, migrations.RunPython.noop),
+    ]
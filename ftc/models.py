@@ -1,8 +1,15 @@
 from django.db import models
 from django.contrib.auth.models import User, Group
+from django.contrib.postgres.fields import ArrayField
 from django.core.validators import RegexValidator
 from django.urls import reverse
+from django.utils import timezone
 from django_prometheus.models import ExportModelOperationsMixin
+from ftc.image_store import get_image_store, image_metadata
+from ftc.image_tiles import schedule_tiles
+from ftc.roi_geometry import (
+    points_in_polygons, polygon_area, polygon_contains_point
+)
 import json
 import logging
 
@@ -95,6 +102,7 @@ class RegionOfInterest:
     """
     def __init__(self, region_queryset):
         self._regions = region_queryset
+        self._polygons = None
 
     def queryset(self):
         return self._regions
@@ -105,16 +113,28 @@ class RegionOfInterest:
     def exists(self):
         return self._regions.exists()
 
+    def polygons(self):
+        """
+        Returns the vertices of every region in this ROI as a list
+        (one element per region) of lists of (x, y) pairs.
+
+        The regions' packed vertices are fetched in a single query, and
+        the result is cached for the lifetime of this object.
+        """
+        if self._polygons is None:
+            self._polygons = [
+                [(x, y) for (x, y) in vertices]
+                for vertices in self._regions.values_list('vertices', flat=True)
+            ]
+        return self._polygons
+
     def roi_area_pixels(self):
         """
         Find the area of the ROI in pixels.
 
         Currently this does not take account of negative ROI regions.
         """
-        total = 0
-        for r in self._regions:
-            total += r.area()
-        return total
+        return sum(r.area() for r in self._regions)
 
     def roi_contains_point(self, x, y):
         """
@@ -124,11 +144,16 @@ class RegionOfInterest:
         the region-of-interest; a region within a region is counted as
         a hole.
         """
-        count = 0
-        for r in self._regions:
-            if r.contains_point(x, y):
-                count += 1
-        return count % 2 == 1
+        return self.roi_contains_points([(x, y)])[0]
+
+    def roi_contains_points(self, points):
+        """
+        Find which of the points (a list of (x, y) pairs in pixels) are
+        within this Region of Interest, returning a list of booleans.
+
+        Holes are treated as in roi_contains_point.
+        """
+        return points_in_polygons(self.polygons(), points)
 
 
 class Grain(models.Model):
@@ -281,8 +306,8 @@ class FissionTrackNumbering(ExportModelOperationsMixin('result'), models.Model):
 
     def roi_area_pixels(self):
         regions = self.region_set.all()
-        if regions.exists():
-            return sum(map(lambda r: r.area(), regions))
+        if regions:
+            return sum(r.area() for r in regions)
         return self.grain.get_regions_generic().roi_area_pixels()
 
     def roi_area_mm2(self):
@@ -295,23 +320,47 @@ class FissionTrackNumbering(ExportModelOperationsMixin('result'), models.Model):
             return None
         return area_mm2 * 1e6
 
+    def get_packed_points(self):
+        """
+        Returns this result's PackedGrainPoints, or None if its points
+        are stored as individual GrainPoint rows.
+        """
+        try:
+            return self.packed_points
+        except PackedGrainPoints.DoesNotExist:
+            return None
+
     def points(self):
+        packed = self.get_packed_points()
+        if packed is not None:
+            return packed.points()
         return [
             {
                 'x_pixels': gp.x_pixels,
                 'y_pixels': gp.y_pixels,
-                'category': gp.category.name,
+                'category': gp.category_id,
                 'comment': gp.comment
             }
             for gp in self.grainpoint_set.all()
         ]
 
+    def get_track_xys(self):
+        """
+        Returns the (x, y) pixel co-ordinates of the track points.
+        """
+        packed = self.get_packed_points()
+        if packed is not None:
+            return packed.xys('track')
+        return list(self.grainpoint_set.filter(
+            category__name='track'
+        ).values_list('x_pixels', 'y_pixels'))
+
     def get_latlngs(self):
         width = self.grain.image_width
         height = self.grain.image_height
         return [
-            [ (height - gp.y_pixels) / width, gp.x_pixels / width ]
-            for gp in self.grainpoint_set.filter(category__name='track')
+            [ (height - y) / width, x / width ]
+            for (x, y) in self.get_track_xys()
         ]
 
     def get_latlngs_within_roi(self, regions: RegionOfInterest | None):
@@ -324,10 +373,12 @@ class FissionTrackNumbering(ExportModelOperationsMixin('result'), models.Model):
             return self.get_latlngs()
         width = self.grain.image_width
         height = self.grain.image_height
+        points = self.get_track_xys()
+        inside = regions.roi_contains_points(points)
         return [
-            [ (height - gp.y_pixels) / width, gp.x_pixels / width ]
-            for gp in self.grainpoint_set.filter(category__name='track')
-            if regions.roi_contains_point(gp.x_pixels, gp.y_pixels)
+            [ (height - y) / width, x / width ]
+            for ((x, y), is_inside) in zip(points, inside)
+            if is_inside
         ]
 
     @property
@@ -339,7 +390,7 @@ class FissionTrackNumbering(ExportModelOperationsMixin('result'), models.Model):
 
     @latlngs.setter
     def latlngs(self, value : list[list[float]]):
-        self.grainpoint_set.all().delete()
+        self.clear_grain_points()
         self.addGrainPointsFromLatlngs(value)
 
     @property
@@ -348,20 +399,25 @@ class FissionTrackNumbering(ExportModelOperationsMixin('result'), models.Model):
 
     @grainpoints.setter
     def grainpoints(self, value : list[dict[str, any]]):
-        self.grainpoint_set.all().delete()
+        self.clear_grain_points()
         self.addGrainPointsFromGrainPoints(value)
 
+    def clear_grain_points(self):
+        """
+        Removes all the grain points, however they are stored.
+        """
+        self.grainpoint_set.all().delete()
+        PackedGrainPoints.objects.filter(result=self).delete()
+        self.packed_points = None
+
     def addGrainPointsFromLatlngs(self, marker_latlngs : list[list[float]]):
         width = self.grain.image_width
         height = self.grain.image_height
-        track = GrainPointCategory(name='track')
-        GrainPoint.objects.bulk_create([
-            GrainPoint(
-                category=track,
-                result=self,
-                x_pixels=lng * width,
-                y_pixels=height - lat * width
-            )
+        self.addGrainPointsFromGrainPoints([
+            {
+                'x_pixels': lng * width,
+                'y_pixels': height - lat * width
+            }
             for (lat, lng) in marker_latlngs
         ])
 
@@ -372,21 +428,16 @@ class FissionTrackNumbering(ExportModelOperationsMixin('result'), models.Model):
         (0,0) being the top left, `category` being 'track' or one of the
         other category names, and `comment` being a string describing the
         point.
+
+        The points are stored packed; any of this result's points that
+        are still stored as GrainPoint rows are packed first.
         """
-        for p in points:
-            category = p.get('category', 'track')
-            gpc = GrainPointCategory.objects.get(pk=category)
-            if gpc is None:
-                logging.warning('No such category {0}'.format(category))
-                gpc = GrainPointCategory.objects.get(pk='track')
-            gp = GrainPoint(
-                result=self,
-                x_pixels=p['x_pixels'],
-                y_pixels=p['y_pixels'],
-                comment=p.get('comment', ''),
-                category=gpc
-            )
-            gp.save()
+        packed = self.get_packed_points()
+        if packed is None:
+            packed = PackedGrainPoints.from_grain_points(self)
+        packed.extend(points)
+        packed.save()
+        self.packed_points = packed
 
     def get_contained_tracks(self):
         return [
@@ -436,6 +487,9 @@ class FissionTrackNumbering(ExportModelOperationsMixin('result'), models.Model):
         return self.containedtrack_set.count()
 
     def get_track_count(self):
+        packed = self.get_packed_points()
+        if packed is not None:
+            return len(packed.x_pixels)
         return self.grainpoint_set.count()
 
 
@@ -444,44 +498,160 @@ class Region(models.Model):
     # NULL result means this is part of the generic ROI
     # A set result means that this user has specified this ROI for their count.
     result = models.ForeignKey(FissionTrackNumbering, on_delete=models.CASCADE, null=True)
+    # The vertices in order, packed as one array of [x, y] pairs in pixels
+    vertices = ArrayField(
+        ArrayField(models.IntegerField(), size=2),
+        default=list,
+        blank=True
+    )
+    # Area in pixels, denormalized from the vertices.
+    # NULL means it has not been calculated.
+    area_pixels = models.FloatField(null=True, blank=True)
+
+    def normalize(self):
+        """
+        Truncates the vertices to whole pixels (as the old Vertex
+        IntegerFields did) and sets the area they enclose, as save()
+        does; regions made with bulk_create need this called first.
+        Returns the region.
+        """
+        self.vertices = [[int(x), int(y)] for (x, y) in self.vertices]
+        self.area_pixels = polygon_area(self.vertices)
+        return self
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the region, truncating the vertices to whole pixels and
+        storing the area they enclose.
+        """
+        self.normalize()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'vertices' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'area_pixels'}
+        super().save(*args, **kwargs)
+
+    @property
+    def vertex_set(self):
+        """
+        The vertices as Vertex objects, for code written against the
+        old one-row-per-vertex storage.
+        """
+        return VertexSet(self)
+
+    def get_vertices(self):
+        """ Returns the region's vertices as a list of (x, y) pairs """
+        return [(x, y) for (x, y) in self.vertices]
 
     def area(self):
-        """ Returns the region's area in pixels """
-        vs = list(self.vertex_set.all())
-        vs.sort(key=lambda v: v.pk)
-        n = len(vs)
-        if n == 0:
-            return 0
-        last_v = vs[n - 1]
-        total = 0
-        for v in vs:
-            total += v.x * last_v.y - last_v.x * v.y
-            last_v = v
-        return abs(total / 2)
+        """
+        Returns the region's area in pixels.
+
+        The stored area is used if there is one, otherwise it is
+        calculated from the vertices.
+        """
+        if self.area_pixels is None:
+            return polygon_area(self.vertices)
+        return self.area_pixels
 
     def contains_point(self, x, y):
         """Find if the point at (x,y) pixels is contained within this region"""
-        vs = list(self.vertex_set.all())
-        vs.sort(key=lambda v: v.pk)
-        n = len(vs)
-        if n == 0:
-            return 0
-        last_v = vs[n - 1]
-        total = 0
-        for v in vs:
-            if (
-                ((v.x <= x and x < last_v.x) or (last_v.x <= x and x < v.x))
-                and (y < last_v.y + (v.y - last_v.y) * (x - last_v.x) / (v.x - last_v.x))
-            ):
-                total += 1
-            last_v = v
-        return total % 2 == 1
+        return polygon_contains_point(self.get_vertices(), x, y)
 
 #
-class Vertex(models.Model):
-    region = models.ForeignKey(Region, on_delete=models.CASCADE)
-    x = models.IntegerField()
-    y = models.IntegerField()
+class Vertex:
+    """
+    One vertex of a Region.
+
+    Vertices used to be stored one per row; now they are packed into
+    Region.vertices. This class keeps the old interface working:
+    Vertex(region=r, x=x, y=y).save() appends a vertex to the region,
+    and changing x or y of a vertex from region.vertex_set (or
+    Vertex.objects.filter(region=r)) then calling save() or delete()
+    rewrites the region's array. Each save() or delete() writes the
+    whole region, so new code should set Region.vertices directly.
+    """
+    def __init__(self, region=None, x=0, y=0, index=None):
+        self.region = region
+        self.x = x
+        self.y = y
+        # position within region.vertices, None if not yet saved
+        self.index = index
+
+    @property
+    def pk(self):
+        return self.index
+
+    @property
+    def id(self):
+        return self.index
+
+    def save(self):
+        vertices = self.region.vertices
+        if self.index is None:
+            self.index = len(vertices)
+            vertices.append([self.x, self.y])
+        else:
+            vertices[self.index] = [self.x, self.y]
+        self.region.save()
+
+    def delete(self):
+        del self.region.vertices[self.index]
+        self.index = None
+        self.region.save()
+
+class VertexSet:
+    """
+    The vertices of one Region, offering the parts of the queryset
+    interface that used to be used with region.vertex_set.
+
+    The vertices are always in order, so order_by('id') has no effect.
+    """
+    def __init__(self, region):
+        self.region = region
+
+    def __iter__(self):
+        return iter([
+            Vertex(region=self.region, x=x, y=y, index=i)
+            for (i, (x, y)) in enumerate(self.region.vertices)
+        ])
+
+    def __len__(self):
+        return len(self.region.vertices)
+
+    def all(self):
+        return self
+
+    def order_by(self, *fields):
+        return self
+
+    def iterator(self):
+        return iter(self)
+
+    def count(self):
+        return len(self)
+
+    def exists(self):
+        return 0 < len(self)
+
+    def first(self):
+        return next(iter(self), None)
+
+    def create(self, x, y):
+        vertex = Vertex(region=self.region, x=x, y=y)
+        vertex.save()
+        return vertex
+
+class VertexManager:
+    """
+    Stands in for Vertex.objects.
+    """
+    def filter(self, region):
+        return VertexSet(region)
+
+    def create(self, region, x, y):
+        return VertexSet(region).create(x, y)
+
+Vertex.objects = VertexManager()
 
 #
 class Image(ExportModelOperationsMixin('image'), models.Model):
@@ -501,13 +671,63 @@ class Image(ExportModelOperationsMixin('image'), models.Model):
     format = models.CharField(max_length=1, choices=IMAGE_FORMAT)
     ft_type = models.CharField(max_length=1, choices=FT_TYPE)
     index = models.IntegerField()
-    data = models.BinaryField()
+    # The file's content is kept in the image store, named by this hash
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.IntegerField()
+    # NULL if the image format was not recognized
+    width = models.IntegerField(null=True)
+    height = models.IntegerField(null=True)
     light_path = models.CharField(max_length=1, choices=LIGHT_PATH, null=True)
     focus = models.FloatField(null=True)
+    # Zoom level of the full-size tiles in the image store, or NULL
+    # if the tiles have not been made (yet)
+    tile_levels = models.SmallIntegerField(null=True, blank=True)
 
     class Meta:
         unique_together = ('grain', 'index', 'ft_type')
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if self.tile_levels is None:
+            schedule_tiles(self.sha256)
+
+    @property
+    def data(self):
+        """ The content of the image file, read from the image store """
+        return get_image_store().get(self.sha256)
+
+    @data.setter
+    def data(self, value : bytes):
+        """
+        Stores `value` as the content of the image file, setting
+        `sha256`, `size`, `width` and `height` to match.
+        """
+        for (k, v) in image_metadata(value).items():
+            setattr(self, k, v)
+        self.tile_levels = get_image_store().tile_levels(self.sha256)
+
+    def get_absolute_url(self):
+        """
+        The URL of the image file, including its hash so that it
+        changes whenever the content does.
+        """
+        return '{0}?v={1}'.format(
+            reverse('get_image', args=[self.pk]), self.sha256
+        )
+
+    def get_tile_url_template(self):
+        """
+        The URL of the image's tiles, with {z}, {x} and {y} to be
+        replaced with the tile's zoom level and position.
+        """
+        return '{0}tiles/{{z}}/{{x}}/{{y}}.jpg?v={1}'.format(
+            reverse('get_image', args=[self.pk]), self.sha256
+        )
+
+    def open(self):
+        """ Returns a binary file object reading the image file """
+        return get_image_store().open(self.sha256)
+
     def get_owner(self):
         return self.grain.get_owner()
 
@@ -544,6 +764,108 @@ class GrainPoint(models.Model):
     category = models.ForeignKey(GrainPointCategory, on_delete=models.CASCADE)
     comment = models.TextField()
 
+class PackedGrainPoints(models.Model):
+    """
+    All the markers of one result, stored as parallel arrays rather
+    than as one GrainPoint row each.
+
+    Point i is at (x_pixels[i], y_pixels[i]) and has the category
+    named categories[category_index[i]]. Only non-empty comments are
+    stored, in `comments`, keyed by the point's index as a string.
+    """
+    result = models.OneToOneField(
+        FissionTrackNumbering,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='packed_points'
+    )
+    x_pixels = ArrayField(models.IntegerField(), default=list)
+    y_pixels = ArrayField(models.IntegerField(), default=list)
+    categories = ArrayField(models.CharField(max_length=20), default=list)
+    category_index = ArrayField(models.SmallIntegerField(), default=list)
+    comments = models.JSONField(default=dict)
+
+    @classmethod
+    def from_grain_points(cls, result):
+        """
+        Returns a new (unsaved) PackedGrainPoints holding the result's
+        GrainPoint rows, which are deleted.
+        """
+        packed = cls(result=result)
+        gps = result.grainpoint_set.order_by('id')
+        packed.extend([
+            {
+                'x_pixels': gp.x_pixels,
+                'y_pixels': gp.y_pixels,
+                'category': gp.category_id,
+                'comment': gp.comment
+            }
+            for gp in gps
+        ])
+        gps.delete()
+        return packed
+
+    def extend(self, points : list[dict[str, any]]):
+        """
+        Appends points in the form accepted by
+        FissionTrackNumbering.addGrainPointsFromGrainPoints
+        """
+        indices = {
+            name: index for (index, name) in enumerate(self.categories)
+        }
+        new_names = set(
+            p.get('category', 'track') for p in points
+        ).difference(indices)
+        if new_names:
+            found = GrainPointCategory.objects.filter(name__in=new_names)
+            missing = new_names.difference(found.values_list('name', flat=True))
+            if missing:
+                raise GrainPointCategory.DoesNotExist(
+                    'No such category {0}'.format(', '.join(sorted(missing)))
+                )
+        for p in points:
+            category = p.get('category', 'track')
+            if category not in indices:
+                indices[category] = len(self.categories)
+                self.categories.append(category)
+            comment = p.get('comment', '')
+            if comment:
+                self.comments[str(len(self.x_pixels))] = comment
+            # truncated, as GrainPoint's IntegerFields did
+            self.x_pixels.append(int(p['x_pixels']))
+            self.y_pixels.append(int(p['y_pixels']))
+            self.category_index.append(indices[category])
+
+    def points(self):
+        """
+        Returns the points as dicts with `x_pixels`, `y_pixels`,
+        `category` and `comment` elements.
+        """
+        return [
+            {
+                'x_pixels': x,
+                'y_pixels': y,
+                'category': self.categories[c],
+                'comment': self.comments.get(str(i), '')
+            }
+            for (i, (x, y, c)) in enumerate(zip(
+                self.x_pixels, self.y_pixels, self.category_index
+            ))
+        ]
+
+    def xys(self, category):
+        """
+        Returns the (x, y) co-ordinates of the points in the category
+        """
+        if category not in self.categories:
+            return []
+        c = self.categories.index(category)
+        return [
+            (x, y)
+            for (x, y, ci) in zip(self.x_pixels, self.y_pixels, self.category_index)
+            if ci == c
+        ]
+
 class TutorialPage(models.Model):
     """
     A page of the tutorial
@@ -573,3 +895,106 @@ class ContainedTrack(models.Model):
     x2_pixels = models.IntegerField()
     y2_pixels = models.IntegerField()
     z2_level = models.IntegerField()
+
+class GrainSummary(models.Model):
+    """
+    Totals of a grain's results and its ROI, kept up to date by
+    ftc.summaries as results and regions are saved.
+    """
+    grain = models.OneToOneField(
+        Grain,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='summary'
+    )
+    # The project owner's counts, as Grain.owners_result_of returns
+    # them: None if not started, -1 if not yet submitted
+    ns = models.IntegerField(null=True, blank=True)
+    ni = models.IntegerField(null=True, blank=True)
+    # Submitted results, and those of them not made by guest
+    result_count = models.IntegerField(default=0)
+    contributor_count = models.IntegerField(default=0)
+    # Area of the generic ROI; in square microns only if the grain has a scale
+    roi_area_pixels = models.FloatField(default=0)
+    roi_area_micron2 = models.FloatField(null=True, blank=True)
+    updated = models.DateTimeField(default=timezone.now)
+
+class SampleSummary(models.Model):
+    """
+    Totals of the GrainSummary objects of a sample's grains.
+    """
+    sample = models.OneToOneField(
+        Sample,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='summary'
+    )
+    grain_count = models.IntegerField(default=0)
+    # Grains with submitted counts from the project owner, and their totals
+    counted_grain_count = models.IntegerField(default=0)
+    ns = models.IntegerField(default=0)
+    ni = models.IntegerField(default=0)
+    result_count = models.IntegerField(default=0)
+    # Users other than guest with a submitted result in the sample
+    contributor_count = models.IntegerField(default=0)
+    # Total of the grains' ROI areas, leaving out grains with no scale
+    roi_area_micron2 = models.FloatField(null=True, blank=True)
+    updated = models.DateTimeField(default=timezone.now)
+
+class UploadJob(models.Model):
+    """
+    A directory of projects dropped into user_upload, waiting to be
+    (or having been) imported by the ingest_uploads command.
+    """
+    STATUS = (
+        ('Q', 'Queued'),
+        ('R', 'Running'),
+        ('D', 'Done'),
+        ('F', 'Failed'),
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    path = models.CharField(max_length=1024)
+    status = models.CharField(max_length=1, choices=STATUS, default='Q')
+    queued = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    log = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'queued'])]
+
+class Job(models.Model):
+    """
+    A task to be run outside any request by the runworkers command;
+    see ftc.jobs.
+    """
+    STATUS = (
+        ('Q', 'Queued'),
+        ('R', 'Running'),
+        ('D', 'Done'),
+        ('F', 'Failed'),
+    )
+    task = models.CharField(max_length=64)
+    args = models.JSONField(default=dict, blank=True)
+    owner = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    status = models.CharField(max_length=1, choices=STATUS, default='Q')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    # when the worker running the job last said it was still running it
+    heartbeat = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def get_owner(self):
+        return self.owner
+
+    @classmethod
+    def filter_owned_by(cls, qs, user):
+        return qs.filter(owner=user)
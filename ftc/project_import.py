@@ -0,0 +1,151 @@
+from django.db import transaction
+from django.db.models.aggregates import Max
+from ftc.apiviews import GrainSerializer
+from ftc.image_tiles import schedule_tiles
+from ftc.models import Project, Grain, Image
+from ftc.parse_image_name import parse_upload_name
+from ftc.save_rois_regions import save_rois_regions
+from geochron.gah.gah import parse_metadata_image
+import json
+import os
+import time
+
+def sorted_dirs(path):
+    return [
+        (name, os.path.join(path, name))
+        for name in sorted(os.listdir(path))
+        if not name.startswith('.')
+        and os.path.isdir(os.path.join(path, name))
+    ]
+
+def read_image(grain, path, info):
+    """
+    Returns an unsaved Image of `grain` for the image file at `path`
+    (whose name parses to `info`), having put its content in the image
+    store.
+    """
+    image = Image(
+        grain=grain,
+        format=info['format'],
+        ft_type=info['ft_type'],
+        index=info['index']
+    )
+    with open(path, 'rb') as fh:
+        image.data = fh.read()
+    meta = path + '_metadata.xml'
+    if os.path.isfile(meta):
+        m = parse_metadata_image(meta)
+        image.light_path = m['light_path']
+        image.focus = m['focus']
+    return image
+
+class ProjectImportError(Exception):
+    pass
+
+class ProjectImporter:
+    """
+    Imports directories of projects, each a directory of samples, each
+    a directory of Grain<nn> directories holding rois.json and the
+    image files. Each sample is imported in one transaction. `pool`
+    is an executor used to read the image files, and progress is
+    written to the streams `stdout` and `stderr`.
+    """
+    def __init__(self, pool, stdout, stderr, batch_size=100):
+        self.pool = pool
+        self.stdout = stdout
+        self.stderr = stderr
+        self.batch_size = batch_size
+
+    def import_projects(self, src, user):
+        """
+        Imports each directory in `src` as a project owned by `user`,
+        returning the paths of the samples that failed. A project is
+        only created with its first sample to import successfully, so
+        a project none of whose samples import is not left behind.
+        """
+        failed = []
+        for (name, path) in sorted_dirs(src):
+            project = None
+            for (sample_name, sample_path) in sorted_dirs(path):
+                try:
+                    with transaction.atomic():
+                        p = project or Project.objects.create(
+                            project_name=name,
+                            creator=user,
+                            project_description='project ' + name,
+                            closed=False
+                        )
+                        self.import_sample(p, sample_name, sample_path)
+                except Exception as e:
+                    self.stderr.write('Sample {0} of project {1} failed: {2}'.format(
+                        sample_name, name, e
+                    ))
+                    failed.append(sample_path)
+                    continue
+                if project is None:
+                    project = p
+                    self.stdout.write('Project "{0}" created by {1}'.format(
+                        name, user.username
+                    ))
+        return failed
+
+    def import_sample(self, project, name, path):
+        start = time.monotonic()
+        sample = project.sample_set.create(
+            sample_name=name,
+            sample_property='T',
+            completed=False
+        )
+        grain_count = 0
+        image_count = 0
+        byte_count = 0
+        for (grain_name, grain_path) in sorted_dirs(path):
+            if grain_name[0:5] != 'Grain':
+                continue
+            grain = self.create_grain(sample, grain_name, grain_path)
+            grain_count += 1
+            files = [
+                (os.path.join(grain_path, n), info)
+                for (n, info) in (
+                    (n, parse_upload_name(n)) for n in sorted(os.listdir(grain_path))
+                )
+                if info is not None and info['is_image']
+                and os.path.isfile(os.path.join(grain_path, n))
+            ]
+            for b in range(0, len(files), self.batch_size):
+                images = list(self.pool.map(
+                    lambda f: read_image(grain, f[0], f[1]),
+                    files[b:b + self.batch_size]
+                ))
+                Image.objects.bulk_create(images)
+                for image in images:
+                    if image.tile_levels is None:
+                        schedule_tiles(image.sha256)
+                image_count += len(images)
+                byte_count += sum(image.size for image in images)
+        elapsed = max(time.monotonic() - start, 1e-6)
+        self.stdout.write(
+            'Sample {0}: {1} grains, {2} images ({3:.1f} MB) in {4:.2f}s'
+            ' ({5:.1f} images/s, {6:.2f} MB/s)'.format(
+                name, grain_count, image_count, byte_count / 1e6, elapsed,
+                image_count / elapsed, byte_count / 1e6 / elapsed
+            )
+        )
+
+    def create_grain(self, sample, name, path):
+        p = os.path.join(path, 'rois.json')
+        if not os.path.isfile(p):
+            raise ProjectImportError('no such grain file {0}'.format(p))
+        with open(p) as fh:
+            rois = json.load(fh)
+        try:
+            index = int(name[5:])
+        except ValueError:
+            index = (sample.grain_set.aggregate(Max('index'))['index__max'] or 0) + 1
+        grain = Grain.objects.create(
+            sample=sample,
+            index=index,
+            **GrainSerializer.rois_fields(rois)
+        )
+        save_rois_regions(rois, grain)
+        return grain
@@ -0,0 +1,63 @@
+from bisect import bisect_left
+
+def polygon_area(vertices):
+    """
+    Returns the area of the polygon with the given vertices (a list of
+    (x, y) pairs in order) using the shoelace formula.
+    """
+    n = len(vertices)
+    if n == 0:
+        return 0
+    (last_x, last_y) = vertices[n - 1]
+    total = 0
+    for (x, y) in vertices:
+        total += x * last_y - last_x * y
+        last_x = x
+        last_y = y
+    return abs(total / 2)
+
+def polygon_contains_point(vertices, x, y):
+    """
+    Find if the point at (x,y) is contained within the polygon with
+    the given vertices (a list of (x, y) pairs in order).
+    """
+    return points_in_polygons([vertices], [(x, y)])[0]
+
+def points_in_polygons(polygons, points):
+    """
+    Classifies many points against many polygons at once.
+
+    `polygons` is a list of polygons, each a list of (x, y) vertex pairs.
+    `points` is a list of (x, y) pairs.
+
+    Returns a list of booleans, one per point, True if the point is
+    within an odd number of the polygons (so a polygon within another
+    polygon counts as a hole), using the even-odd rule.
+
+    The points are sorted by x once, and each polygon edge only visits
+    the points that lie within its x-range, so the cost is proportional
+    to the number of edges plus the number of edge crossings rather than
+    to the number of edges times the number of points.
+    """
+    order = sorted(range(len(points)), key=lambda i: points[i][0])
+    xs = [points[i][0] for i in order]
+    inside = [False] * len(points)
+    for vertices in polygons:
+        n = len(vertices)
+        if n == 0:
+            continue
+        (last_x, last_y) = vertices[n - 1]
+        for (vx, vy) in vertices:
+            if vx != last_x:
+                lo = bisect_left(xs, min(vx, last_x))
+                hi = bisect_left(xs, max(vx, last_x))
+                dy = vy - last_y
+                dx = vx - last_x
+                for j in range(lo, hi):
+                    i = order[j]
+                    (px, py) = points[i]
+                    if py < last_y + dy * (px - last_x) / dx:
+                        inside[i] = not inside[i]
+            last_x = vx
+            last_y = vy
+    return inside
@@ -1,10 +1,18 @@
-from ftc.models import Region, Vertex
+from ftc.models import Region
+
+def save_regions(grain, vertex_lists, result=None):
+    """
+    Creates a region of `grain` (part of the count `result` if given,
+    otherwise of the generic ROI) for each list of [x, y] vertices in
+    `vertex_lists`, all in one query. Returns the new regions.
+    """
+    return Region.objects.bulk_create([
+        Region(grain=grain, result=result, vertices=vertices).normalize()
+        for vertices in vertex_lists
+    ])
 
 def save_rois_regions(rois, grain):
-    for r in rois['regions']:
-        if 'vertices' in r:
-            region = Region(grain=grain)
-            region.save()
-            for v in r['vertices']:
-                vertex = Vertex(region=region, x=v[0], y=v[1])
-                vertex.save()
+    return save_regions(
+        grain,
+        [r['vertices'] for r in rois['regions'] if 'vertices' in r]
+    )
@@ -8,6 +8,18 @@
  * grain_info.shift_y The y-difference in pixels of the Mica layers from the crystal layers
  * grain_info.scale_x Meters per pixel, if known
  * grain_info.images Array of URLs to the z-stack images
+ * grain_info.bundle (optional) URL returning all the z-stack images in one
+ *  multipart response (with the images in the same order as `images`).
+ *  If present (and `tiles` is not), the images are fetched from here in one
+ *  request instead of one request each.
+ * grain_info.tiles (optional) Array of the tile pyramids of the z-stack
+ *  images, or null if they are not all available. If present, the images
+ *  are shown by loading just the visible tiles. Objects with keys:
+ * - url: URL template of the tiles with {z}, {x} and {y} placeholders
+ * - levels: the zoom level of the full-size tiles; each level below
+ *   halves the width and height (rounding up), level 0 being one tile
+ * - width: width of the full-size image in pixels
+ * - height: height of the full-size image in pixels
  * grain_info.indices Array of indices corresponding to the images. A contained track will
  *  have its z co-ordinate matching an index in this array.
  * grain_info.marker_latlngs Array of marker positions, instead of `points`
@@ -821,8 +833,187 @@ function grain_view(options) {
         }
     };
 
+    // A layer showing one image of the z-stack from its tile pyramid
+    // (see grain_info.tiles), loading only the tiles covering the visible
+    // part of the image, from the smallest level that is at least as
+    // detailed as the screen. The tiles of the previous view are kept
+    // until the new ones have loaded, so that the image never blanks out.
+    var TiledImage = L.Layer.extend({
+        initialize: function(tiles, bounds) {
+            this._tiles = tiles;
+            this._bounds = L.latLngBounds(bounds);
+            this._shown = {};
+            // keys of the tiles in _shown that have not loaded yet
+            this._pending = {};
+            this._wanted = {};
+        },
+        onAdd: function() {
+            this._map.on('moveend', this._update, this);
+            this._update();
+        },
+        onRemove: function(map) {
+            map.off('moveend', this._update, this);
+            for (var key in this._shown) {
+                this._shown[key].removeFrom(map);
+            }
+            this._shown = {};
+            this._pending = {};
+        },
+        _update: function() {
+            var map = this._map;
+            var tiles = this._tiles;
+            var zoom = map.getZoom();
+            // Map pixel positions of the corners of the image
+            var nw = map.project(this._bounds.getNorthWest(), zoom);
+            var se = map.project(this._bounds.getSouthEast(), zoom);
+            var screenWidth = (se.x - nw.x) * (window.devicePixelRatio || 1);
+            var level = tiles.levels;
+            while (0 < level && screenWidth <= Math.ceil(
+                tiles.width / Math.pow(2, tiles.levels - level + 1)
+            )) {
+                level -= 1;
+            }
+            var scale = Math.pow(2, tiles.levels - level);
+            var levelWidth = Math.ceil(tiles.width / scale);
+            var levelHeight = Math.ceil(tiles.height / scale);
+            // Visible part of the image, in pixels of this level
+            var view = map.getPixelBounds();
+            function clamp(v, max) {
+                return Math.min(Math.max(v, 0), max);
+            }
+            var x0 = clamp((view.min.x - nw.x) / (se.x - nw.x) * levelWidth, levelWidth);
+            var x1 = clamp((view.max.x - nw.x) / (se.x - nw.x) * levelWidth, levelWidth);
+            var y0 = clamp((view.min.y - nw.y) / (se.y - nw.y) * levelHeight, levelHeight);
+            var y1 = clamp((view.max.y - nw.y) / (se.y - nw.y) * levelHeight, levelHeight);
+            var wanted = {};
+            var self = this;
+            function loaded(key) {
+                return function() {
+                    if (key in self._pending) {
+                        delete self._pending[key];
+                        self._removeUnwantedIfLoaded();
+                    }
+                };
+            }
+            for (var x = Math.floor(x0 / TILE_SIZE); x * TILE_SIZE < x1; ++x) {
+                for (var y = Math.floor(y0 / TILE_SIZE); y * TILE_SIZE < y1; ++y) {
+                    var key = level + '/' + x + '/' + y;
+                    wanted[key] = true;
+                    if (key in this._shown) {
+                        continue;
+                    }
+                    // The corners of the tile, placed between the map pixel
+                    // positions of the image's corners just as a whole-image
+                    // overlay would be
+                    var tileNw = map.unproject(L.point(
+                        nw.x + (se.x - nw.x) * x * TILE_SIZE / levelWidth,
+                        nw.y + (se.y - nw.y) * y * TILE_SIZE / levelHeight
+                    ), zoom);
+                    var tileSe = map.unproject(L.point(
+                        nw.x + (se.x - nw.x) * Math.min((x + 1) * TILE_SIZE, levelWidth) / levelWidth,
+                        nw.y + (se.y - nw.y) * Math.min((y + 1) * TILE_SIZE, levelHeight) / levelHeight
+                    ), zoom);
+                    var url = L.Util.template(tiles.url, { z: level, x: x, y: y });
+                    var overlay = L.imageOverlay(url, [tileNw, tileSe]);
+                    this._pending[key] = true;
+                    overlay.once('load error', loaded(key));
+                    overlay.addTo(map);
+                    overlay.getElement().classList.add("image-crystal");
+                    this._shown[key] = overlay;
+                }
+            }
+            this._wanted = wanted;
+            // Tiles still loading that are no longer wanted can go now
+            for (var key in this._pending) {
+                if (!(key in wanted)) {
+                    this._removeTile(key);
+                }
+            }
+            this._removeUnwantedIfLoaded();
+        },
+        _removeUnwantedIfLoaded: function() {
+            if (Object.keys(this._pending).length !== 0) {
+                return;
+            }
+            for (var key in this._shown) {
+                if (!(key in this._wanted)) {
+                    this._removeTile(key);
+                }
+            }
+        },
+        _removeTile: function(key) {
+            this._shown[key].removeFrom(this._map);
+            delete this._shown[key];
+            delete this._pending[key];
+        }
+    });
+
+    // Splits the bytes of a multipart response into its parts, each an
+    // object with the part's `type` and its `body` (a Uint8Array). Each
+    // part must have a Content-Length header.
+    function splitMultipart(bytes) {
+        var parts = [];
+        var pos = 0;
+        function readLine() {
+            var end = pos;
+            while (end + 1 < bytes.length
+                && !(bytes[end] === 13 && bytes[end + 1] === 10)) {
+                ++end;
+            }
+            var line = String.fromCharCode.apply(null, bytes.subarray(pos, end));
+            pos = end + 2;
+            return line;
+        }
+        while (pos < bytes.length) {
+            var delimiter = readLine();
+            if (delimiter.endsWith('--')) {
+                break;
+            }
+            var headers = {};
+            for (var line = readLine(); line !== ''; line = readLine()) {
+                var colon = line.indexOf(':');
+                headers[line.slice(0, colon).trim().toLowerCase()] =
+                    line.slice(colon + 1).trim();
+            }
+            var length = parseInt(headers['content-length']);
+            if (isNaN(length)) {
+                throw new Error('multipart part has no Content-Length');
+            }
+            parts.push({
+                type: headers['content-type'],
+                body: bytes.subarray(pos, pos + length)
+            });
+            pos += length + 2;
+        }
+        return parts;
+    }
+
+    // Fetches the z-stack images from the bundle URL (see grain_info.bundle)
+    // and calls callback with an array of (object) URLs of the images, or
+    // null if the bundle could not be fetched.
+    function fetchBundle(url, imageCount, callback) {
+        fetch(url, { credentials: 'same-origin' }).then(function(response) {
+            if (!response.ok) {
+                throw new Error('bundle request failed: ' + response.status);
+            }
+            return response.arrayBuffer();
+        }).then(function(buffer) {
+            // The first part is the images' metadata
+            var parts = splitMultipart(new Uint8Array(buffer)).slice(1);
+            if (parts.length !== imageCount) {
+                throw new Error('bundle has the wrong number of images');
+            }
+            return parts.map(function(part) {
+                return URL.createObjectURL(new Blob([part.body], { type: part.type }));
+            });
+        }).then(callback, function(e) {
+            console.log(e);
+            callback(null);
+        });
+    }
+
     function makeZStack(
-        map, images, imageCount, yOverX, rois
+        map, images, tiles, bundle, imageCount, yOverX, rois
     ) {
         // Callbacks for when the focused layer changes
         var focus_callbacks = [];
@@ -832,22 +1023,41 @@ function grain_view(options) {
             [yOverX, 1.0]
         ];
         var imageOverlayers = new Array();
-        for (var i = 0; i < images.length; i++) {
-            imageOverlayers[i] = new L.imageOverlay(
-                images[i], bounds
-            ).addTo(map);
-            imageOverlayers[i].getElement().classList.add("image-crystal");
-        }
         var layerCurrent = 0;
         var layerRendered = 0;
-        // Try to ensure images are in the cache so appear instantly, unsure of a better solution
-        setTimeout(function() {
-            imageOverlayers.forEach(function(imageOverlay, i) {
-                if (imageOverlay && i !== layerRendered) {
-                    imageOverlay.removeFrom(map);
-                }
+        if (tiles) {
+            // Only the tiles of the layer shown are loaded
+            for (var i = 0; i < tiles.length; i++) {
+                imageOverlayers[i] = new TiledImage(tiles[i], bounds);
+            }
+        } else if (bundle) {
+            // Fetch all the images in one request; they are then all in
+            // memory, so the overlays are only made once they have arrived.
+            // If that fails, fetch them one by one.
+            fetchBundle(bundle, images.length, function(urls) {
+                (urls || images).forEach(function(url, i) {
+                    imageOverlayers[i] = new L.imageOverlay(
+                        url, bounds, { className: "image-crystal" }
+                    );
+                });
+                add_current_layer();
             });
-        }, 1000);
+        } else {
+            for (var i = 0; i < images.length; i++) {
+                imageOverlayers[i] = new L.imageOverlay(
+                    images[i], bounds
+                ).addTo(map);
+                imageOverlayers[i].getElement().classList.add("image-crystal");
+            }
+            // Try to ensure images are in the cache so appear instantly, unsure of a better solution
+            setTimeout(function() {
+                imageOverlayers.forEach(function(imageOverlay, i) {
+                    if (imageOverlay && i !== layerRendered) {
+                        imageOverlay.removeFrom(map);
+                    }
+                });
+            }, 1000);
+        }
         var rois_layer = L.polygon(rois, {
             color: 'white',
             opacity: 1.0,
@@ -1119,7 +1329,8 @@ function grain_view(options) {
     var height = grain_info.image_height;
     var yOverX = height / width;
     zStack = makeZStack(
-        map, grain_info.images, sliderNum, yOverX, grain_info.rois
+        map, grain_info.images, grain_info.tiles, grain_info.bundle,
+        sliderNum, yOverX, grain_info.rois
     );
     markers = makeMarkers(map);
     selector = markers.makeSelector();
@@ -0,0 +1,43 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.middleware.gzip import re_accepts_gzip
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+import json
+
+class Echo:
+    """
+    A file-like object whose write() returns what it is given, so that
+    csv.writer can make lines for a streaming response.
+    """
+    def write(self, value):
+        return value
+
+def json_array_chunks(items):
+    """
+    Yields the JSON encoding of an array of `items`, one item at a
+    time, so that only one item need be in memory at once.
+    """
+    yield b'['
+    separator = b''
+    for item in items:
+        yield separator + json.dumps(item, cls=DjangoJSONEncoder).encode()
+        separator = b','
+    yield b']'
+
+def streaming_json_response(request, items):
+    """
+    Returns a response streaming the JSON array of `items`, which can
+    be a generator, compressed as it goes if the client accepts gzip.
+    """
+    chunks = json_array_chunks(items)
+    accepts = request.headers.get('Accept-Encoding', '')
+    gzip = bool(re_accepts_gzip.search(accepts))
+    response = StreamingHttpResponse(
+        compress_sequence(chunks) if gzip else chunks,
+        content_type='application/json'
+    )
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
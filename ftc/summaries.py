@@ -0,0 +1,247 @@
+"""
+GrainSummary and SampleSummary hold the totals that the sample, report
+and public pages show, so that those pages need not read every result.
+Whatever saves or deletes results or regions calls refresh_summaries()
+for the grains it touched, which recalculates just those grains and
+their samples. Grains that have never been summarised (such as new
+grains) get their summaries when ensure_summaries() is called for
+their samples, and the rebuild_summaries command recalculates (or
+checks) everything.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from ftc.models import (
+    FissionTrackNumbering, Grain, GrainSummary, Region, Sample, SampleSummary
+)
+
+GRAIN_FIELDS = [
+    'ns', 'ni', 'result_count', 'contributor_count',
+    'roi_area_pixels', 'roi_area_micron2'
+]
+SAMPLE_FIELDS = [
+    'grain_count', 'counted_grain_count', 'ns', 'ni', 'result_count',
+    'contributor_count', 'roi_area_micron2'
+]
+
+def grain_summaries(grain_ids):
+    """
+    Returns unsaved GrainSummary objects for the grains with IDs in
+    `grain_ids`, calculated from their results and regions, keyed by
+    grain ID. Each has the grain's sample_id as an extra attribute.
+    """
+    now = timezone.now()
+    summaries = {}
+    scales = {}
+    grains = Grain.objects.filter(pk__in=grain_ids).values_list(
+        'pk', 'sample_id', 'scale_x', 'scale_y'
+    )
+    for (pk, sample_id, scale_x, scale_y) in grains:
+        summary = GrainSummary(grain_id=pk, updated=now)
+        summary.sample_id = sample_id
+        summaries[pk] = summary
+        scales[pk] = (scale_x, scale_y)
+    counts = FissionTrackNumbering.objects.filter(
+        grain__in=grain_ids,
+        result__gte=0
+    ).order_by().values('grain').annotate(
+        results=Count('pk'),
+        contributors=Count('pk', filter=~Q(worker__username='guest'))
+    ).values_list('grain', 'results', 'contributors')
+    for (grain_id, results, contributors) in counts:
+        summaries[grain_id].result_count = results
+        summaries[grain_id].contributor_count = contributors
+    # Latest first, so that the owner's first result is the one kept,
+    # as with Grain.owners_result_of
+    owners = FissionTrackNumbering.objects.filter(
+        grain__in=grain_ids,
+        worker=F('grain__sample__in_project__creator')
+    ).order_by('-pk').values_list('grain', 'ft_type', 'result')
+    for (grain_id, ft_type, result) in owners:
+        if ft_type == 'S':
+            summaries[grain_id].ns = result
+        else:
+            summaries[grain_id].ni = result
+    regions = Region.objects.filter(
+        grain__in=grain_ids,
+        result__isnull=True
+    ).order_by('pk').only('grain_id', 'area_pixels', 'vertices')
+    for region in regions:
+        summaries[region.grain_id].roi_area_pixels += region.area()
+    for (pk, summary) in summaries.items():
+        (scale_x, scale_y) = scales[pk]
+        if scale_x is not None and scale_y is not None:
+            summary.roi_area_micron2 = (
+                scale_x * scale_y * summary.roi_area_pixels * 1e12
+            )
+    return summaries
+
+def sample_summaries(sample_ids, grains):
+    """
+    Returns unsaved SampleSummary objects for the samples with IDs in
+    `sample_ids` from `grains`, the GrainSummary objects (with
+    sample_id attributes) of all their grains.
+    """
+    now = timezone.now()
+    summaries = {
+        pk: SampleSummary(sample_id=pk, updated=now)
+        for pk in sample_ids
+    }
+    for grain in grains:
+        summary = summaries[grain.sample_id]
+        summary.grain_count += 1
+        summary.result_count += grain.result_count
+        if grain.ns is not None and 0 <= grain.ns:
+            summary.counted_grain_count += 1
+            summary.ns += grain.ns
+        if grain.ni is not None and 0 <= grain.ni:
+            summary.ni += grain.ni
+        if grain.roi_area_micron2 is not None:
+            summary.roi_area_micron2 = (
+                (summary.roi_area_micron2 or 0) + grain.roi_area_micron2
+            )
+    contributors = FissionTrackNumbering.objects.filter(
+        grain__sample__in=sample_ids,
+        result__gte=0
+    ).exclude(
+        worker__username='guest'
+    ).order_by().values('grain__sample').annotate(
+        workers=Count('worker', distinct=True)
+    ).values_list('grain__sample', 'workers')
+    for (sample_id, workers) in contributors:
+        summaries[sample_id].contributor_count = workers
+    return summaries
+
+def save_summaries(model, summaries, fields):
+    model.objects.bulk_create(
+        summaries,
+        update_conflicts=True,
+        unique_fields=[model._meta.pk.name],
+        update_fields=fields + ['updated']
+    )
+
+def stored_grain_summaries(sample_ids):
+    return GrainSummary.objects.filter(
+        grain__sample__in=sample_ids
+    ).annotate(sample_id=F('grain__sample')).order_by('pk')
+
+def lock_sample_summaries(sample_ids):
+    """
+    Locks the SampleSummary rows of the samples with IDs in
+    `sample_ids` until the current transaction ends, creating any that
+    are missing, so that concurrent refreshes of a sample take turns.
+    """
+    SampleSummary.objects.bulk_create(
+        [SampleSummary(sample_id=pk) for pk in sample_ids],
+        ignore_conflicts=True
+    )
+    # In primary key order so that two refreshes cannot deadlock
+    list(SampleSummary.objects.select_for_update().filter(
+        pk__in=sample_ids
+    ).order_by('pk').values_list('pk', flat=True))
+
+def refresh_summaries(grain_ids=(), sample_ids=()):
+    """
+    Recalculates and stores the summaries of the grains with IDs in
+    `grain_ids`, of any other grains in their samples that have none
+    yet, and of their samples and the samples with IDs in
+    `sample_ids`. The samples' summaries stay locked until the
+    transaction ends, so that another refresh of the same samples
+    waits and then sees these grain summaries rather than overwriting
+    the sample totals with its own stale ones.
+    """
+    with transaction.atomic():
+        sample_ids = set(sample_ids) | set(Grain.objects.filter(
+            pk__in=grain_ids
+        ).values_list('sample_id', flat=True))
+        sample_ids = set(Sample.objects.filter(
+            pk__in=sample_ids
+        ).values_list('pk', flat=True))
+        lock_sample_summaries(sample_ids)
+        grain_ids = set(grain_ids) | set(Grain.objects.filter(
+            sample__in=sample_ids,
+            summary__isnull=True
+        ).values_list('pk', flat=True))
+        save_summaries(
+            GrainSummary,
+            list(grain_summaries(grain_ids).values()),
+            GRAIN_FIELDS
+        )
+        save_summaries(
+            SampleSummary,
+            list(sample_summaries(
+                sample_ids, stored_grain_summaries(sample_ids)
+            ).values()),
+            SAMPLE_FIELDS
+        )
+
+def ensure_summaries(samples):
+    """
+    Makes sure that `samples` (a Sample queryset or a list of sample
+    IDs) and all their grains have summaries.
+    """
+    missing = set(Grain.objects.filter(
+        sample__in=samples,
+        summary__isnull=True
+    ).values_list('sample_id', flat=True)) | set(Sample.objects.filter(
+        pk__in=samples,
+        summary__isnull=True
+    ).values_list('pk', flat=True))
+    if missing:
+        refresh_summaries(sample_ids=missing)
+
+def delete_updating_summaries(qs):
+    """
+    Deletes the objects in the queryset `qs` and refreshes the
+    summaries that counted them. Returns what QuerySet.delete() does.
+    """
+    grain_ids = set()
+    sample_ids = set()
+    if qs.model is Grain:
+        sample_ids = set(qs.values_list('sample_id', flat=True))
+    elif qs.model is FissionTrackNumbering:
+        grain_ids = set(qs.values_list('grain_id', flat=True))
+    deleted = qs.delete()
+    if grain_ids or sample_ids:
+        refresh_summaries(grain_ids, sample_ids)
+    return deleted
+
+def summary_values(summary, fields):
+    return tuple(getattr(summary, f) for f in fields)
+
+def rebuild_summaries(check=False, batch_size=500):
+    """
+    Recalculates the summaries of every grain and sample, a batch of
+    `batch_size` samples at a time. Returns the IDs of the grains and
+    of the samples whose stored summaries were missing or wrong. If
+    `check`, nothing is changed.
+    """
+    bad_grains = []
+    bad_samples = []
+    sample_ids = list(Sample.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(sample_ids), batch_size):
+        batch = sample_ids[start:start + batch_size]
+        grains = grain_summaries(Grain.objects.filter(
+            sample__in=batch
+        ).values_list('pk', flat=True))
+        stored = {
+            s.pk: summary_values(s, GRAIN_FIELDS)
+            for s in stored_grain_summaries(batch)
+        }
+        bad_grains += [
+            pk for (pk, s) in grains.items()
+            if stored.get(pk) != summary_values(s, GRAIN_FIELDS)
+        ]
+        samples = sample_summaries(batch, grains.values())
+        stored = {
+            s.pk: summary_values(s, SAMPLE_FIELDS)
+            for s in SampleSummary.objects.filter(sample__in=batch)
+        }
+        bad_samples += [
+            pk for (pk, s) in samples.items()
+            if stored.get(pk) != summary_values(s, SAMPLE_FIELDS)
+        ]
+        if not check:
+            save_summaries(GrainSummary, list(grains.values()), GRAIN_FIELDS)
+            save_summaries(SampleSummary, list(samples.values()), SAMPLE_FIELDS)
+    return (sorted(bad_grains), sorted(bad_samples))
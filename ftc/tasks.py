@@ -0,0 +1,22 @@
+"""
+The tasks that can be queued with ftc.jobs.enqueue.
+"""
+from django.apps import apps
+from ftc.image_tiles import build_tiles
+from ftc.jobs import task
+from ftc.summaries import delete_updating_summaries
+
+@task
+def make_image_tiles(sha256):
+    return build_tiles(sha256)
+
+@task
+def delete_object(model, pk):
+    """
+    Deletes the `model` (an "app_label.ModelName" label) with primary
+    key `pk` and everything that depends on it.
+    """
+    (count, per_model) = delete_updating_summaries(
+        apps.get_model(model).objects.filter(pk=pk)
+    )
+    return per_model
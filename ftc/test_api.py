@@ -1,10 +1,33 @@
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import Client, TestCase, tag, override_settings
+from unittest import skipUnless
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 import django
-from ftc.models import Grain, FissionTrackNumbering, Region, Vertex
-from geochron.settings import SIMPLE_JWT
+from ftc.jobs import work
+from ftc.models import (
+    Grain, FissionTrackNumbering, Image, Region, Vertex, ContainedTrack,
+    PackedGrainPoints, GrainSummary, SampleSummary, Transform2D
+)
+from geochron.settings import (
+    GRAIN_ARCHIVE_MAX_FILES, GRAIN_ARCHIVE_SIZE_LIMIT, IMAGE_UPLOAD_SIZE_LIMIT,
+    SIMPLE_JWT
+)
 
 import abc
+import array
+import ast
+from importlib.util import find_spec
+import io
 import json
+import math
+import os
+import struct
+import tarfile
+import tempfile
+import zipfile
 
 
 testGrain1 = 'test/crystals/john/p1/s1/Grain01/stack-01.jpg'
@@ -194,6 +217,33 @@ class DeleteTestBaseMixin:
         expected_ids.sort()
         self.assertListEqual(actual_ids, expected_ids)
 
+    def test_background_delete(self):
+        r = self.client.delete(
+            '/ftc/api/'+self.path+str(self.counter_id)+'/?background=true',
+            **self.headers
+        )
+        self.assertEqual(r.status_code, 202)
+        url = r['Location']
+        self.assertEqual(json.loads(r.content)['url'], url)
+        j = json.loads(self.client.get(url, **self.headers).content)
+        self.assertEqual(j['status'], 'Queued')
+        admin_headers = log_in_headers(self.client, 'admin', 'admin_password')
+        self.assertEqual(self.client.get(url, **admin_headers).status_code, 404)
+        self.assertEqual(work(burst=True), 1)
+        j = json.loads(self.client.get(url, **self.headers).content)
+        self.assertEqual(j['status'], 'Done')
+        self.assertEqual(j['attempts'], 1)
+        r2 = self.client.get('/ftc/api/'+self.path, **self.super_headers)
+        self.assertNotIn(self.counter_id, [p['id'] for p in json.loads(r2.content)])
+
+    def test_cannot_background_delete_others(self):
+        r = self.client.delete(
+            '/ftc/api/'+self.path+str(self.admin_id)+'/?background=true',
+            **self.headers
+        )
+        self.assertIn(r.status_code, [403, 404])
+        self.assertEqual(work(burst=True), 0)
+
     def test_cannot_delete_others(self):
         r = self.client.delete('/ftc/api/'+self.path+str(self.admin_id)+'/', **self.headers)
         self.assertIn(r.status_code, [403, 404])
@@ -418,6 +468,126 @@ class ApiGrainCreate(ApiTestMixin, JwtTestCase):
         self.assertEqual(j['index'], 1)
 
 
+class ApiGrainArchive(ApiTestMixin, JwtTestCase):
+    fixtures = [
+        'essential.json',
+        'users.json',
+        'projects.json',
+        'samples.json'
+    ]
+    grain_dir = 'test/crystals/john/p1/s1/Grain01'
+
+    def make_zip(self):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w') as z:
+            for f in sorted(os.listdir(self.grain_dir)):
+                z.write(os.path.join(self.grain_dir, f), 'Grain01/' + f)
+            z.writestr('__MACOSX/Grain01/._stack-01.jpg', b'junk')
+        buf.seek(0)
+        buf.name = 'Grain01.zip'
+        return buf
+
+    def make_tar(self, *names):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode='w:gz') as t:
+            for f in names:
+                t.add(os.path.join(self.grain_dir, f), 'Grain01/' + f)
+        buf.seek(0)
+        buf.name = 'Grain01.tar.gz'
+        return buf
+
+    def post_archive(self, sample, archive, headers, **kwargs):
+        return self.client.post(
+            '/ftc/api/sample/{0}/grain/archive/'.format(sample),
+            { 'archive': archive, **kwargs },
+            **headers
+        )
+
+    def test_create_grain_from_zip(self):
+        with CaptureQueriesContext(connection) as queries:
+            r = self.post_archive(2, self.make_zip(), self.headers)
+        self.assertEqual(r.status_code, 201)
+        j = json.loads(r.content)
+        self.assertEqual(j['sample'], 2)
+        self.assertEqual(j['index'], 1)
+        with open(os.path.join(self.grain_dir, 'rois.json')) as fh:
+            rois = json.load(fh)
+        self.assertEqual(j['image_width'], rois['image_width'])
+        self.assertEqual(j['region_count'], len(rois['regions']))
+        self.assertEqual(
+            [(i['ft_type'], i['index']) for i in j['images']],
+            [('I', 1), ('S', 1), ('S', 2), ('S', 3), ('S', 4)]
+        )
+        # the metadata file gives the image's focus
+        self.assertIsNotNone(j['images'][1]['focus'])
+        grain = Grain.objects.get(pk=j['id'])
+        with open(os.path.join(self.grain_dir, 'stack-02.jpg'), 'rb') as fh:
+            self.assertEqual(
+                grain.image_set.get(ft_type='S', index=2).data, fh.read()
+            )
+        # one insert each for the grain, its regions and its images
+        inserts = [q for q in queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 3)
+
+    def test_create_grain_from_tar_with_index(self):
+        r = self.post_archive(
+            'counter_samp',
+            self.make_tar('stack-01.jpg', 'stack-02.jpg'),
+            self.headers,
+            index=7
+        )
+        self.assertEqual(r.status_code, 201)
+        j = json.loads(r.content)
+        self.assertEqual(j['index'], 7)
+        # without rois.json the grain gets a default region
+        self.assertEqual(j['region_count'], 1)
+        self.assertEqual(len(j['images']), 2)
+        r = self.post_archive(
+            2, self.make_tar('stack-01.jpg'), self.headers, index=7
+        )
+        self.assertEqual(r.status_code, 400)
+
+    def test_bad_archives(self):
+        r = self.post_archive(1, self.make_zip(), self.headers)
+        self.assertEqual(r.status_code, 403)
+        bad = io.BytesIO(b'neither zip nor tar')
+        bad.name = 'bad.zip'
+        r = self.post_archive(2, bad, self.headers)
+        self.assertEqual(r.status_code, 400)
+        r = self.post_archive(
+            2, self.make_tar('stack-01.jpg_metadata.xml'), self.headers
+        )
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(Grain.objects.filter(sample=2).count(), 0)
+
+    def test_archive_limits(self):
+        # Each file is small enough, but together they are too large
+        bomb = io.BytesIO()
+        with zipfile.ZipFile(bomb, 'w', zipfile.ZIP_DEFLATED) as z:
+            for n in range(GRAIN_ARCHIVE_SIZE_LIMIT // IMAGE_UPLOAD_SIZE_LIMIT + 1):
+                z.writestr(
+                    'Grain01/stack-{0:02}.jpg'.format(n + 1),
+                    bytes(IMAGE_UPLOAD_SIZE_LIMIT)
+                )
+        bomb.seek(0)
+        bomb.name = 'Grain01.zip'
+        r = self.post_archive(2, bomb, self.headers)
+        self.assertEqual(r.status_code, 400)
+        self.assertIn('too large', r.content.decode())
+        many = io.BytesIO()
+        with tarfile.open(fileobj=many, mode='w:gz') as t:
+            for n in range(GRAIN_ARCHIVE_MAX_FILES + 1):
+                info = tarfile.TarInfo('Grain01/{0}.txt'.format(n))
+                info.size = 1
+                t.addfile(info, io.BytesIO(b'x'))
+        many.seek(0)
+        many.name = 'Grain01.tar.gz'
+        r = self.post_archive(2, many, self.headers)
+        self.assertEqual(r.status_code, 400)
+        self.assertIn('more than', r.content.decode())
+        self.assertEqual(Grain.objects.filter(sample=2).count(), 0)
+
+
 class ApiGrainUpdate(ApiTestMixin, JwtTestCase):
     fixtures = [
         'essential.json',
@@ -453,6 +623,56 @@ class ApiGrainUpdate(ApiTestMixin, JwtTestCase):
         self.assertEqual(j['image_width'], 402) # unchanged
         self.assertEqual(j['index'], new_index)
 
+    def test_grain_update_rois(self):
+        rois_path = 'test/crystals/john/p1/s1/Grain01/rois.json'
+        with open(rois_path) as fh:
+            expected = json.load(fh)
+        with open(rois_path, 'rb') as fh:
+            r = self.client.patch(
+                '/ftc/api/grain/2/',
+                encode_multipart(BOUNDARY, { 'rois': fh }),
+                content_type=MULTIPART_CONTENT,
+                **self.headers
+            )
+        self.assertEqual(r.status_code, 200)
+        j = json.loads(r.content)
+        self.assertEqual(j['image_width'], expected['image_width'])
+        self.assertEqual(j['index'], 1) # unchanged
+        rr = self.client.get('/ftc/api/grain/2/rois/', **self.headers)
+        content = json.loads(rr.content.decode(rr.charset))
+        self.assertEqual(
+            [r['vertices'] for r in content['regions']],
+            [r['vertices'] for r in expected['regions']]
+        )
+
+    def patch_rois(self, rois):
+        fh = io.BytesIO(json.dumps(rois).encode('utf-8'))
+        fh.name = 'rois.json'
+        return self.client.patch(
+            '/ftc/api/grain/2/',
+            encode_multipart(BOUNDARY, { 'rois': fh }),
+            content_type=MULTIPART_CONTENT,
+            **self.headers
+        )
+
+    def test_grain_update_rois_reuses_transform(self):
+        with open('test/crystals/john/p1/s1/Grain01/rois.json') as fh:
+            rois = json.load(fh)
+        rois['mica_transform'] = [[1, 0, 10], [0, 1, 20]]
+        self.assertEqual(self.patch_rois(rois).status_code, 200)
+        transform = Grain.objects.get(pk=2).mica_transform_matrix
+        count = Transform2D.objects.count()
+        rois['mica_transform'] = [[1, 0, 11], [0, 1, 21]]
+        self.assertEqual(self.patch_rois(rois).status_code, 200)
+        self.assertEqual(Transform2D.objects.count(), count)
+        grain = Grain.objects.get(pk=2)
+        self.assertEqual(grain.mica_transform_matrix.pk, transform.pk)
+        self.assertEqual(grain.mica_transform_matrix.t0, 11)
+        del rois['mica_transform']
+        self.assertEqual(self.patch_rois(rois).status_code, 200)
+        self.assertEqual(Transform2D.objects.count(), count - 1)
+        self.assertIsNone(Grain.objects.get(pk=2).mica_transform_matrix)
+
     def test_cannot_change_grain_ownership(self):
         r = self.client.patch('/ftc/api/grain/2/', {
             'sample': 1
@@ -505,6 +725,34 @@ class ApiImageCreate(ApiTestMixin, JwtTestCase):
         j3 = json.loads(r3.content)
         self.assertEqual(len(j3), 0)
 
+    def test_identical_images_are_stored_once(self):
+        r1 = self.upload_image(1, testGrain1, self.super_headers)
+        self.assertEqual(r1.status_code, 201)
+        r2 = self.upload_image(2, testGrain1, self.headers)
+        self.assertEqual(r2.status_code, 201)
+        j1 = json.loads(r1.content)
+        j2 = json.loads(r2.content)
+        self.assertNotEqual(j1['id'], j2['id'])
+        self.assertEqual(j1['sha256'], j2['sha256'])
+        with open(testGrain1, 'rb') as fh:
+            data = fh.read()
+        self.assertEqual(j1['size'], len(data))
+        r3 = self.client.get(
+            '/ftc/api/image/{0}/data/'.format(j2['id']),
+            **self.headers
+        )
+        self.assertEqual(r3.status_code, 200)
+        self.assertEqual(b''.join(r3.streaming_content), data)
+
+    @override_settings(IMAGE_TILES='immediate')
+    def test_created_image_gets_tiles(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            r = self.upload_image(1, testGrain1, self.super_headers)
+        self.assertEqual(r.status_code, 201)
+        image = Image.objects.get(pk=json.loads(r.content)['id'])
+        # 200x200 pixels fits in one tile
+        self.assertEqual(image.tile_levels, 0)
+
     def test_cannot_create_image_for_other(self):
         r = self.upload_image(
             1,
@@ -587,6 +835,166 @@ class ApiImageUpdate(ApiTestMixin, JwtTestCase):
             }, content_type='application/json', **self.super_headers)
     
 
+class ImageListsLoadNoImageData(ApiTestMixin, JwtTestCase):
+    """
+    Pages and endpoints that only list images must not read the
+    images themselves: neither from a blob column in the database
+    nor from the image store.
+    """
+    fixtures = [
+        'essential.json',
+        'users.json',
+        'projects.json',
+        'samples.json',
+        'grains.json',
+        'images.json'
+    ]
+
+    def assertLoadsNoImageData(self, url, **headers):
+        with (
+            tempfile.TemporaryDirectory() as empty_store,
+            override_settings(IMAGE_STORE_ROOT=empty_store),
+            CaptureQueriesContext(connection) as queries
+        ):
+            r = self.client.get(url, **headers)
+        self.assertEqual(r.status_code, 200)
+        for query in queries.captured_queries:
+            self.assertNotIn('"ftc_image"."data"', query['sql'])
+
+    def test_api_image_lists(self):
+        self.assertLoadsNoImageData('/ftc/api/grain/1/image/', **self.super_headers)
+        self.assertLoadsNoImageData('/ftc/api/image/', **self.super_headers)
+        self.assertLoadsNoImageData('/ftc/api/image/1/', **self.super_headers)
+
+    def test_grain_pages(self):
+        self.client.force_login(User.objects.get(username='super'))
+        for name in ['grain', 'grain_images', 'grain_delete']:
+            self.assertLoadsNoImageData(reverse(name, args=[1]))
+
+
+class ApiImageBundle(ApiTestMixin, JwtTestCase):
+    fixtures = [
+        'essential.json',
+        'users.json',
+        'projects.json',
+        'samples.json',
+        'grains.json',
+        'images.json'
+    ]
+
+    def setUp(self):
+        super().setUp()
+        # Saved with a lower index than the fixture's image
+        # (index 1) so the bundle has to sort them
+        image = Image(
+            grain=Grain.objects.get(pk=1),
+            index=-3,
+            ft_type='S',
+            format='P',
+            light_path='R',
+            focus=2.5
+        )
+        image.data = b'another image'
+        image.save()
+
+    def read_parts(self, response):
+        content = b''.join(response.streaming_content)
+        self.assertEqual(int(response['Content-Length']), len(content))
+        boundary = response['Content-Type'].split('boundary=')[1].encode()
+        self.assertTrue(content.endswith(b'--' + boundary + b'--\r\n'))
+        parts = []
+        for chunk in content.split(b'--' + boundary)[1:-1]:
+            (head, body) = chunk.split(b'\r\n\r\n', 1)
+            headers = dict(
+                line.split(': ', 1)
+                for line in head.decode('ascii').split('\r\n') if line
+            )
+            self.assertEqual(int(headers['Content-Length']), len(body) - 2)
+            parts.append((headers['Content-Type'], body[:-2]))
+        return parts
+
+    def test_bundle(self):
+        r = self.client.get('/ftc/api/grain/1/image/bundle/S/', **self.headers)
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r['Content-Type'].startswith('multipart/mixed'))
+        parts = self.read_parts(r)
+        self.assertEqual(len(parts), 3)
+        (mime, manifest) = parts[0]
+        self.assertEqual(mime, 'application/json')
+        manifest = json.loads(manifest)
+        self.assertEqual([v['index'] for v in manifest], [-3, 1])
+        self.assertEqual(manifest[0]['light_path'], 'R')
+        self.assertEqual(manifest[0]['focus'], 2.5)
+        self.assertEqual(parts[1], ('image/png', b'another image'))
+        self.assertEqual(parts[2][0], 'image/jpeg')
+        self.assertEqual(parts[2][1], Image.objects.get(pk=1).data)
+        r = self.client.get(
+            '/ftc/api/grain/1/image/bundle/S/',
+            HTTP_IF_NONE_MATCH=r['ETag'],
+            **self.headers
+        )
+        self.assertEqual(r.status_code, 304)
+
+    def test_empty_and_bad_bundles(self):
+        r = self.client.get('/ftc/api/grain/1/image/bundle/I/', **self.headers)
+        self.assertEqual(r.status_code, 200)
+        parts = self.read_parts(r)
+        self.assertEqual(parts, [('application/json', b'[]')])
+        r = self.client.get('/ftc/api/grain/1/image/bundle/X/', **self.headers)
+        self.assertEqual(r.status_code, 404)
+        r = self.client.get('/ftc/api/grain/1/image/bundle/S/')
+        self.assertEqual(r.status_code, 401)
+
+
+class ApiSampleInventory(ApiTestMixin, JwtTestCase):
+    fixtures = [
+        'essential.json',
+        'users.json',
+        'projects.json',
+        'samples.json',
+        'grains.json',
+        'images.json'
+    ]
+
+    def test_inventory(self):
+        image = Image(
+            grain=Grain.objects.get(pk=2), index=0, ft_type='I', format='P'
+        )
+        image.data = b'mica image'
+        image.save()
+        for sample in ['2', 'counter_samp']:
+            r = self.client.get(
+                '/ftc/api/sample/{0}/inventory/'.format(sample),
+                **self.headers
+            )
+            self.assertEqual(r.status_code, 200)
+            j = json.loads(r.content)
+            self.assertEqual(j['id'], 2)
+            self.assertEqual(j['grains'], [{
+                'id': 2,
+                'index': 1,
+                'images': [{
+                    'id': image.pk,
+                    'index': 0,
+                    'ft_type': 'I',
+                    'sha256': image.sha256,
+                }, {
+                    'id': 2,
+                    'index': 1,
+                    'ft_type': 'S',
+                    'sha256': Image.objects.get(pk=2).sha256,
+                }],
+            }])
+
+    def test_cannot_see_others_inventory(self):
+        r = self.client.get('/ftc/api/sample/1/inventory/', **self.headers)
+        self.assertEqual(r.status_code, 403)
+        r = self.client.get('/ftc/api/sample/1/inventory/', **self.super_headers)
+        self.assertEqual(r.status_code, 200)
+        r = self.client.get('/ftc/api/sample/99/inventory/', **self.super_headers)
+        self.assertEqual(r.status_code, 404)
+
+
 class ApiCount(ApiTestMixin):
     fixtures = [
         'essential.json',
@@ -709,6 +1117,22 @@ class ApiCount(ApiTestMixin):
         self.assertSetAlmostEqual(jgp, points, ApiCountGrainPoint.points_close)
         self.assertDictContainsSubset({'id': 102, 'email': 'admin@uni.ac.uk'}, jo2[0]['worker'])
 
+    def test_upload_count_updates_summary(self):
+        grain = Grain.objects.get(sample__pk=2, index=1)
+        data = {
+            'grain': '2/1',
+            'ft_type': 'S',
+            'worker': 'counter',
+            'create_date': '2023-11-14',
+            'grainpoints': json.dumps(self.latlngs_to_points(grain, [[0.2, 0.3], [0.4, 0.5]])),
+        }
+        r = self.client.post(self.count_url, data, **self.super_headers)
+        self.assertEqual(r.status_code, 201)
+        summary = GrainSummary.objects.get(grain=grain)
+        self.assertEqual(summary.ns, 2)
+        self.assertEqual(summary.result_count, grain.count_results())
+        self.assertEqual(SampleSummary.objects.get(sample=2).ns, 2)
+
     def _upload_count_with_roi(self, grain, regions, region_repr):
         """
         Uploads a count with an ROI (by both APIs which should do the same thing).
@@ -1129,3 +1553,154 @@ class ApiGrainDownload(ApiTestMixin, JwtTestCase):
             [183, 7],
             [6, 7]
         ], jd[6]['regions'][0]['vertices'])
+
+
+def read_npz(data):
+    """
+    Reads the arrays of an .npz file into lists, without numpy.
+    """
+    arrays = {}
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        for name in z.namelist():
+            raw = z.read(name)
+            assert raw[:8] == b'\x93NUMPY\x01\x00'
+            (length,) = struct.unpack('<H', raw[8:10])
+            assert (10 + length) % 64 == 0
+            header = ast.literal_eval(raw[10:10 + length].decode('latin1'))
+            body = raw[10 + length:]
+            descr = header['descr']
+            count = header['shape'][0]
+            if descr.startswith('<U'):
+                width = int(descr[2:]) * 4
+                values = [
+                    body[i * width:(i + 1) * width].decode('utf-32-le').rstrip('\0')
+                    for i in range(count)
+                ]
+            else:
+                typecode = { '<i4': 'i', '<i8': 'q', '<f8': 'd', '<M8[us]': 'q' }[descr]
+                values = array.array(typecode, body).tolist()
+            assert len(values) == count
+            arrays[name[:-len('.npy')]] = values
+    return arrays
+
+
+class ApiCountExport(ApiTestMixin, JwtTestCase):
+    fixtures = [
+        'essential.json',
+        'users.json',
+        'projects.json',
+        'samples.json',
+        'grains.json',
+        'grains2.json',
+        'results.json',
+        'results2.json'
+    ]
+
+    def setUp(self):
+        super().setUp()
+        ContainedTrack.objects.create(
+            result_id=1, x1_pixels=1, y1_pixels=2, z1_level=0,
+            x2_pixels=3, y2_pixels=4, z2_level=2
+        )
+        # One result's points are packed, the others' are GrainPoint rows
+        packed = PackedGrainPoints.from_grain_points(
+            FissionTrackNumbering.objects.get(pk=2)
+        )
+        packed.comments['1'] = 'faint'
+        packed.save()
+
+    def expected_points(self, results):
+        points = []
+        for ft in results:
+            points += [
+                (ft.pk, p['x_pixels'], p['y_pixels'], p['category'], p['comment'])
+                for p in ft.points()
+            ]
+        return sorted(points)
+
+    def get_export(self, export_format, **params):
+        r = self.client.get(
+            '/ftc/api/count/export/{0}/'.format(export_format),
+            params,
+            **self.headers
+        )
+        self.assertEqual(r.status_code, 200)
+        return r.getvalue()
+
+    def test_npz(self):
+        a = read_npz(self.get_export('npz', sample='1'))
+        results = FissionTrackNumbering.objects.filter(
+            grain__sample=1, result__gte=0
+        ).order_by('pk')
+        self.assertEqual(a['results.result_id'], [ft.pk for ft in results])
+        self.assertEqual(a['results.count'], [ft.result for ft in results])
+        self.assertEqual(
+            [a['results.worker.values'][i] for i in a['results.worker']],
+            [ft.worker.username for ft in results]
+        )
+        self.assertEqual(a['results.analyst'], [-1] * results.count())
+        self.assertEqual(
+            a['results.create_date'][0],
+            int(results[0].create_date.timestamp() * 1e6)
+        )
+        self.assertEqual(a['grains.grain_id'], [1, 3, 4])
+        self.assertTrue(all(math.isnan(x) for x in a['grains.scale_x']))
+        self.assertEqual(
+            sorted(zip(
+                a['points.result_id'], a['points.x_pixels'], a['points.y_pixels'],
+                [a['points.category.values'][i] for i in a['points.category']],
+                [a['points.comment.values'][i] for i in a['points.comment']],
+            )),
+            self.expected_points(results)
+        )
+        self.assertEqual(a['contained_tracks.result_id'], [1])
+        self.assertEqual(a['contained_tracks.z2_level'], [2])
+
+    def test_npz_packed_points(self):
+        a = read_npz(self.get_export('npz', sample='2'))
+        results = FissionTrackNumbering.objects.filter(grain__sample=2, result__gte=0)
+        points = self.expected_points(results)
+        self.assertIn('faint', [p[4] for p in points])
+        self.assertEqual(
+            sorted(zip(
+                a['points.result_id'], a['points.x_pixels'], a['points.y_pixels'],
+                [a['points.category.values'][i] for i in a['points.category']],
+                [a['points.comment.values'][i] for i in a['points.comment']],
+            )),
+            points
+        )
+        self.assertEqual(a['contained_tracks.result_id'], [])
+
+    @skipUnless(find_spec('pyarrow'), 'pyarrow is not installed')
+    def test_parquet(self):
+        import pyarrow.parquet
+        data = self.get_export('parquet')
+        with zipfile.ZipFile(io.BytesIO(data)) as z:
+            self.assertEqual(sorted(z.namelist()), [
+                'contained_tracks.parquet', 'grains.parquet',
+                'points.parquet', 'results.parquet'
+            ])
+            tables = {
+                name[:-len('.parquet')]: pyarrow.parquet.read_table(
+                    io.BytesIO(z.read(name))
+                ).to_pylist()
+                for name in z.namelist()
+            }
+        results = FissionTrackNumbering.objects.filter(result__gte=0).order_by('pk')
+        self.assertEqual(
+            [(r['result_id'], r['worker'], r['count'], r['create_date']) for r in tables['results']],
+            [(ft.pk, ft.worker.username, ft.result, ft.create_date) for ft in results]
+        )
+        self.assertEqual(len(tables['grains']), 4)
+        self.assertIsNone(tables['grains'][0]['scale_x'])
+        self.assertEqual(
+            sorted(tuple(p.values()) for p in tables['points']),
+            self.expected_points(results)
+        )
+        self.assertEqual(tables['contained_tracks'][0]['x2_pixels'], 3)
+
+    def test_unknown_format(self):
+        r = self.client.get('/ftc/api/count/export/xls/', **self.headers)
+        self.assertEqual(r.status_code, 404)
+        r = self.client.get('/ftc/api/count/export/npz/')
+        self.assertEqual(r.status_code, 401)
@@ -1,16 +1,27 @@
-from django.test import TestCase, tag
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth.models import User, Group
+from prometheus_client import REGISTRY
 
 import csv
+import gzip
 import io
 import json
+import os
 from random import uniform
 import re
+import shutil
+import tempfile
 
+from ftc.image_tiles import build_tiles
+from ftc.save_rois_regions import save_regions
 from ftc.models import (
-  GrainPoint, FissionTrackNumbering,
-  TutorialPage, Sample, Region, Project,
+  GrainPoint, FissionTrackNumbering, Image,
+  TutorialPage, Sample, Region, Project, UploadJob, Grain, SampleSummary,
 )
 
 def gen_latlng():
@@ -27,6 +38,8 @@ def gen_latlngs(n):
 
 
 @tag('integration')
+# These tests log in far more often than allauth's rate limits allow
+@override_settings(ACCOUNT_RATE_LIMITS=False)
 class GahCase(TestCase):
   def login(self, user, password):
     login_page = reverse('account_login')
@@ -150,7 +163,7 @@ class TestCountJsonDownload(CountingCase):
       )
     return {
       g['grain']: g
-      for g in json.loads(r.content)
+      for g in json.loads(r.getvalue())
     }
 
   def sorted_results_for_grain(self, grain):
@@ -195,15 +208,31 @@ class TestCountJsonDownload(CountingCase):
     grains = self.get_json_results(['2'])
     assert(sorted(grains.keys()) == [])
 
+  def test_gzipped_json_results(self):
+    self.login_super()
+    plain = self.client.get(reverse('getJsonResults'))
+    self.assertTrue(plain.streaming)
+    self.assertNotIn('Content-Encoding', plain)
+    r = self.client.get(
+      reverse('getJsonResults'),
+      headers={ 'Accept-Encoding': 'gzip, deflate' }
+    )
+    self.assertEqual(r['Content-Encoding'], 'gzip')
+    self.assertIn('Accept-Encoding', r['Vary'])
+    self.assertEqual(
+      json.loads(gzip.decompress(r.getvalue())),
+      json.loads(plain.getvalue())
+    )
+
 class TestCountCsvDownload(CountingCase):
   fixtures = [
     'essential.json',
     'users.json', 'projects.json', 'samples.json',
     'grains.json', 'grains2.json', 'images.json',
-    'results.json', 'results2.json'
+    'results.json', 'results2.json', 'grain1_region.json'
   ]
 
-  def get_csv_results(self, samples=None):
+  def get_csv_rows(self, samples=None):
     if samples is None:
       r = self.client.get(reverse('getCsvResults'))
     else:
@@ -211,7 +240,11 @@ class TestCountCsvDownload(CountingCase):
         reverse('getCsvResults'),
         { 'samples[]': samples }
       )
-    dicts = csv.DictReader(io.StringIO(r.content.decode('utf-8')))
+    self.assertTrue(r.streaming)
+    return list(csv.DictReader(io.StringIO(r.getvalue().decode('utf-8'))))
+
+  def get_csv_results(self, samples=None):
+    dicts = self.get_csv_rows(samples)
     res = {}
     for row in dicts:
       psi = (row['project_name'], row['sample_name'], row['index'])
@@ -236,6 +269,195 @@ class TestCountCsvDownload(CountingCase):
     assert(sorted(grains[("proj1", "adm_samp", '3')]) == [2])
     assert(sorted(grains[("proj2", "counter_samp", '1')]) == [2, 2, 3, 3])
 
+  def test_csv_areas(self):
+    # One result on grain 1 has its own region; the rest use the grain's
+    result = FissionTrackNumbering.objects.filter(grain=1).first()
+    save_regions(result.grain, [[[0, 0], [10, 0], [10, 5], [0, 5]]], result)
+    self.login_super()
+    rows = self.get_csv_rows()
+    results = FissionTrackNumbering.objects.filter(result__gte=0)
+    self.assertEqual(len(rows), results.count())
+    self.assertEqual(
+      sorted((r['user_id'], r['count'], float(r['area_pixels'])) for r in rows),
+      sorted((str(ft.worker_id), str(ft.result), float(ft.roi_area_pixels())) for ft in results)
+    )
+    self.assertIn(50.0, [float(r['area_pixels']) for r in rows])
+
+  def test_csv_query_count_is_fixed(self):
+    self.login_super()
+    with CaptureQueriesContext(connection) as one_sample:
+      self.assertEqual(len(self.get_csv_rows(['1'])), 4)
+    with CaptureQueriesContext(connection) as all_samples:
+      self.assertEqual(len(self.get_csv_rows()), 8)
+    self.assertEqual(len(one_sample), len(all_samples))
+
+
+class TestTableData(CountingCase):
+  fixtures = [
+    'essential.json',
+    'users.json', 'projects.json', 'samples.json',
+    'grains.json', 'grains2.json', 'images.json',
+    'results.json', 'results2.json'
+  ]
+
+  def get_table_data(self, samples, **params):
+    r = self.client.post(
+      reverse('getTableData'),
+      { 'client_response': samples, **params },
+      content_type='application/json'
+    )
+    self.assertEqual(r.status_code, 200)
+    return json.loads(r.content)
+
+  def test_areas(self):
+    Grain.objects.filter(pk=1).update(scale_x=0.001, scale_y=0.002)
+    grain = Grain.objects.get(pk=1)
+    save_regions(grain, [[[0, 0], [10, 0], [10, 10], [0, 10]]])
+    result = FissionTrackNumbering.objects.get(pk=4)
+    save_regions(grain, [[[0, 0], [10, 0], [10, 5], [0, 5]]], result)
+    self.login_super()
+    rows = self.get_table_data([1, 2])['aaData']
+    self.assertEqual(len(rows), 8)
+    areas = sorted(
+      (r[5], r[4], r[7]) for r in rows if r[7] is not None
+    )
+    expected = sorted(
+      (ft.worker.username, ft.result, ft.roi_area_micron2())
+      for ft in FissionTrackNumbering.objects.filter(grain=grain)
+    )
+    self.assertEqual([a[:2] for a in areas], [e[:2] for e in expected])
+    for (a, e) in zip(areas, expected):
+      self.assertAlmostEqual(a[2], e[2])
+    self.assertEqual(sorted(round(a[2]) for a in areas), [100000000, 200000000])
+
+  def test_server_side_page(self):
+    self.login_super()
+    j = self.get_table_data(
+      [1, 2], draw=3, start=2, length=3,
+      order=[{ 'column': 4, 'dir': 'desc' }],
+      search={ 'value': 'ADM_', 'regex': False },
+      columns=[{ 'searchable': True } for _ in range(8)]
+    )
+    self.assertEqual(j['draw'], 3)
+    self.assertEqual(j['recordsTotal'], 8)
+    self.assertEqual(j['recordsFiltered'], 4)
+    self.assertEqual(
+      [(r[0], r[1], r[2], r[4]) for r in j['data']],
+      [('proj1', 'adm_samp', 2, 2), ('proj1', 'adm_samp', 3, 2)]
+    )
+    j = self.get_table_data(
+      [1, 2], draw=4, start=0, length=-1,
+      search={ 'value': 'adm super' }
+    )
+    self.assertEqual(j['recordsFiltered'], 3)
+    self.assertEqual({r[5] for r in j['data']}, {'super'})
+
+  def test_query_count_is_fixed(self):
+    self.login_super()
+    page = { 'draw': 1, 'start': 0, 'length': 10, 'search': { 'value': 'samp' } }
+    with CaptureQueriesContext(connection) as one_sample:
+      self.assertEqual(len(self.get_table_data([2], **page)['data']), 4)
+    with CaptureQueriesContext(connection) as two_samples:
+      self.assertEqual(len(self.get_table_data([1, 2], **page)['data']), 8)
+    self.assertEqual(len(one_sample), len(two_samples))
+
+  def test_bad_parameters(self):
+    self.login_super()
+    r = self.client.post(
+      reverse('getTableData'),
+      { 'client_response': [1], 'draw': 1, 'order': [{ 'column': 8 }] },
+      content_type='application/json'
+    )
+    self.assertEqual(r.status_code, 400)
+
+
+class TestSummaries(GahCase):
+  fixtures = [
+    'essential.json',
+    'users.json', 'projects.json', 'samples.json',
+    'grains.json', 'grains2.json', 'images.json', 'grain1_region.json',
+    'results.json', 'results2.json'
+  ]
+
+  def assert_summaries_up_to_date(self):
+    call_command('rebuild_summaries', '--check', stdout=io.StringIO())
+
+  def test_sample_page_makes_summaries(self):
+    self.login_admin()
+    r = self.client.get(reverse('sample', args=[1]))
+    self.assertEqual(r.status_code, 200)
+    self.assertEqual(r.context['summary'].grain_count, 3)
+    for grain in Grain.objects.filter(sample=1):
+      self.assertEqual(
+        (grain.summary.ns, grain.summary.ni, grain.summary.result_count),
+        (grain.owners_result(), grain.owners_result_mica(), grain.count_results())
+      )
+      self.assertAlmostEqual(
+        grain.summary.roi_area_pixels,
+        grain.get_regions_generic().roi_area_pixels()
+      )
+    summary = SampleSummary.objects.get(sample=1)
+    self.assertEqual(
+      (summary.counted_grain_count, summary.ns, summary.ni),
+      (1, 3, 0)
+    )
+    # results by admin and super
+    self.assertEqual((summary.result_count, summary.contributor_count), (4, 2))
+
+  def test_saving_results_updates_summaries(self):
+    call_command('rebuild_summaries', stdout=io.StringIO())
+    self.login_admin()
+    r = self.client.post(
+      reverse('saveWorkingGrain'),
+      { 'sample_id': 1, 'grain_num': 2, 'ft_type': 'S', 'marker_latlngs': gen_latlngs(3) },
+      content_type='application/json'
+    )
+    self.assertEqual(r.status_code, 200)
+    self.assertEqual(Grain.objects.get(pk=3).summary.ns, -1)
+    self.assert_summaries_up_to_date()
+    r = self.client.post(
+      reverse('updateFtnResult'),
+      { 'sample_id': 1, 'grain_num': 2, 'ft_type': 'S', 'marker_latlngs': gen_latlngs(5) },
+      content_type='application/json'
+    )
+    self.assertEqual(r.status_code, 200)
+    self.assertEqual(Grain.objects.get(pk=3).summary.ns, 5)
+    summary = SampleSummary.objects.get(sample=1)
+    self.assertEqual((summary.counted_grain_count, summary.ns), (2, 8))
+    self.assert_summaries_up_to_date()
+    r = self.client.post(reverse('grain_update_roi', kwargs={ 'pk': 3 }), {
+      'vertex_0_0_x': 0.1,
+      'vertex_0_0_y': 0.1,
+      'vertex_0_1_x': 0.5,
+      'vertex_0_1_y': 0.1,
+      'vertex_0_2_x': 0.5,
+      'vertex_0_2_y': 0.5,
+    })
+    self.assertLess(r.status_code, 400)
+    self.assertGreater(Grain.objects.get(pk=3).summary.roi_area_pixels, 0)
+    self.assert_summaries_up_to_date()
+
+  def test_deleting_grain_updates_sample_summary(self):
+    call_command('rebuild_summaries', stdout=io.StringIO())
+    self.login_super()
+    r = self.client.post(reverse('grain_delete', args=[1]))
+    self.assertLess(r.status_code, 400)
+    summary = SampleSummary.objects.get(sample=1)
+    self.assertEqual((summary.grain_count, summary.result_count), (2, 2))
+    self.assert_summaries_up_to_date()
+
+  def test_check_reports_stale_summaries(self):
+    call_command('rebuild_summaries', stdout=io.StringIO())
+    FissionTrackNumbering.objects.filter(pk=6).update(result=-1)
+    with self.assertRaises(CommandError):
+      self.assert_summaries_up_to_date()
+    out = io.StringIO()
+    call_command('rebuild_summaries', stdout=out)
+    self.assertIn('Grain summaries out of date: 3', out.getvalue())
+    self.assertIn('Sample summaries out of date: 1', out.getvalue())
+    self.assertEqual(Grain.objects.get(pk=3).summary.result_count, 0)
+    self.assert_summaries_up_to_date()
+
 
 class RegionCase(GahCase):
   fixtures = [
@@ -270,8 +492,8 @@ class RegionCase(GahCase):
       reverse('download_roiss'),
       { 'samples[]': [1] }
     )
-    self.assertContains(r, '', status_code=200)
-    j = json.loads(r.content)
+    self.assertEqual(r.status_code, 200)
+    j = json.loads(r.getvalue())
     self.assertEqual(len(j), 2)
     rois = {
       region['grain_id']: region
@@ -299,8 +521,8 @@ class RegionCase(GahCase):
       reverse('download_roiss'),
       { 'projects[]': [1] }
     )
-    self.assertContains(r, '', status_code=200)
-    j = json.loads(r.content)
+    self.assertEqual(r.status_code, 200)
+    j = json.loads(r.getvalue())
     self.assertEqual(len(j), 3)
     rois = {
       region['grain_id']: region
@@ -317,6 +539,13 @@ class RegionCase(GahCase):
       [6, 7]
     ], rois[6]['regions'][0]["vertices"])
 
+  def test_backfill_region_areas(self):
+    Region.objects.update(area_pixels=None)
+    call_command('backfill_region_areas', stdout=io.StringIO())
+    region = Region.objects.get(grain__pk=5)
+    self.assertEqual(region.area_pixels, 19012)
+    self.assertFalse(Region.objects.filter(area_pixels__isnull=True).exists())
+
 class TutorialPageCase(GahCase):
   fixtures = [
     'essential.json',
@@ -367,8 +596,24 @@ class TutorialPageCase(GahCase):
     tps.all()
     self.assertEqual(len(tps), 1, 'should still be one tutorial page')
     tp = tps[0]
-    gp_count = GrainPoint.objects.filter(result=tp.marks.pk).count()
-    self.assertEqual(gp_count, LATLNG_COUNT)
+    self.assertEqual(tp.marks.get_track_count(), LATLNG_COUNT)
+    self.assertFalse(GrainPoint.objects.filter(result=tp.marks.pk).exists())
+
+  def test_pack_grain_points(self):
+    ftns = FissionTrackNumbering.objects.filter(grainpoint__isnull=False).distinct()
+    before = {
+      ftn.pk: (ftn.points(), ftn.get_latlngs(), ftn.get_track_count())
+      for ftn in ftns
+    }
+    self.assertNotEqual(len(before), 0, 'precondition failed, should be some grain points')
+    call_command('pack_grain_points', stdout=io.StringIO())
+    self.assertFalse(GrainPoint.objects.exists())
+    for (pk, (points, latlngs, count)) in before.items():
+      ftn = FissionTrackNumbering.objects.get(pk=pk)
+      self.assertIsNotNone(ftn.get_packed_points())
+      self.assertEqual(ftn.points(), points)
+      self.assertEqual(ftn.get_latlngs(), latlngs)
+      self.assertEqual(ftn.get_track_count(), count)
 
   def get_tutorial_page_grain_info(self, pk):
     r = self.client.get(reverse('tutorial_page', kwargs={'pk': pk}))
@@ -469,6 +714,85 @@ class PublicPageCase(GahCase):
       reverse('get_image', kwargs={ 'pk': 1 }),
     ])
 
+  def test_grain_image_conditional_get(self):
+    self.login_super()
+    image = Image.objects.get(pk=1)
+    url = reverse('get_image', kwargs={ 'pk': 1 })
+    r = self.client.get(url)
+    self.assertEqual(r.status_code, 200)
+    self.assertEqual(r['ETag'], '"{0}"'.format(image.sha256))
+    self.assertIn('Last-Modified', r)
+    self.assertIn('no-cache', r['Cache-Control'])
+    r = self.client.get(url, HTTP_IF_NONE_MATCH=r['ETag'])
+    self.assertEqual(r.status_code, 304)
+    r = self.client.get(url, HTTP_IF_NONE_MATCH='"other"')
+    self.assertEqual(r.status_code, 200)
+
+  def test_versioned_grain_image_is_immutable(self):
+    self.login_super()
+    image = Image.objects.get(pk=1)
+    r = self.client.get(image.get_absolute_url())
+    self.assertEqual(r.status_code, 200)
+    self.assertIn('immutable', r['Cache-Control'])
+    self.assertIn('private', r['Cache-Control'])
+    r = self.client.get(
+      reverse('get_image', kwargs={ 'pk': 1 }),
+      { 'v': 'out-of-date' }
+    )
+    self.assertEqual(r.status_code, 200)
+    self.assertNotIn('immutable', r['Cache-Control'])
+
+  @override_settings(IMAGE_ACCEL_REDIRECT='/image_store/')
+  def test_grain_image_accel_redirect(self):
+    image = Image.objects.get(pk=1)
+    url = image.get_absolute_url()
+    r = self.client.get(url)
+    self.assertForbidden(r)
+    self.assertNotIn('X-Accel-Redirect', r)
+    self.login_super()
+    r = self.client.get(url)
+    self.assertEqual(r.status_code, 200)
+    sha = image.sha256
+    self.assertEqual(
+      r['X-Accel-Redirect'],
+      '/image_store/{0}/{1}/{2}'.format(sha[:2], sha[2:4], sha)
+    )
+    self.assertEqual(r['Content-Type'], 'image/jpeg')
+    self.assertEqual(r['ETag'], '"{0}"'.format(sha))
+    self.assertIn('immutable', r['Cache-Control'])
+    self.assertEqual(r.content, b'')
+
+  def test_grain_image_tiles(self):
+    image = Image.objects.get(pk=1)
+    # The fixture's image data is not a real image
+    with open('test/crystals/john/p1/s1/Grain01/stack-01.jpg', 'rb') as fh:
+      image.data = fh.read()
+    image.save()
+    self.assertEqual(build_tiles(image.sha256), 0)
+    image.refresh_from_db()
+    self.assertEqual(image.tile_levels, 0)
+    url = image.get_tile_url_template().replace(
+      '{z}', '0'
+    ).replace('{x}', '0').replace('{y}', '0')
+    r = self.client.get(url)
+    self.assertForbidden(r)
+    self.login_super()
+    r = self.client.get(url)
+    self.assertEqual(r.status_code, 200)
+    self.assertEqual(r['Content-Type'], 'image/jpeg')
+    self.assertIn('immutable', r['Cache-Control'])
+    self.assertEqual(b''.join(r.streaming_content)[:2], b'\xff\xd8')
+    r = self.client.get(url, HTTP_IF_NONE_MATCH=r['ETag'])
+    self.assertEqual(r.status_code, 304)
+    r = self.client.get(reverse(
+      'get_image_tile', kwargs={ 'pk': 1, 'z': 1, 'x': 0, 'y': 0 }
+    ))
+    self.assertEqual(r.status_code, 404)
+    r = self.client.get(reverse(
+      'get_image_tile', kwargs={ 'pk': 1, 'z': 0, 'x': 1, 'y': 0 }
+    ))
+    self.assertEqual(r.status_code, 404)
+
   def test_analyst_page_publicness(self):
     self.run_publicness(gets = [
       reverse('analyses_page', kwargs={ 'pk': 1 })
@@ -505,6 +829,127 @@ class PublicPageCase(GahCase):
       j = json.loads(grain_info_json)
       return j
 
+class UploadProjectsCase(GahCase):
+  fixtures = [
+    'essential.json',
+    'users.json'
+  ]
+
+  def test_upload_projects(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      shutil.copytree('test/crystals/john', os.path.join(tmp, 'admin'))
+      # A sample with a grain missing its rois.json fails without
+      # leaving anything behind
+      os.makedirs(os.path.join(tmp, 'admin', 'p1', 's2', 'Grain01'))
+      shutil.copy(
+        'test/crystals/john/p1/s1/Grain01/stack-01.jpg',
+        os.path.join(tmp, 'admin', 'p1', 's2', 'Grain01')
+      )
+      # A project none of whose samples import is not created
+      shutil.copytree(
+        os.path.join(tmp, 'admin', 'p1', 's2'),
+        os.path.join(tmp, 'admin', 'p2', 's1')
+      )
+      out = io.StringIO()
+      with self.assertRaises(CommandError):
+        call_command(
+          'upload_projects', '--input', tmp, '--user', 'admin',
+          '--batch-size', '2', stdout=out, stderr=io.StringIO()
+        )
+    self.assertIn('Sample s1: 1 grains, 5 images', out.getvalue())
+    self.assertFalse(Project.objects.filter(project_name='p2').exists())
+    project = Project.objects.get(project_name='p1')
+    self.assertEqual(project.creator.username, 'admin')
+    self.assertEqual([s.sample_name for s in project.sample_set.all()], ['s1'])
+    grain = project.sample_set.get().grain_set.get()
+    self.assertEqual(grain.index, 1)
+    self.assertEqual(grain.region_set.count(), 1)
+    images = grain.image_set.order_by('ft_type', 'index')
+    self.assertEqual(
+      [(i.ft_type, i.index) for i in images],
+      [('I', 1), ('S', 1), ('S', 2), ('S', 3), ('S', 4)]
+    )
+    image = images.get(ft_type='S', index=1)
+    self.assertIsNotNone(image.focus)
+    with open('test/crystals/john/p1/s1/Grain01/stack-01.jpg', 'rb') as fh:
+      self.assertEqual(image.data, fh.read())
+
+@tag('integration')
+# The uploads are imported on worker threads with their own connections
+class IngestUploadsCase(TransactionTestCase):
+  fixtures = [
+    'essential.json',
+    'users.json'
+  ]
+
+  def ingest(self, tmp):
+    call_command(
+      'ingest_uploads', '--input', tmp, '--once', '--workers', '2',
+      stdout=io.StringIO(), stderr=io.StringIO()
+    )
+
+  def test_ingest_uploads(self):
+    finished = REGISTRY.get_sample_value(
+      'geochron_upload_jobs_finished_total', {'status': 'done'}
+    ) or 0
+    with tempfile.TemporaryDirectory() as tmp:
+      shutil.copytree('test/crystals/john', os.path.join(tmp, 'admin'))
+      shutil.copytree('test/crystals/john', os.path.join(tmp, 'counter'))
+      os.rename(
+        os.path.join(tmp, 'counter', 'p1'),
+        os.path.join(tmp, 'counter', 'p2')
+      )
+      # Nothing happens until the upload is committed
+      self.ingest(tmp)
+      self.assertFalse(UploadJob.objects.exists())
+      for user in ['admin', 'counter', 'nobody']:
+        os.makedirs(os.path.join(tmp, user), exist_ok=True)
+        open(os.path.join(tmp, user, 'do_commit'), 'w').close()
+      self.ingest(tmp)
+      jobs = UploadJob.objects.order_by('user__username')
+      self.assertEqual(
+        [(j.user.username, j.status) for j in jobs],
+        [('admin', 'D'), ('counter', 'D')]
+      )
+      self.assertIn('Sample s1: 1 grains, 5 images', jobs[0].log)
+      self.assertFalse(os.path.exists(os.path.join(tmp, 'admin', 'do_commit')))
+      self.assertFalse(os.path.exists(os.path.join(tmp, 'admin', 'p1')))
+      self.assertTrue(os.path.exists(os.path.join(tmp, 'nobody', 'do_commit.unknown-user')))
+    self.assertEqual(
+      REGISTRY.get_sample_value(
+        'geochron_upload_jobs_finished_total', {'status': 'done'}
+      ),
+      finished + 2
+    )
+    p1 = Project.objects.get(project_name='p1')
+    self.assertEqual(p1.creator.username, 'admin')
+    self.assertEqual(p1.sample_set.get().grain_set.get().image_set.count(), 5)
+    self.assertEqual(Project.objects.get(project_name='p2').creator.username, 'counter')
+
+  def test_failed_upload(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      os.makedirs(os.path.join(tmp, 'admin', 'p1', 's1', 'Grain01'))
+      open(os.path.join(tmp, 'admin', 'do_commit'), 'w').close()
+      with self.assertRaises(CommandError):
+        self.ingest(tmp)
+    job = UploadJob.objects.get()
+    self.assertEqual(job.status, 'F')
+    self.assertIn('no such grain file', job.log)
+    self.assertIsNotNone(job.finished)
+    self.assertFalse(Sample.objects.filter(sample_name='s1').exists())
+
+  def test_interrupted_upload_is_resumed(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      path = os.path.join(tmp, 'admin', '.jobs', '1')
+      shutil.copytree('test/crystals/john', path)
+      job = UploadJob.objects.create(
+        user=User.objects.get(username='admin'), path=path, status='R'
+      )
+      self.ingest(tmp)
+    job.refresh_from_db()
+    self.assertEqual(job.status, 'D')
+    self.assertTrue(Project.objects.filter(project_name='p1').exists())
+
 class GroupsTestCaseBase(GahCase):
   fixtures = [
     'essential.json',
@@ -552,6 +997,31 @@ class GroupsTestCase(GroupsTestCaseBase):
     self.assertEqual(grain_regions.count(), 1)
     self.assertIsNotNone(grain_regions.first().result)
 
+  def test_save_roi_stores_area(self):
+    self.login_counter()
+    grain_pk = 1
+    r = self.client.post(
+      reverse('grain_update_roi', kwargs={ 'pk': grain_pk }), {
+      'vertex_0_0_x': 0.1,
+      'vertex_0_0_y': 0.1,
+      'vertex_0_1_x': 0.5,
+      'vertex_0_1_y': 0.1,
+      'vertex_0_2_x': 0.5,
+      'vertex_0_2_y': 0.5,
+    })
+    self.assertLess(r.status_code, 400)
+    region = Region.objects.get(grain__pk=grain_pk, result__worker__username='counter')
+    self.assertIsNotNone(region.area_pixels)
+    self.assertEqual(region.area_pixels, region.area())
+    area = region.area_pixels
+    vertex = region.vertex_set.first()
+    vertex.x += 1
+    vertex.save()
+    region.refresh_from_db()
+    self.assertEqual(region.vertices[0], [vertex.x, vertex.y])
+    self.assertEqual(region.area_pixels, region.area())
+    self.assertNotEqual(region.area_pixels, area)
+
 
 class GroupsAndRoisTestCase(GroupsTestCaseBase):
   fixtures = GroupsTestCaseBase.fixtures + [
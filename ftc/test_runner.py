@@ -0,0 +1,33 @@
+import os
+import tempfile
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from ftc.image_store import get_image_store
+
+FIXTURE_IMAGES = os.path.join(os.path.dirname(__file__), 'fixtures', 'images')
+
+class ImageStoreTestRunner(DiscoverRunner):
+    """
+    Runs the tests with a temporary image store, holding the image
+    files that the fixtures refer to (from ftc/fixtures/images).
+    Tiles are made before the saving request returns, rather than in
+    the background, so that they are never written after the store
+    has gone.
+    """
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.old_image_store_root = settings.IMAGE_STORE_ROOT
+        self.old_image_tiles = settings.IMAGE_TILES
+        settings.IMAGE_TILES = 'immediate'
+        self.image_store_dir = tempfile.TemporaryDirectory()
+        settings.IMAGE_STORE_ROOT = self.image_store_dir.name
+        store = get_image_store()
+        for name in os.listdir(FIXTURE_IMAGES):
+            with open(os.path.join(FIXTURE_IMAGES, name), 'rb') as fh:
+                store.put(fh.read())
+
+    def teardown_test_environment(self, **kwargs):
+        settings.IMAGE_STORE_ROOT = self.old_image_store_root
+        settings.IMAGE_TILES = self.old_image_tiles
+        self.image_store_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
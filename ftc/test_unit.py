@@ -1,6 +1,35 @@
-from django.test import Client, TestCase, tag
+from datetime import datetime, timedelta
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import Client, TestCase, TransactionTestCase, override_settings, tag
+from django.utils import timezone
+from ftc.image_store import get_image_store
+from ftc.image_tiles import make_tiles, tile_levels_for
+from ftc.jobs import claim_job, enqueue, run_job, task, work
+from ftc.models import (
+    FissionTrackNumbering, Grain, GrainPoint, GrainPointCategory, Job, Project,
+    SampleSummary
+)
+from ftc.tasks import delete_object
 from ftc.parse_image_name import parse_upload_name
+from ftc.roi_geometry import (
+    points_in_polygons, polygon_area, polygon_contains_point
+)
+from ftc.save_rois_regions import save_regions, save_rois_regions
+from ftc.streaming import json_array_chunks
+from ftc.summaries import refresh_summaries
+from geochron.gah import gah
+import argparse
+import io
 import json
+import os
+from PIL import Image as PilImage
+import random
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
 
 
 @tag('unit')
@@ -40,3 +69,395 @@ class TestParseUploadName(TestCase):
             'flat': False, 'meta': False, 'is_image': True,
             'ft_type': 'S', 'index': 4, 'format': 'J'
         })
+
+
+def reference_contains_point(vertices, x, y):
+    """
+    Even-odd test, one edge and one point at a time.
+    """
+    last_v = vertices[-1]
+    total = 0
+    for v in vertices:
+        if (
+            ((v[0] <= x and x < last_v[0]) or (last_v[0] <= x and x < v[0]))
+            and (y < last_v[1] + (v[1] - last_v[1]) * (x - last_v[0]) / (v[0] - last_v[0]))
+        ):
+            total += 1
+        last_v = v
+    return total % 2 == 1
+
+
+@tag('unit')
+class TestRoiGeometry(TestCase):
+    square = [(10, 10), (90, 10), (90, 90), (10, 90)]
+    hole = [(40, 40), (60, 40), (60, 60), (40, 60)]
+
+    def test_area(self):
+        self.assertEqual(polygon_area(self.square), 6400)
+        self.assertEqual(polygon_area(list(reversed(self.square))), 6400)
+        self.assertEqual(polygon_area([]), 0)
+
+    def test_contains_point(self):
+        self.assertTrue(polygon_contains_point(self.square, 50, 50))
+        self.assertFalse(polygon_contains_point(self.square, 5, 50))
+        self.assertFalse(polygon_contains_point(self.square, 50, 95))
+
+    def test_hole(self):
+        self.assertListEqual(
+            points_in_polygons(
+                [self.square, self.hole],
+                [(50, 50), (20, 20), (0, 0), (50, 30)]
+            ),
+            [False, True, False, True]
+        )
+
+    def test_matches_point_by_point(self):
+        rng = random.Random(1)
+        polygons = [
+            [(rng.randint(0, 200), rng.randint(0, 200)) for _ in range(rng.randint(3, 12))]
+            for _ in range(3)
+        ]
+        points = [(rng.randint(0, 200), rng.randint(0, 200)) for _ in range(500)]
+        expected = [
+            sum(reference_contains_point(p, x, y) for p in polygons) % 2 == 1
+            for (x, y) in points
+        ]
+        self.assertListEqual(points_in_polygons(polygons, points), expected)
+
+
+@tag('unit')
+class TestSaveRegions(TestCase):
+    fixtures = [
+        'essential.json',
+        'users.json',
+        'projects.json',
+        'samples.json',
+        'grains.json'
+    ]
+
+    def test_save_rois_regions_in_one_query(self):
+        grain = Grain.objects.get(pk=1)
+        rois = { 'regions': [
+            { 'vertices': [[0, 0], [10.4, 0], [10.4, 10], [0, 10]] },
+            { 'shift': [0, 0] },
+            { 'vertices': [[20, 20], [30, 20], [20, 30]] },
+        ]}
+        with self.assertNumQueries(1):
+            regions = save_rois_regions(rois, grain)
+        self.assertEqual(len(regions), 2)
+        self.assertTrue(all(r.pk is not None for r in regions))
+        saved = list(grain.region_set.order_by('pk'))
+        self.assertEqual(saved[0].vertices, [[0, 0], [10, 0], [10, 10], [0, 10]])
+        self.assertEqual(saved[0].area_pixels, 100)
+        self.assertEqual(saved[1].area_pixels, 50)
+        self.assertIsNone(saved[1].result)
+
+    def test_vertices_are_truncated(self):
+        grain = Grain.objects.get(pk=1)
+        [region] = save_regions(grain, [
+            [[0.9, 0.6], [10.7, 0], [10.5, 10.99], [0, 10.5]]
+        ])
+        region.refresh_from_db()
+        self.assertEqual(region.vertices, [[0, 0], [10, 0], [10, 10], [0, 10]])
+        self.assertEqual(region.area_pixels, 100)
+
+
+@tag('unit')
+class TestPackedGrainPoints(TestCase):
+    fixtures = [
+        'essential.json',
+        'users.json',
+        'projects.json',
+        'samples.json',
+        'grains.json'
+    ]
+
+    def test_packed_points_match_grain_points(self):
+        grain = Grain.objects.get(pk=1)
+        latlngs = [[0.1234, 0.5678], [0.3339, 0.6667], [0.0571, 0.9993]]
+        unpacked = FissionTrackNumbering.objects.create(
+            grain=grain, ft_type='S', worker_id=102, result=3
+        )
+        track = GrainPointCategory.objects.get(name='track')
+        for (lat, lng) in latlngs:
+            GrainPoint.objects.create(
+                result=unpacked,
+                x_pixels=lng * grain.image_width,
+                y_pixels=grain.image_height - lat * grain.image_width,
+                category=track,
+                comment=''
+            )
+        packed = FissionTrackNumbering.objects.create(
+            grain=grain, ft_type='S', worker_id=101, result=3
+        )
+        packed.addGrainPointsFromLatlngs(latlngs)
+        self.assertIsNone(unpacked.get_packed_points())
+        self.assertIsNotNone(packed.get_packed_points())
+        self.assertEqual(packed.points(), unpacked.points())
+        self.assertEqual(packed.get_latlngs(), unpacked.get_latlngs())
+
+
+failures_left = []
+
+@task
+def flaky_task(value):
+    if failures_left:
+        failures_left.pop()
+        raise ValueError('not this time')
+    return value * 2
+
+
+@tag('unit')
+@override_settings(JOB_MAX_ATTEMPTS=3, JOB_RETRY_DELAY=10, JOB_TIMEOUT=60)
+class TestJobs(TestCase):
+    def test_job_runs(self):
+        job = enqueue(flaky_task, value=21)
+        self.assertEqual(work(burst=True), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'D')
+        self.assertEqual(job.result, 42)
+        self.assertIsNotNone(job.finished)
+
+    def test_retries_with_backoff(self):
+        failures_left[:] = [1, 1, 1]
+        job = enqueue(flaky_task, value=1)
+        for (attempt, delay) in [(1, 10), (2, 20)]:
+            before = timezone.now()
+            self.assertEqual(work(burst=True), 1)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), ('Q', attempt))
+            self.assertEqual(job.error, 'ValueError: not this time')
+            self.assertGreaterEqual(job.run_after, before + timedelta(seconds=delay))
+            # Not ready to run again yet
+            self.assertEqual(work(burst=True), 0)
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertEqual(work(burst=True), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('F', 3))
+        self.assertIsNotNone(job.finished)
+
+    def test_unknown_task_fails_at_once(self):
+        job = Job.objects.create(task='no_such_task')
+        self.assertEqual(work(burst=True), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('F', 1))
+
+    def test_abandoned_job_is_reclaimed(self):
+        job = enqueue(flaky_task, value=2)
+        self.assertEqual(claim_job().pk, job.pk)
+        # The worker running it has gone away
+        self.assertIsNone(claim_job())
+        Job.objects.filter(pk=job.pk).update(
+            heartbeat=timezone.now() - timedelta(seconds=61)
+        )
+        reclaimed = claim_job()
+        self.assertEqual((reclaimed.pk, reclaimed.attempts), (job.pk, 2))
+        run_job(reclaimed)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), ('D', 4))
+
+
+@task
+def slow_task(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+@tag('unit')
+# The heartbeat has its own connection, so must see committed jobs
+@override_settings(JOB_TIMEOUT=0.4)
+class TestJobHeartbeat(TransactionTestCase):
+    def test_slow_job_is_not_reclaimed(self):
+        job = enqueue(slow_task, seconds=1.2)
+        claimed = claim_job()
+
+        def run():
+            try:
+                run_job(claimed)
+            finally:
+                connection.close()
+
+        worker = threading.Thread(target=run)
+        worker.start()
+        try:
+            # Well past JOB_TIMEOUT since the job was claimed
+            time.sleep(0.8)
+            self.assertIsNone(claim_job())
+        finally:
+            worker.join()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('D', 1))
+
+
+@tag('unit')
+# The workers are separate processes with their own connections
+class TestRunWorkers(TransactionTestCase):
+    fixtures = [
+        'essential.json',
+        'users.json',
+        'projects.json'
+    ]
+
+    def test_workers_share_the_queue(self):
+        jobs = [
+            enqueue(delete_object, model='ftc.Project', pk=pk)
+            for pk in Project.objects.values_list('pk', flat=True)
+        ] + [enqueue(flaky_task, value=n) for n in range(6)]
+        call_command(
+            'runworkers', '--workers', '3', '--burst', stdout=io.StringIO()
+        )
+        self.assertFalse(Project.objects.exists())
+        for job in jobs:
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), ('D', 1))
+        self.assertEqual(
+            sorted(j.result for j in jobs if j.task == 'flaky_task'),
+            [0, 2, 4, 6, 8, 10]
+        )
+
+
+@tag('unit')
+# The two counters need connections of their own
+class TestRefreshSummaries(TransactionTestCase):
+    fixtures = [
+        'essential.json',
+        'users.json',
+        'projects.json',
+        'samples.json',
+        'grains.json',
+        'grains2.json'
+    ]
+
+    def test_concurrent_refreshes_of_a_sample(self):
+        refresh_summaries(sample_ids=[1])
+        refreshed = threading.Event()
+        finish = threading.Event()
+
+        def count_grain_1():
+            try:
+                with transaction.atomic():
+                    FissionTrackNumbering.objects.create(
+                        grain_id=1, ft_type='S', worker_id=102, result=4
+                    )
+                    refresh_summaries([1])
+                    refreshed.set()
+                    finish.wait(5)
+            finally:
+                connection.close()
+
+        def count_grain_3():
+            try:
+                FissionTrackNumbering.objects.create(
+                    grain_id=3, ft_type='S', worker_id=102, result=5
+                )
+                refresh_summaries([3])
+            finally:
+                connection.close()
+
+        first = threading.Thread(target=count_grain_1)
+        first.start()
+        self.assertTrue(refreshed.wait(5))
+        second = threading.Thread(target=count_grain_3)
+        second.start()
+        # The second refresh waits for the first to commit
+        second.join(0.5)
+        self.assertTrue(second.is_alive())
+        finish.set()
+        first.join()
+        second.join()
+        summary = SampleSummary.objects.get(pk=1)
+        self.assertEqual((summary.ns, summary.counted_grain_count), (9, 2))
+
+
+@tag('unit')
+class TestImageTiles(TestCase):
+    def test_tile_levels(self):
+        self.assertEqual(tile_levels_for(1, 1), 0)
+        self.assertEqual(tile_levels_for(256, 100), 0)
+        self.assertEqual(tile_levels_for(257, 100), 1)
+        self.assertEqual(tile_levels_for(100, 1024), 2)
+        self.assertEqual(tile_levels_for(1025, 1024), 3)
+
+    def tile_size(self, sha256, z, x, y):
+        with get_image_store().open_tile(sha256, z, x, y) as fh:
+            return PilImage.open(fh).size
+
+    def test_make_tiles(self):
+        buf = io.BytesIO()
+        PilImage.new('RGB', (600, 300), (200, 100, 0)).save(buf, 'PNG')
+        store = get_image_store()
+        sha256 = store.put(buf.getvalue())
+        self.assertIsNone(store.tile_levels(sha256))
+        self.assertEqual(make_tiles(sha256), 2)
+        self.assertEqual(store.tile_levels(sha256), 2)
+        # Full size: 3x2 tiles, cut short at the right and bottom
+        self.assertEqual(self.tile_size(sha256, 2, 0, 0), (256, 256))
+        self.assertEqual(self.tile_size(sha256, 2, 2, 1), (88, 44))
+        self.assertFalse(os.path.exists(store.tile_path(sha256, 2, 3, 0)))
+        # Half size: 300x150
+        self.assertEqual(self.tile_size(sha256, 1, 1, 0), (44, 150))
+        self.assertFalse(os.path.exists(store.tile_path(sha256, 1, 0, 1)))
+        # Quarter size: 150x75
+        self.assertEqual(self.tile_size(sha256, 0, 0, 0), (150, 75))
+
+
+@tag('unit')
+class TestStreaming(TestCase):
+    def test_json_array_chunks(self):
+        def items():
+            for n in range(3):
+                yield { 'n': n, 'when': datetime(2024, 1, n + 1) }
+        chunks = list(json_array_chunks(items()))
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(json.loads(b''.join(chunks)), [
+            { 'n': n, 'when': '2024-01-0{0}T00:00:00'.format(n + 1) }
+            for n in range(3)
+        ])
+        self.assertEqual(b''.join(json_array_chunks([])), b'[]')
+
+
+@tag('unit')
+class TestGahUploadManifest(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.grain_dir = os.path.join(self.dir, 'Grain01')
+        shutil.copytree('test/crystals/john/p1/s1/Grain01', self.grain_dir)
+        self.uploads = []
+        for (name, f) in [
+            ('grain_new_with_id', lambda opts, config: 7),
+            ('grain_exists', lambda opts, config, grain: True),
+            ('try_image_upload', self.image_upload)
+        ]:
+            patcher = mock.patch.object(gah, name, f)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def image_upload(self, grain, image, config, id=None):
+        self.uploads.append((os.path.basename(image), id))
+        return (id or 100 + len(self.uploads), None)
+
+    def upload(self):
+        opts = argparse.Namespace(
+            root=self.grain_dir,
+            rois=os.path.join(self.grain_dir, 'rois.json'),
+            sample=2,
+            index=None,
+            manifest=gah.UploadManifest(self.dir, 'http://testserver/')
+        )
+        return gah.upload_grain(opts, {}, 1)
+
+    def test_changed_metadata_uploads_image_again(self):
+        self.assertEqual(self.upload(), (5, []))
+        manifest = gah.UploadManifest(self.dir, 'http://testserver/')
+        image_id = manifest.grain(self.grain_dir)['images']['stack-01.jpg']['id']
+        self.uploads.clear()
+        self.assertEqual(self.upload(), (0, []))
+        self.assertEqual(self.uploads, [])
+        meta = os.path.join(self.grain_dir, 'stack-01.jpg_metadata.xml')
+        with open(meta, 'a') as fh:
+            fh.write('\n')
+        self.assertEqual(self.upload(), (1, []))
+        # the server's image is replaced rather than duplicated
+        self.assertEqual(self.uploads, [('stack-01.jpg', image_id)])
@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import OutputWrapper
+from django.db import connection
+from django.utils import timezone
+from ftc.models import UploadJob
+from ftc.project_import import ProjectImporter
+from prometheus_client import Counter, Gauge, Histogram
+import io
+import os
+import time
+
+# The file a user's upload tool creates when the upload is complete
+COMMIT_FILE = 'do_commit'
+# Where, within a user's upload directory, queued uploads are kept
+JOBS_DIR = '.jobs'
+
+queue_depth = Gauge(
+    'geochron_upload_jobs_queued',
+    'Number of uploads waiting to be imported'
+)
+processing_seconds = Histogram(
+    'geochron_upload_job_seconds',
+    'Time taken to import an upload',
+    buckets=(1, 5, 15, 60, 300, 900, 3600, float('inf'))
+)
+jobs_finished = Counter(
+    'geochron_upload_jobs_finished',
+    'Number of uploads imported',
+    ['status']
+)
+
+def queue_drop(user_dir, user):
+    """
+    Moves everything uploaded to `user_dir` into a directory of its
+    own, removes the commit file and returns a new queued UploadJob
+    to import it as projects owned by `user`.
+    """
+    job = UploadJob.objects.create(user=user, path='')
+    path = os.path.join(user_dir, JOBS_DIR, str(job.pk))
+    os.makedirs(path)
+    for name in os.listdir(user_dir):
+        if not name.startswith('.') and name != COMMIT_FILE:
+            os.rename(os.path.join(user_dir, name), os.path.join(path, name))
+    os.remove(os.path.join(user_dir, COMMIT_FILE))
+    job.path = path
+    job.save(update_fields=['path'])
+    queue_depth.inc()
+    return job
+
+def requeue_interrupted():
+    """
+    Puts jobs that were running when the ingester last stopped back
+    on the queue and returns the ids of all queued jobs, oldest first.
+    """
+    UploadJob.objects.filter(status='R').update(status='Q', started=None)
+    ids = list(UploadJob.objects.filter(
+        status='Q'
+    ).order_by('queued').values_list('pk', flat=True))
+    queue_depth.set(len(ids))
+    return ids
+
+def run_upload_job(job_id, jobs=4, batch_size=100):
+    """
+    Imports the projects of the queued UploadJob `job_id`, recording
+    its status and log in the job, which is returned. Returns None if
+    the job was not queued. Intended to be run on a worker thread.
+    """
+    try:
+        started = UploadJob.objects.filter(pk=job_id, status='Q').update(
+            status='R', started=timezone.now()
+        )
+        if not started:
+            return None
+        queue_depth.dec()
+        job = UploadJob.objects.select_related('user').get(pk=job_id)
+        log = io.StringIO()
+        out = OutputWrapper(log)
+        start = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                importer = ProjectImporter(pool, out, out, batch_size)
+                failed = importer.import_projects(job.path, job.user)
+            job.status = 'F' if failed else 'D'
+        except Exception as e:
+            out.write('Upload failed: {0}'.format(e))
+            job.status = 'F'
+        processing_seconds.observe(time.monotonic() - start)
+        jobs_finished.labels(job.get_status_display().lower()).inc()
+        job.log = log.getvalue()
+        job.finished = timezone.now()
+        job.save(update_fields=['status', 'log', 'finished'])
+        return job
+    finally:
+        connection.close()
@@ -4,7 +4,7 @@ from rest_framework_simplejwt import views as jwt_views
 from ftc import apiviews
 from ftc.views import (home, signmeup, report, getTableData,
     count_grain, updateFtnResult, counting, saveWorkingGrain,
-    get_image, projects, ProjectCreateView,
+    get_image, get_image_tile, get_grain_image_bundle, projects, ProjectCreateView,
     ProjectDetailView, ProjectUpdateView,
     SampleDetailView, SampleUpdateView, SampleCreateView,
     GrainDetailView, MicaDetailView, GrainCreateView,
@@ -49,6 +49,8 @@ urlpatterns = [
     path('grain/<pk>/update_shift', grain_update_shift, name='grain_update_shift'),
     # Table of metadata + table of images + upload form to upload metadata, grain images or rois.json
     path('grain/<pk>/images', GrainImagesView.as_view(), name='grain_images'),
+    # All of a grain's images of one type (S or I) in one multipart response
+    path('grain/<pk>/image_bundle/<ft_type>/', get_grain_image_bundle, name='get_grain_image_bundle'),
     path('grain/<pk>/analyst/', GrainAnalysesView.as_view(), name='analyses_page'),
     path('grain/<grain>/analyst/<analyst>/', grainAnalystResult, name='grain_analyst_result'),
     # Not navigable to, but referenced in README.md
@@ -66,6 +68,7 @@ urlpatterns = [
     path('count_my_mica/<pk>/', CountMyGrainMicaView.as_view(), name='count_my_mica'),
     path('saveWorkingGrain/', saveWorkingGrain, name='saveWorkingGrain'),
     path('image/<pk>/', get_image, name="get_image"),
+    path('image/<pk>/tiles/<int:z>/<int:x>/<int:y>.jpg', get_image_tile, name="get_image_tile"),
     path('image/<pk>/delete', ImageDeleteView.as_view(), name='image_delete'),
     path('tutorial/', tutorial, name='tutorial'),
     path('tutorial_result/', saveTutorialResult, name='tutorial_result'),
@@ -87,7 +90,9 @@ urlpatterns = [
     path('api/project/<pk>/', ProjectInfoView.as_view(), name='api_project_info'),
     path('api/sample/', SampleListView.as_view(), name='api_sample_list'),
     path('api/sample/<pk>/', SampleInfoView.as_view(), name='api_sample_info'),
+    path('api/sample/<sample>/inventory/', apiviews.get_sample_inventory, name='api_sample_inventory'),
     path('api/sample/<sample>/grain/', SampleGrainListView.as_view(), name='api_sample_grain_list'),
+    path('api/sample/<sample>/grain/archive/', apiviews.create_grain_from_archive, name='api_sample_grain_archive'),
     path('api/sample/<sample>/grain/<index>/', SampleGrainInfoView.as_view(), name='api_sample_grain_list'),
     path('api/grain/', GrainListView.as_view(), name='api_grain_list'),
     path('api/grain/<pk>/', GrainInfoView.as_view(), name='api_grain_info'),
@@ -95,9 +100,12 @@ urlpatterns = [
     path('api/grain/<pk>/rois/<user>/', get_grain_rois_user, name='api_grain_rois_user'),
     path('api/rois/', get_many_roiss, name='api_roiss'),
     path('api/grain/<grain>/image/', GrainImageListView.as_view(), name='api_grain_image_list'),
+    path('api/grain/<grain>/image/bundle/<ft_type>/', apiviews.get_grain_image_bundle, name='api_grain_image_bundle'),
     path('api/image/', ImageListView.as_view(), name='api_image_list'),
     path('api/image/<pk>/', ImageInfoView.as_view(), name='api_image_info'),
     path('api/image/<pk>/data/', apiviews.get_image, name='api_image_data'),
     path('api/count/', FissionTrackNumberingView.as_view(), name='api_ftn_list'),
     path('api/countll/', FissionTrackNumberingViewLatLngs.as_view(), name='api_ftn_list'),
+    path('api/count/export/<export_format>/', apiviews.get_count_export, name='api_count_export'),
+    path('api/job/<pk>/', apiviews.JobInfoView.as_view(), name='api_job_info'),
 ]
@@ -1,6 +1,8 @@
 from django.shortcuts import render, get_object_or_404
 from django.db import transaction
-from django.db.models import Exists, OuterRef, Q, Subquery, Prefetch
+from django.db.models import (Exists, ExpressionWrapper, F, FloatField,
+    OuterRef, Q, Subquery, Sum, Prefetch, Value)
+from django.db.models.functions import Coalesce
 from django.db.models.aggregates import Max
 from django.forms import (ModelForm, CharField, Textarea, FileField,
     ClearableFileInput, ValidationError)
@@ -10,30 +12,41 @@ from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.views.generic.list import ListView
 from django.urls import reverse
 from django.http import (HttpResponse, HttpResponseRedirect,
-    HttpResponseForbidden)
+    HttpResponseBadRequest, HttpResponseForbidden, FileResponse, Http404, StreamingHttpResponse)
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import UserPassesTestMixin
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied, ObjectDoesNotExist
+from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from django.shortcuts import redirect
 
-from ftc.apiviews import request_roiss
+from ftc.apiviews import ImageSerializer, make_transform, request_roiss_grains
 from ftc.get_image_size import get_image_size_from_handle
 from ftc.grain_uinfo import choose_working_grain
+from ftc.image_store import get_image_store
+from ftc.image_tiles import schedule_tiles
 from ftc.load_rois import get_rois, load_rois_from_regions
 from ftc.models import (Project, Sample, FissionTrackNumbering, Image, Grain,
-    TutorialResult, Region, Vertex, GrainPointCategory,
+    TutorialResult, Region, GrainPointCategory,
     TutorialPage, RegionOfInterest)
 from ftc.parse_image_name import parse_upload_name
+from ftc.save_rois_regions import save_regions, save_rois_regions
+from ftc.streaming import Echo, streaming_json_response
+from ftc.summaries import ensure_summaries, refresh_summaries
 from geochron.gah.gah import parse_metadata_grain, parse_metadata_image
 from geochron.settings import IMAGE_UPLOAD_SIZE_LIMIT
 
 import csv
 import enum
+import hashlib
 import io
+import itertools
 import json
+import os
 
 #
 def home(request):
@@ -188,6 +201,15 @@ class SampleDetailView(UserHasProjectAccess, DetailView):
     model = Sample
     template_name = "ftc/sample.html"
 
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ensure_summaries([self.object.pk])
+        ctx['summary'] = self.object.summary
+        ctx['grains'] = self.object.grain_set.select_related(
+            'summary'
+        ).order_by('index')
+        return ctx
+
 
 class SampleCreateView(ParentCreatorOrSuperuserMixin, CreateView):
     model = Sample
@@ -228,8 +250,8 @@ class GrainDetailView(UserHasProjectAccess, DetailView):
     def get_regions_json(self, w, h):
         return json_array([
             json_array([
-                self.json_latlng((h - vertex.y) / w, vertex.x / w)
-                for vertex in region.vertex_set.order_by('id').iterator()
+                self.json_latlng((h - y) / w, x / w)
+                for (x, y) in region.vertices
             ])
             for region in self.object.get_regions_specific(
                 self.request.user
@@ -339,6 +361,7 @@ class GrainForm(ModelForm):
                 'stage_y': rois_json.get('stage_y'),
                 'mica_stage_x': rois_json.get('mica_stage_x'),
                 'mica_stage_y': rois_json.get('mica_stage_y'),
+                'mica_transform': rois_json.get('mica_transform'),
                 'regions': regions
             }
         except Exception as e:
@@ -478,13 +501,8 @@ class GrainForm(ModelForm):
         Region.objects.filter(grain=self.instance).delete()
 
     def save_region(self, vertices, commit=True):
-        region = Region(grain=self.instance)
         if commit:
-            region.save()
-        for v in vertices:
-            vertex = Vertex(region=region, x=v[0], y=v[1])
-            if commit:
-                vertex.save()
+            save_regions(self.instance, [vertices])
 
     def save_images(self):
         for (ft_type, ims) in self.cleaned_data['images'].items():
@@ -496,7 +514,23 @@ class GrainForm(ModelForm):
                     defaults=f
                 )
 
-    def save(self, commit=True):
+    def default_region(self):
+        """
+        Returns the vertices of a region covering most of the grain,
+        for grains uploaded without a rois.json file.
+        """
+        width = self.cleaned_data['image_width']
+        height = self.cleaned_data['image_height']
+        margin_x = width / 20
+        margin_y = height / 20
+        return [
+            [margin_x, margin_y],
+            [width - margin_x, margin_y],
+            [width - margin_x, height - margin_y],
+            [margin_x, height - margin_y]
+        ]
+
+    def set_instance_fields(self):
         if hasattr(self, 'grain_index'):
             self.instance.index = self.grain_index
         sample = getattr(self, 'sample', None)
@@ -506,14 +540,53 @@ class GrainForm(ModelForm):
             'stage_x', 'stage_y', 'shift_x', 'shift_y']:
             if attr in self.cleaned_data:
                 setattr(self.instance, attr, self.cleaned_data[attr])
+
+    @transaction.atomic
+    def save_new(self):
+        """
+        Saves the form as a new grain (next_grain_number must have been
+        called first), inserting its regions and images in bulk.
+        Returns the grain.
+        """
+        images = [
+            Image(grain=self.instance, **f)
+            for ims in self.cleaned_data['images'].values()
+            for f in ims.values()
+        ]
+        for image in images:
+            if not image.sha256:
+                raise ValidationError(
+                    "Metadata for image %(index)s (%(ft_type)s) has no image",
+                    params={'index': image.index, 'ft_type': image.ft_type},
+                    code='metadata-without-image'
+                )
+        self.set_instance_fields()
+        rois = self.cleaned_data['rois']
+        if rois is not None and rois.get('mica_transform'):
+            self.instance.mica_transform_matrix = make_transform(
+                rois['mica_transform']
+            )
+        self.instance.save()
+        if rois is None:
+            save_regions(self.instance, [self.default_region()])
+        else:
+            save_rois_regions(rois, self.instance)
+        Image.objects.bulk_create(images)
+        for image in images:
+            if image.tile_levels is None:
+                schedule_tiles(image.sha256)
+        return self.instance
+
+    def save(self, commit=True):
+        self.set_instance_fields()
         inst = super().save(commit)
         rois = self.cleaned_data['rois']
-        if rois is not None:
+        if rois is not None and commit:
             self.delete_regions()
-            for region in rois['regions']:
-                if 'vertices' in region:
-                    self.save_region(region['vertices'], commit)
+            save_rois_regions(rois, self.instance)
         self.save_images()
+        if commit:
+            refresh_summaries([self.instance.pk])
         return inst
 
 
@@ -532,16 +605,7 @@ class GrainCreateView(ParentCreatorOrSuperuserMixin, CreateView):
         form.next_grain_number(self.parent_object)
         rtn = self.form_valid(form)
         if 'rois' not in form.cleaned_data or form.cleaned_data['rois'] is None:
-            width = form.cleaned_data['image_width']
-            height = form.cleaned_data['image_height']
-            margin_x = width / 20
-            margin_y = height / 20
-            form.save_region([
-                [margin_x, margin_y],
-                [width - margin_x, margin_y],
-                [width - margin_x, height - margin_y],
-                [margin_x, height - margin_y]
-            ])
+            form.save_region(form.default_region())
         return rtn
 
     def get_success_url(self):
@@ -562,6 +626,11 @@ class GrainDeleteView(CreatorOrSuperuserMixin, DeleteView):
         return ctx
     def get_success_url(self):
         return reverse('sample', args=[self.object.sample.id])
+    def form_valid(self, form):
+        sample_id = self.object.sample_id
+        response = super().form_valid(form)
+        refresh_summaries(sample_ids=[sample_id])
+        return response
 
 class GrainImagesView(UserHasProjectAccess, UpdateView):
     model = Grain
@@ -610,16 +679,11 @@ def publicSample(request, sample, grain, ft_type):
         # it's not public, but the creator and superusers can see it
         if user != request.user and not request.user.is_superuser:
             raise PermissionDenied('This sample is not public')
-    result_query = Subquery(FissionTrackNumbering.objects.filter(
-        worker=user,
-        grain=OuterRef('id'),
-        result__gte=0
-    ))
-    grains_in_sample = Grain.objects.annotate(
-        result_exists=Exists(result_query)
-    ).filter(
-        sample=sample,
-        result_exists=True
+    # Grains the owner has submitted counts for
+    ensure_summaries([sample])
+    grains_in_sample = Grain.objects.filter(
+        Q(summary__ns__gte=0) | Q(summary__ni__gte=0),
+        sample=sample
     )
     next = grains_in_sample.filter(
         index__gt=grain
@@ -627,12 +691,11 @@ def publicSample(request, sample, grain, ft_type):
     prev = grains_in_sample.filter(
         index__lt=grain
     ).order_by('-index').first()
-    types = FissionTrackNumbering.objects.filter(
-        worker=user,
-        grain=g.pk,
-        result__gte=0,
-    ).order_by('-ft_type').values_list('ft_type').distinct()
-    type_set = {ftt for ftts in types for ftt in ftts}
+    summary = g.summary
+    type_set = {
+        ftt for (ftt, count) in [('S', summary.ns), ('I', summary.ni)]
+        if count is not None and 0 <= count
+    }
     if len(type_set) == 0:
         raise ObjectDoesNotExist('No such result')
     has_mica_button = False
@@ -781,14 +844,14 @@ def grain_update_roi(request, pk):
         else:
             region_filter &= Q(result=result)
         Region.objects.filter(region_filter).delete()
-        for _, vertices in sorted(regions.items()):
-            region = Region(grain=grain, result=result)
-            region.save()
-            for _, v in sorted(vertices.items()):
-                x = float(v['x']) * w
-                y = h - float(v['y']) * w
-                vertex = Vertex(region=region, x=x, y=y)
-                vertex.save()
+        save_regions(grain, [
+            [
+                [float(v['x']) * w, h - float(v['y']) * w]
+                for _, v in sorted(vertices.items())
+            ]
+            for _, vertices in sorted(regions.items())
+        ], result)
+        refresh_summaries([grain.pk])
 
     return redirect('grain', pk=pk)
 
@@ -804,8 +867,94 @@ def grain_update_shift(request, pk):
     grain.save()
     return redirect('mica', pk=pk)
 
+# The report table's columns, as fields of an annotated result
+TABLE_COLUMNS = [
+    'grain__sample__in_project__project_name',
+    'grain__sample__sample_name',
+    'grain__index',
+    'ft_type',
+    'result',
+    'worker__username',
+    'create_date',
+    'area_micron2',
+]
+# The indices of the columns that the table's search box looks in
+TABLE_SEARCH_COLUMNS = [0, 1, 3, 5]
+
+def region_area_total(**filters):
+    return Subquery(Region.objects.filter(
+        **filters
+    ).order_by().values('grain').annotate(
+        total=Sum('area_pixels')
+    ).values('total'))
+
+def with_roi_area(results):
+    """
+    Annotates the FissionTrackNumbering queryset `results` with the
+    area of each one's region of interest in square microns as
+    area_micron2, as roi_area_micron2() would calculate it but from
+    the stored region areas and grain summaries, within the same
+    query.
+    """
+    area_pixels = Coalesce(
+        region_area_total(result=OuterRef('pk')),
+        F('grain__summary__roi_area_pixels'),
+        Value(0.0)
+    )
+    return results.annotate(area_micron2=ExpressionWrapper(
+        F('grain__scale_x') * F('grain__scale_y') * area_pixels * Value(1e12),
+        output_field=FloatField()
+    ))
+
+def search_table(rows, params):
+    """
+    Filters `rows` by the search parameters of a DataTables server-side
+    request: every word of the global search must appear in one of
+    the searchable text columns, and each column search in its column.
+    """
+    columns = params.get('columns') or []
+    searchable = [
+        i for i in TABLE_SEARCH_COLUMNS
+        if len(columns) <= i or columns[i].get('searchable', True)
+    ]
+    value = (params.get('search') or {}).get('value') or ''
+    for word in value.split():
+        q = Q()
+        for i in searchable:
+            q |= Q(**{ TABLE_COLUMNS[i] + '__icontains': word })
+        rows = rows.filter(q)
+    for (i, column) in enumerate(columns):
+        value = (column.get('search') or {}).get('value')
+        if value and i in searchable:
+            rows = rows.filter(**{ TABLE_COLUMNS[i] + '__icontains': value })
+    return rows
+
+def order_table(rows, params):
+    """
+    Orders `rows` by the order parameters of a DataTables server-side
+    request.
+    """
+    keys = []
+    for order in params.get('order') or []:
+        column = int(order['column'])
+        if not 0 <= column < len(TABLE_COLUMNS):
+            raise IndexError(column)
+        field = F(TABLE_COLUMNS[column])
+        if order.get('dir') == 'desc':
+            keys.append(field.desc(nulls_last=True))
+        else:
+            keys.append(field.asc(nulls_first=True))
+    return rows.order_by(*keys, 'pk')
+
 @login_required
 def getTableData(request):
+    """
+    Returns the results for the samples in the JSON body's
+    client_response. If the body has the parameters of a DataTables
+    server-side request (draw, start, length, order, search and
+    columns) just the requested page is returned, otherwise every
+    result is returned as aaData.
+    """
     if not user_is_staff(request.user):
         raise PermissionDenied
     # http://owtrsnc.blogspot.co.uk/2013/12/sending-ajax-data-json-to-django.html
@@ -813,32 +962,40 @@ def getTableData(request):
     # assuming request.body contains json data which is UTF-8 encoded
     json_str = request.body.decode(encoding='UTF-8')
     # turn the json bytestr into a python obj
-    json_obj = json.loads(json_str)
-    sample_list = json_obj['client_response']
-    res = []
-    ftq = FissionTrackNumbering.objects.filter(result__gte=0)
+    params = json.loads(json_str)
+    results = FissionTrackNumbering.objects.filter(
+        result__gte=0,
+        grain__sample__in=params['client_response']
+    )
     if not request.user.is_superuser:
-        ftq = ftq.filter(grain__sample__in_project__creator=request.user)
-    for sample_id in sample_list:
-        fts = ftq.filter(
-            grain__sample=sample_id
-        ).select_related(
-            'grain__sample__in_project'
+        results = results.filter(grain__sample__in_project__creator=request.user)
+    ensure_summaries(params['client_response'])
+    rows = with_roi_area(results)
+    if 'draw' not in params:
+        return HttpResponse(
+            json.dumps({
+                'aaData': list(rows.values_list(*TABLE_COLUMNS))
+            }, cls=DjangoJSONEncoder),
+            content_type='application/json'
         )
-        for ft in fts:
-            a = [
-                ft.grain.sample.in_project.project_name,
-                ft.grain.sample.sample_name,
-                ft.grain.index,
-                ft.ft_type,
-                ft.result,
-                ft.worker.username,
-                ft.create_date,
-                ft.roi_area_micron2(),
-            ]
-            res.append(a)
+    try:
+        total = results.count()
+        filtered_rows = search_table(rows, params)
+        filtered = total if filtered_rows is rows else filtered_rows.count()
+        start = max(int(params.get('start', 0)), 0)
+        length = int(params.get('length', -1))
+        page = order_table(filtered_rows, params).values_list(*TABLE_COLUMNS)
+        page = page[start:start + length] if 0 <= length else page[start:]
+        data = list(page)
+    except (ValueError, TypeError, KeyError, IndexError, AttributeError):
+        return HttpResponseBadRequest('Bad DataTables parameters')
     return HttpResponse(
-        json.dumps({ 'aaData' : res }, cls=DjangoJSONEncoder),
+        json.dumps({
+            'draw': int(params['draw']),
+            'recordsTotal': total,
+            'recordsFiltered': filtered,
+            'data': data
+        }, cls=DjangoJSONEncoder),
         content_type='application/json'
     )
 
@@ -872,35 +1029,25 @@ def json_grain_result(grain):
         j[field] = getattr(grain, field)
     return j
 
-def getGrainsWithResults(request):
-    gq = Grain.objects.filter(
-        results__result__gte=0
+JSON_CHUNK_SIZE = 100
+
+def grains_with_results(request):
+    """
+    The grains with the results getJsonResults should return, read a
+    chunk at a time.
+    """
+    return Grain.objects.filter(
+        pk__in=results_requested(request).values('grain_id')
+    ).select_related(
+        'sample__in_project'
     ).prefetch_related(
         Prefetch(
             lookup='results',
             queryset=FissionTrackNumbering.objects.filter(
                 result__gte=0
-            )
+            ).select_related('worker').prefetch_related('region_set')
         ),
-        'results__worker',
-        'sample',
-        'sample__in_project',
-        'region_set',
-        'region_set__vertex_set'
-    )
-    if 'samples[]' in request.GET:
-        gq = gq.filter(
-            sample__in=request.GET.getlist('samples[]')
-        )
-    if not request.user.is_superuser:
-        gq = gq.filter(
-            sample__in_project__creator=request.user.id
-        )
-    grains = {}
-    for g in gq:
-        if g.id not in grains:
-            grains[g.id] = g
-    return grains
+    ).order_by('pk').iterator(chunk_size=JSON_CHUNK_SIZE)
 
 @login_required
 def download_rois(request, pk):
@@ -916,35 +1063,58 @@ def download_rois(request, pk):
 def download_roiss(request):
     if not user_is_staff(request.user):
         raise PermissionDenied
-    return HttpResponse(
-        json.dumps(request_roiss(request)),
-        content_type='application/json'
+    grains = request_roiss_grains(request).iterator(chunk_size=JSON_CHUNK_SIZE)
+    return streaming_json_response(
+        request, (get_rois(g) for g in grains)
     )
 
 @login_required
 def getJsonResults(request):
     if not user_is_staff(request.user):
         raise PermissionDenied
-    grains = getGrainsWithResults(request)
-    result = [json_grain_result(g) for g in grains.values()]
-    return HttpResponse(
-        json.dumps(result, cls=DjangoJSONEncoder),
-        content_type='application/json'
+    return streaming_json_response(
+        request, (json_grain_result(g) for g in grains_with_results(request))
     )
 
-@login_required
-def getCsvResults(request):
-    if not user_is_staff(request.user):
-        raise PermissionDenied
-    grains = getGrainsWithResults(request)
-    response = HttpResponse(
-        content_type='text/csv',
-        headers={
-            'Content-Disposition': 'attachment; filename="results.csv"'
-        }
-    )
-    writer = csv.writer(response)
-    writer.writerow([
+def results_requested(request):
+    """
+    The counting results that getJsonResults and getCsvResults should
+    return for the samples[] in the request.
+    """
+    fq = FissionTrackNumbering.objects.filter(result__gte=0)
+    if 'samples[]' in request.GET:
+        fq = fq.filter(grain__sample__in=request.GET.getlist('samples[]'))
+    if not request.user.is_superuser:
+        fq = fq.filter(grain__sample__in_project__creator=request.user.id)
+    return fq
+
+def grain_areas(regions):
+    """
+    Yields (grain_id, generic_area, {result_id: area}) for each grain
+    in `regions`, an iterable of (grain_id, result_id, area_pixels,
+    vertices) ordered by grain_id.
+    """
+    for (grain_id, rows) in itertools.groupby(regions, key=lambda r: r[0]):
+        generic = 0
+        specific = {}
+        for (_, result_id, area_pixels, vertices) in rows:
+            area = Region(area_pixels=area_pixels, vertices=vertices).area()
+            if result_id is None:
+                generic += area
+            else:
+                specific[result_id] = specific.get(result_id, 0) + area
+        yield (grain_id, generic, specific)
+
+CSV_CHUNK_SIZE = 2000
+
+def csv_results_rows(results):
+    """
+    Yields the header and then a row for each result in `results` (a
+    queryset of FissionTrackNumbering), reading the results and their
+    regions through two server-side cursors so that neither the query
+    count nor the memory used grows with the number of results.
+    """
+    yield [
         'project_name',
         'sample_name',
         'index',
@@ -955,26 +1125,56 @@ def getCsvResults(request):
         'count',
         'area_pixels',
         'area_mm2'
-    ])
-    for grain in grains.values():
-        for result in grain.results.all():
-            name = result.worker.get_full_name()
-            if not name:
-                name = result.worker.email
-            area_pixels = result.roi_area_pixels()
-            writer.writerow([
-                grain.sample.in_project.project_name,
-                grain.sample.sample_name,
-                grain.index,
-                result.ft_type,
-                result.worker.pk,
+    ]
+    rows = results.order_by('grain_id', 'pk').values_list(
+        'grain_id', 'pk', 'grain__sample__in_project__project_name',
+        'grain__sample__sample_name', 'grain__index',
+        'grain__scale_x', 'grain__scale_y', 'ft_type', 'worker_id',
+        'worker__first_name', 'worker__last_name', 'worker__email',
+        'create_date', 'result'
+    ).iterator(chunk_size=CSV_CHUNK_SIZE)
+    areas = grain_areas(Region.objects.filter(
+        grain__in=results.values('grain_id')
+    ).order_by('grain_id').values_list(
+        'grain_id', 'result_id', 'area_pixels', 'vertices'
+    ).iterator(chunk_size=CSV_CHUNK_SIZE))
+    area = (None, 0, {})
+    for (grain_id, grain_rows) in itertools.groupby(rows, key=lambda r: r[0]):
+        while area[0] is None or area[0] < grain_id:
+            area = next(areas, (grain_id, 0, {}))
+        (generic, specific) = area[1:] if area[0] == grain_id else (0, {})
+        for (_, pk, project_name, sample_name, index, scale_x, scale_y,
+                ft_type, worker_id, first_name, last_name, email,
+                create_date, count) in grain_rows:
+            name = '{0} {1}'.format(first_name, last_name).strip() or email
+            area_pixels = specific.get(pk, generic)
+            yield [
+                project_name,
+                sample_name,
+                index,
+                ft_type,
+                worker_id,
                 name,
-                result.create_date,
-                result.result,
+                create_date,
+                count,
                 area_pixels,
-                grain.pixels_to_mm2(area_pixels)
-            ])
-    return response
+                Grain(scale_x=scale_x, scale_y=scale_y).pixels_to_mm2(area_pixels)
+            ]
+
+@login_required
+def getCsvResults(request):
+    if not user_is_staff(request.user):
+        raise PermissionDenied
+    writer = csv.writer(Echo())
+    return StreamingHttpResponse(
+        (writer.writerow(row) for row in csv_results_rows(
+            results_requested(request)
+        )),
+        content_type='text/csv',
+        headers={
+            'Content-Disposition': 'attachment; filename="results.csv"'
+        }
+    )
 
 
 def get_grain_images_list(grain, ft_type):
@@ -982,16 +1182,175 @@ def get_grain_images_list(grain, ft_type):
         ft_type=ft_type
     ).order_by('index')
     return [
-        list(map(lambda x: reverse('get_image', args=[x.pk]), images)),
+        list(map(lambda x: x.get_absolute_url(), images)),
         list(map(lambda x: x.index, images))
     ]
 
+def get_grain_tiles_list(grain, ft_type):
+    """
+    Returns the tile pyramids of the grain's images, in index order,
+    for the viewer (see grain_info.tiles in geochron.js), or None
+    if any of the images has no tiles.
+    """
+    images = grain.image_set.filter(
+        ft_type=ft_type
+    ).order_by('index')
+    tiles = [{
+        'url': image.get_tile_url_template(),
+        'levels': image.tile_levels,
+        'width': image.width,
+        'height': image.height,
+    } for image in images]
+    if not tiles or any(
+        t['levels'] is None or t['width'] is None for t in tiles
+    ):
+        return None
+    return tiles
+
+# How long browsers may cache an image requested with its version
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+
 def get_image(request, pk):
+    """
+    Returns the image file.
+
+    The ETag is the SHA-256 hash of the file, so conditional requests
+    get 304 Not Modified if the browser already has the same file.
+    URLs with a `v` parameter matching the hash (as produced by
+    Image.get_absolute_url) can never refer to different content, so
+    those responses may be cached without revalidation.
+
+    If the IMAGE_ACCEL_REDIRECT setting is set, the file itself is
+    not sent; instead nginx is asked to send it from its internal
+    location at that path.
+    """
+    image = get_viewable_image(request, pk)
+    store = get_image_store()
+    return stored_file_response(
+        request,
+        image,
+        image.sha256,
+        store.modified(image.sha256),
+        image.format == 'P' and 'image/png' or 'image/jpeg',
+        store.name(image.sha256),
+        image.open
+    )
+
+def get_image_tile(request, pk, z, x, y):
+    """
+    Returns one tile of the image's tile pyramid (see ftc.image_tiles),
+    with the same caching as get_image.
+    """
+    image = get_viewable_image(request, pk)
+    store = get_image_store()
+    if (image.tile_levels is None or image.tile_levels < z
+            or not os.path.isfile(store.tile_path(image.sha256, z, x, y))):
+        raise Http404('no such tile')
+    return stored_file_response(
+        request,
+        image,
+        '{0}-{1}-{2}-{3}'.format(image.sha256, z, x, y),
+        store.modified(image.sha256),
+        'image/jpeg',
+        store.tile_name(image.sha256, z, x, y),
+        lambda: store.open_tile(image.sha256, z, x, y)
+    )
+
+def get_grain_image_bundle(request, pk, ft_type):
+    """
+    Returns all of the grain's images of type `ft_type` in one
+    multipart/mixed response, so the whole z-stack can be fetched in
+    one request.
+
+    The first part is a JSON array of the images' metadata (as from
+    the image API, so including `focus` and `light_path`) in index
+    order. The image files follow as the remaining parts, in the same
+    order. Every part has a Content-Length header, so a reader can
+    skip from part to part without searching for the boundary.
+    """
+    grain = get_object_or_404(Grain, pk=pk)
+    if ft_type not in dict(Image.FT_TYPE):
+        raise Http404('no such image type')
+    if not request.user.is_authenticated and not grain.sample.public:
+        raise PermissionDenied('not a public grain')
+    images = list(grain.image_set.filter(ft_type=ft_type).order_by('index'))
+    manifest = json.dumps(ImageSerializer(images, many=True).data).encode()
+    etag = quote_etag(hashlib.sha256(manifest).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        boundary = 'gah-bundle-' + etag.strip('"')[:32]
+        heads = [bundle_part_head(boundary, 'application/json', len(manifest))]
+        for image in images:
+            heads.append(bundle_part_head(
+                boundary,
+                image.format == 'P' and 'image/png' or 'image/jpeg',
+                image.size
+            ))
+        tail = '--{0}--\r\n'.format(boundary).encode('ascii')
+        response = StreamingHttpResponse(
+            stream_bundle(heads, manifest, images, tail),
+            content_type='multipart/mixed; boundary=' + boundary
+        )
+        response.headers['Content-Length'] = (
+            sum(len(head) + 2 for head in heads)
+            + len(manifest) + sum(image.size for image in images)
+            + len(tail)
+        )
+    response.headers['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+def bundle_part_head(boundary, content_type, length):
+    return (
+        '--{0}\r\nContent-Type: {1}\r\nContent-Length: {2}\r\n\r\n'
+    ).format(boundary, content_type, length).encode('ascii')
+
+def stream_bundle(heads, manifest, images, tail):
+    yield heads[0] + manifest + b'\r\n'
+    for (head, image) in zip(heads[1:], images):
+        yield head
+        with image.open() as fh:
+            for chunk in iter(lambda: fh.read(1 << 16), b''):
+                yield chunk
+        yield b'\r\n'
+    yield tail
+
+def get_viewable_image(request, pk):
     image = get_object_or_404(Image, pk=pk)
     if not request.user.is_authenticated and not image.grain.sample.public:
         raise PermissionDenied('not a public image')
-    mime = image.format = 'P' and 'image/png' or 'image/jpeg'
-    return HttpResponse(image.data, content_type=mime)
+    return image
+
+def stored_file_response(request, image, etag, modified, mime, name, opener):
+    """
+    Returns a response sending a file from the image store, or 304 Not
+    Modified if the request's conditions show that the browser already
+    has it. `name` is the file's path within the store and `opener`
+    a function returning the open file.
+    """
+    etag = quote_etag(etag)
+    last_modified = int(modified)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        if settings.IMAGE_ACCEL_REDIRECT:
+            # Let nginx send the file itself
+            response = HttpResponse(content_type=mime)
+            response.headers['X-Accel-Redirect'] = (
+                settings.IMAGE_ACCEL_REDIRECT + name
+            )
+        else:
+            response = FileResponse(opener(), content_type=mime)
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified)
+    if request.GET.get('v') == image.sha256:
+        patch_cache_control(
+            response, private=True, max_age=IMAGE_MAX_AGE, immutable=True
+        )
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 def redirect_to_count(request):
     ft_type = 'S'  # At the moment we're only choosing minerals randomly
@@ -1082,6 +1441,8 @@ def get_grain_info(
         'image_height': grain.image_height,
         'scale_x': grain.scale_x,
         'images': images_list,
+        'tiles': get_grain_tiles_list(grain, ft_type),
+        'bundle': reverse('get_grain_image_bundle', args=[grain.pk, ft_type]),
         'indices': indices_list,
         'rois': rois
     }
@@ -1279,9 +1640,10 @@ def updateFtnResult(request):
             )
         else:
             fts.result = result
-            fts.grainpoint_set.all().delete()
+            fts.clear_grain_points()
         fts.save()
         addGrainPoints(fts, res_dic)
+        refresh_summaries([grain.pk])
         myjson = json.dumps({ 'reply' : 'Done and thank you' }, cls=DjangoJSONEncoder)
         return HttpResponse(myjson, content_type='application/json')
     else:
@@ -1319,6 +1681,7 @@ def saveWorkingGrain(request):
                         r.save()
                     previous.delete()
             addGrainPoints(ftn, res)
+            refresh_summaries([grain.pk])
         myjson = json.dumps({ 'reply' : 'Done and thank you' }, cls=DjangoJSONEncoder)
         return HttpResponse(myjson, content_type='application/json')
     else:
@@ -1,14 +1,23 @@
 #!/usr/bin/env python3
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+import copy
 import csv
 from getpass import getpass
+import hashlib
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+import io
 import json
 import os
 import re
+import select
+import shutil
 import sys
+import threading
 from urllib.error import HTTPError
-from urllib.parse import urlencode, quote
-from urllib.request import Request, urlopen
+from urllib.parse import urlencode, quote, urljoin, urlsplit, urlunsplit
+from urllib.request import Request, getproxies, proxy_bypass
+import urllib.request
 import xml.etree.ElementTree as ET
 
 
@@ -231,6 +240,252 @@ def get_values(d, ks):
     return r
 
 
+class HostPool:
+    """
+    Keep-alive connections to one host, so that requests after the
+    first do not have to wait for a new connection (and TLS handshake).
+    Safe to use from several threads.
+    """
+    # most idle connections kept open
+    max_idle = 16
+    # most bytes of an unread response body to read so that its
+    # connection can be used again (rather than closing it)
+    drain_limit = 1 << 20
+    # methods that can be sent again if the connection fails after
+    # the server might already have acted on them
+    idempotent = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+
+    def __init__(self, scheme, host):
+        self.connection_class = HTTPSConnection if scheme == 'https' else HTTPConnection
+        self.host = host
+        self.idle = []
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.opened = 0
+        self.reused = 0
+        self.reopened = 0
+
+    @staticmethod
+    def closed_by_server(conn):
+        """
+        True if the idle connection cannot be used again: the server
+        has closed it (or sent something unasked for).
+        """
+        if conn.sock is None:
+            return True
+        try:
+            (readable, _, _) = select.select([conn.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def acquire(self):
+        """
+        Returns (connection, True if it has been used before)
+        """
+        with self.lock:
+            self.requests += 1
+            while self.idle:
+                conn = self.idle.pop()
+                if not self.closed_by_server(conn):
+                    self.reused += 1
+                    return (conn, True)
+                conn.close()
+                self.reopened += 1
+            self.opened += 1
+        return (self.connection_class(self.host), False)
+
+    def send(self, method, path, body, headers):
+        """
+        Sends the request and returns (connection, response).
+        """
+        (conn, reused) = self.acquire()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+        except ConnectionError:
+            conn.close()
+            if not reused:
+                raise
+            # The server closed the connection while it was idle,
+            # before the request could reach it
+            return self.resend(method, path, body, headers)
+        try:
+            return (conn, conn.getresponse())
+        except ConnectionError:
+            conn.close()
+            # The server might have acted on the request before the
+            # connection failed, so only send it again if that is safe
+            if not reused or method not in self.idempotent:
+                raise
+            return self.resend(method, path, body, headers)
+
+    def resend(self, method, path, body, headers):
+        with self.lock:
+            self.opened += 1
+            self.reopened += 1
+        conn = self.connection_class(self.host)
+        conn.request(method, path, body=body, headers=headers)
+        return (conn, conn.getresponse())
+
+    def release(self, conn, response):
+        """
+        Reads whatever is left of response and keeps conn for the
+        next request, or closes it if it cannot be used again.
+        """
+        try:
+            if not response.isclosed():
+                response.read(self.drain_limit)
+            reusable = response.isclosed() and not response.will_close
+        except (OSError, HTTPException):
+            reusable = False
+        if reusable:
+            with self.lock:
+                if len(self.idle) < self.max_idle:
+                    self.idle.append(conn)
+                    return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            for conn in self.idle:
+                conn.close()
+            self.idle = []
+
+
+class PooledResponse:
+    """
+    A response to a request made through a Transport. Close it (or use
+    it as a context manager) to return its connection to the pool.
+    """
+    def __init__(self, pool, conn, response):
+        self.pool = pool
+        self.conn = conn
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def readline(self, limit=-1):
+        return self.response.readline(limit)
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def close(self):
+        if self.conn is not None:
+            self.pool.release(self.conn, self.response)
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Transport:
+    """
+    Sends urllib Requests over pooled keep-alive connections, one pool
+    per host. Like urlopen, it follows redirects and raises HTTPError
+    for responses that are neither successful nor redirects. Requests
+    that should go through a proxy (as set by http_proxy, https_proxy
+    and no_proxy) are left to urllib.
+    """
+    max_redirects = 10
+
+    def __init__(self):
+        self.pools = {}
+        self.lock = threading.Lock()
+        self.proxies = getproxies()
+
+    def proxied(self, url):
+        parts = urlsplit(url)
+        return (
+            parts.scheme in self.proxies
+            and not proxy_bypass(parts.hostname or '')
+        )
+
+    def pool(self, scheme, host):
+        with self.lock:
+            key = (scheme, host)
+            if key not in self.pools:
+                self.pools[key] = HostPool(scheme, host)
+            return self.pools[key]
+
+    def open(self, req, data=None):
+        if data is not None:
+            req.data = data
+        url = req.full_url
+        if self.proxied(url):
+            return urllib.request.urlopen(req)
+        method = req.get_method()
+        body = req.data
+        headers = dict(req.header_items())
+        if body is not None and 'Content-type' not in headers:
+            headers['Content-type'] = 'application/x-www-form-urlencoded'
+        for _redirect in range(self.max_redirects + 1):
+            parts = urlsplit(url)
+            pool = self.pool(parts.scheme, parts.netloc)
+            path = urlunsplit(('', '', parts.path or '/', parts.query, ''))
+            (conn, response) = pool.send(method, path, body, headers)
+            location = response.getheader('Location')
+            redirect = response.status in (301, 302, 303, 307, 308) and location
+            if redirect and (
+                response.status in (301, 302, 303) or method in ('GET', 'HEAD')
+            ):
+                pool.release(conn, response)
+                url = urljoin(url, location)
+                if method not in ('GET', 'HEAD'):
+                    # as urllib does, redirect other requests as GETs
+                    method = 'GET'
+                    body = None
+                    headers = {
+                        k: v for (k, v) in headers.items()
+                        if k not in ('Content-type', 'Content-length')
+                    }
+                continue
+            if 200 <= response.status < 300:
+                return PooledResponse(pool, conn, response)
+            content = response.read()
+            pool.release(conn, response)
+            raise HTTPError(
+                url, response.status, response.reason,
+                response.headers, io.BytesIO(content)
+            )
+        raise HTTPError(
+            url, response.status, 'too many redirects',
+            response.headers, io.BytesIO()
+        )
+
+    def report(self):
+        with self.lock:
+            pools = list(self.pools.values())
+        for pool in pools:
+            print((
+                'Connections to {0}: {1} requests, {2} connections opened,'
+                ' {3} reused, {4} reopened after the server closed them'
+            ).format(
+                pool.host, pool.requests, pool.opened,
+                pool.reused, pool.reopened
+            ))
+
+    def close(self):
+        with self.lock:
+            for pool in self.pools.values():
+                pool.close()
+
+
+# All of gah's requests go through this
+transport = Transport()
+
+
+def urlopen(req, data=None):
+    return transport.open(req, data)
+
+
 def is_ok(response):
     status = response.status
     return 200 <= status and status < 300
@@ -302,20 +557,38 @@ def refresh_token(config):
     return config
 
 
+# Held while refreshing the access token, so that upload threads
+# that all find it has expired only refresh it once
+token_lock = threading.Lock()
+
+
 def token_refresh(func):
     def rf(options, config, *args, **kwargs):
+        access = config.get('access')
         try:
             config_altered = func(options, config, *args, **kwargs)
         except HTTPError as e:
             if e.code == 403 or e.code == 401:
-                refreshed_config = refresh_token(config)
-                config_altered = func(options, refreshed_config, *args, **kwargs) or refreshed_config
+                with token_lock:
+                    # unless another thread has already refreshed it
+                    if config.get('access') == access:
+                        refresh_token(config)
+                config_altered = func(options, config, *args, **kwargs) or config
             else:
                 raise e
         return config_altered
     return rf
 
 
+# Held while printing, so that lines from upload threads do not mix
+output_lock = threading.Lock()
+
+
+def report(*args):
+    with output_lock:
+        print(*args)
+
+
 def login(opts, config):
     url = get_url(config)
     user = 'user' in opts and opts.user or input("username: ")
@@ -394,32 +667,75 @@ def api_post(config, *args, **kwargs):
     return urlopen(req)
 
 
-def api_upload_verb(verb, config, *args, **kwargs):
+class MultipartBody:
+    """
+    A multipart/form-data request body for urlopen. Files (values with
+    a read method) are sent in chunks as the request is written rather
+    than being read into memory first; len() gives the size of the
+    whole body so that Content-Length can be set up front.
+    """
     boundary = b'auf98arnu8furpaurh83ryiruhvtbt43v!'
-    url = get_url(config) + '/ftc/api/' + '/'.join(map(quote_val, args)) + '/'
-    data = b''
-    for k,v in kwargs.items():
-        if hasattr(v, 'read'):
-            content = v.read()
-            if type(content) is str:
-                content = content.encode('utf-8')
-            data += (
-                b'--' + boundary + b'\r\nContent-Disposition: form-data;'
-                + b' name="' + k.encode('ascii')
-                + b'"; filename="' + quote(os.path.basename(v.name)).encode('ascii')
-                + b'"\r\n\r\n' + content + b'\r\n'
+    chunk_size = 1 << 16
+
+    def __init__(self, fields):
+        # each piece is either bytes or (file, start, size) for a binary
+        # file to send from its position when given to its end
+        self.pieces = []
+        for (k, v) in fields.items():
+            head = (
+                b'--' + self.boundary + b'\r\nContent-Disposition: form-data;'
+                + b' name="' + k.encode('ascii') + b'"'
             )
-        else:
-            data += (
-                b'--' + boundary + b'\r\nContent-Disposition: form-data;'
-                + b' name="' + k.encode('ascii')
-                + b'"\r\n\r\n' + str(v).encode('ascii') + b'\r\n'
-            )
-    data += b'--' + boundary + b'--'
-    req = Request(url, data=data, method=verb)
+            if hasattr(v, 'read'):
+                self.pieces.append(
+                    head + b'; filename="'
+                    + quote(os.path.basename(v.name)).encode('ascii')
+                    + b'"\r\n\r\n'
+                )
+                if isinstance(v, io.TextIOBase):
+                    self.pieces.append(v.read().encode('utf-8'))
+                else:
+                    start = v.tell()
+                    size = v.seek(0, io.SEEK_END) - start
+                    self.pieces.append((v, start, size))
+            else:
+                self.pieces.append(
+                    head + b'\r\n\r\n' + str(v).encode('ascii')
+                )
+            self.pieces.append(b'\r\n')
+        self.pieces.append(b'--' + self.boundary + b'--')
+
+    def content_type(self):
+        return 'multipart/form-data; boundary=' + self.boundary.decode('ascii')
+
+    def __len__(self):
+        return sum(
+            len(piece) if type(piece) is bytes else piece[2]
+            for piece in self.pieces
+        )
+
+    def __iter__(self):
+        for piece in self.pieces:
+            if type(piece) is bytes:
+                yield piece
+            else:
+                (fh, start, size) = piece
+                fh.seek(start)
+                while 0 < size:
+                    chunk = fh.read(min(size, self.chunk_size))
+                    if not chunk:
+                        raise OSError('{0} got shorter while uploading'.format(fh.name))
+                    size -= len(chunk)
+                    yield chunk
+
+
+def api_upload_verb(verb, config, *args, **kwargs):
+    url = get_url(config) + '/ftc/api/' + '/'.join(map(quote_val, args)) + '/'
+    body = MultipartBody(kwargs)
+    req = Request(url, data=body, method=verb)
     req.add_header('Authorization', 'Bearer ' + config.get('access', ''))
-    req.add_header('Content-Type', b'multipart/form-data; boundary='+boundary)
-    req.add_header('Content-Length', len(data))
+    req.add_header('Content-Type', body.content_type())
+    req.add_header('Content-Length', len(body))
     return urlopen(req)
 
 
@@ -485,6 +801,41 @@ def add_json_options(parser, id_help):
     )
 
 
+def positive_int(v):
+    i = int(v)
+    if i < 1:
+        raise argparse.ArgumentTypeError('must be at least 1')
+    return i
+
+
+def add_jobs_options(parser, whole_grains=True):
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=positive_int,
+        default=1,
+        help='number of images to upload at once (default 1)'
+    )
+    if whole_grains:
+        parser.add_argument(
+            '--whole-grains',
+            dest='whole_grains',
+            action='store_true',
+            help='upload --jobs whole grains at once instead of --jobs images of one grain'
+        )
+
+
+def add_manifest_options(parser):
+    parser.add_argument(
+        '--fresh',
+        action='store_true',
+        help=(
+            'upload everything again as new grains, ignoring the record'
+            + ' of previous uploads kept in {0} in the directory'
+        ).format(UploadManifest.file_name)
+    )
+
+
 def add_project_subparser(subparsers):
     # project has verbs list, info, new, update and delete
     project_parser = subparsers.add_parser('project', help='operations on projects')
@@ -674,6 +1025,8 @@ def add_sample_subparser(subparsers):
         action='store_true',
         help='keep going if some grains cannot be uploaded'
     )
+    add_jobs_options(upload)
+    add_manifest_options(upload)
     upload.add_argument(
         '--sample_name',
         dest='sample_name',
@@ -736,6 +1089,7 @@ def grain_list(opts, config):
             print(result)
 
 
+@token_refresh
 def grain_new_with_id(opts, config):
     with api_upload(
         config, 'sample', opts.sample, 'grain',
@@ -745,7 +1099,7 @@ def grain_new_with_id(opts, config):
         body = response.read()
         result = json.loads(body)
         id = result['id']
-        print("Created new grain", id)
+        report("Created new grain", id)
         return id
 
 
@@ -872,6 +1226,8 @@ def add_grain_subparser(subparsers):
         action='store_true',
         help='keep going if some grains cannot be uploaded'
     )
+    add_jobs_options(upload)
+    add_manifest_options(upload)
     upload.add_argument(
         '--genrois',
         choices=['yes', 'no', 'always'],
@@ -909,53 +1265,187 @@ def image_list(opts, config):
             print(result)
 
 
-@token_refresh
-def image_upload(opts, config):
+def image_extras(image):
     try:
-        extras = parse_metadata_image(opts.image + '_metadata.xml')
+        return parse_metadata_image(image + '_metadata.xml')
     except OSError:
-        extras = {}
+        return {}
+
+
+@token_refresh
+def image_upload(opts, config):
     with api_upload(
         config, 'grain', opts.grain, 'image',
-        data=open(opts.image, 'rb'), **extras
+        data=open(opts.image, 'rb'), **image_extras(opts.image)
     ) as response:
         body = response.read()
         result = json.loads(body)
-        print("Uploaded image", opts.image, "as image", result.get('id'))
+        report("Uploaded image", opts.image, "as image", result.get('id'))
+        return result.get('id')
 
 
-def images_upload(opts, config):
-    images = sorted(opts.image)
+@token_refresh
+def image_replace(opts, config):
+    with api_upload_verb(
+        'PATCH', config, 'image', opts.id,
+        data=open(opts.image, 'rb'), grain=opts.grain,
+        **image_extras(opts.image)
+    ) as response:
+        response.read()
+        report("Replaced image", opts.id, "with", opts.image)
+        return opts.id
+
+
+def try_image_upload(grain, image, config, id=None):
+    """
+    Uploads one image (replacing image `id` if given), returning
+    (image ID, None) on success or (None, the HTTPError that stopped
+    it).
+    """
+    image_opts = argparse.Namespace(grain=grain, image=image, id=id)
+    try:
+        if id is None:
+            return (image_upload(image_opts, config), None)
+        return (image_replace(image_opts, config), None)
+    except HTTPError as e:
+        return (None, e)
+
+
+def upload_image_files(grain_images, jobs, config, existing=None, uploaded=None):
+    """
+    Uploads each image file `path` in the list of (grain ID, path)
+    pairs `grain_images` to its grain, `jobs` of them at once, trying
+    those that fail with server errors up to three times. Paths that
+    are keys of `existing` replace the server images whose IDs are its
+    values. `uploaded`, if given, is called with the path and ID of
+    each image as it is uploaded. Returns the list of paths that could
+    not be uploaded.
+    """
+    existing = existing or {}
+
+    def upload(grain_image):
+        (grain, image) = grain_image
+        (id, e) = try_image_upload(grain, image, config, existing.get(image))
+        if e is None and uploaded is not None:
+            uploaded(image, id)
+        return e
+
+    failed = []
     last_error = None
-    for _attempt in [1,2,3]:
-        for_retry = []
-        for i in images:
-            opts.image = i
-            try:
-                image_upload(opts, config)
-            except HTTPError as e:
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for _attempt in [1,2,3]:
+            for_retry = []
+            errors = pool.map(upload, grain_images)
+            for ((g, i), e) in zip(grain_images, errors):
+                if e is None:
+                    continue
                 last_error = e
                 if 500 <= e.code:
-                    for_retry.append(i)
-                elif 400 <= e.code:
-                    print('image {0} failed with error {1}'.format(
+                    for_retry.append((g, i))
+                else:
+                    report('image {0} failed with error {1}'.format(
                         i, e.code
                     ))
-        if len(for_retry) == 0:
-            return
-        images = for_retry
-    print("Some uploads failed:", images)
-    print("Last error was", last_error)
+                    failed.append(i)
+            if len(for_retry) == 0:
+                return failed
+            grain_images = for_retry
+    report("Some uploads failed:", [i for (g, i) in grain_images])
+    report("Last error was", last_error)
+    return failed + [i for (g, i) in grain_images]
+
+
+def upload_images(opts, config, existing=None, uploaded=None):
+    """
+    Uploads the images opts.image to the grain opts.grain, opts.jobs
+    of them at once, as upload_image_files does.
+    """
+    return upload_image_files(
+        [(opts.grain, i) for i in sorted(opts.image)],
+        getattr(opts, 'jobs', 1),
+        config,
+        existing,
+        uploaded
+    )
+
+
+def images_upload(opts, config):
+    upload_images(opts, config)
+
+
+def file_sha256(file_name):
+    """
+    Returns the SHA-256 hash (as hex) of the file's contents, or None
+    if there is no such file.
+    """
+    if not os.path.isfile(file_name):
+        return None
+    h = hashlib.sha256()
+    with open(file_name, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
 
 
 @token_refresh
-def download_image(opts, config, id, file_name):
+def download_image(opts, config, id, file_name, sha256=None):
+    if sha256 is not None and file_sha256(file_name) == sha256:
+        print(f'Already have {file_name}')
+        return
     with api_get(config, 'image', id, 'data') as response:
         with open(file_name, 'wb') as output:
             print(f'Downloading {file_name}')
             output.write(response.read())
 
 
+def read_multipart(response):
+    """
+    Yields (headers, body) for each part of a multipart response in
+    which every part has a Content-Length header (as the image bundle
+    endpoint's responses do). Header names are lower-cased.
+    """
+    while True:
+        delimiter = response.readline().rstrip(b'\r\n')
+        if not delimiter or delimiter.endswith(b'--'):
+            return
+        headers = {}
+        line = response.readline().rstrip(b'\r\n')
+        while line:
+            (k, v) = line.decode('latin-1').split(':', 1)
+            headers[k.strip().lower()] = v.strip()
+            line = response.readline().rstrip(b'\r\n')
+        body = response.read(int(headers['content-length']))
+        response.readline()
+        yield (headers, body)
+
+
+@token_refresh
+def download_image_bundle(opts, config, ft_type, file_names):
+    """
+    Downloads all the grain's images of type ft_type in one request,
+    writing each one whose ID is a key in the dict file_names to the
+    file named by its value. If the server cannot send a bundle, the
+    images are downloaded one at a time instead.
+    """
+    try:
+        response = api_get(config, 'grain', opts.id, 'image', 'bundle', ft_type)
+    except HTTPError as e:
+        if e.code != 404:
+            raise e
+        for (id, file_name) in file_names.items():
+            download_image(opts, config, id, file_name)
+        return
+    with response:
+        parts = read_multipart(response)
+        (_, manifest) = next(parts)
+        for (v, (_, body)) in zip(json.loads(manifest), parts):
+            file_name = file_names.get(v['id'])
+            if file_name is not None:
+                print(f'Downloading {file_name}')
+                with open(file_name, 'wb') as output:
+                    output.write(body)
+
+
 skeleton_metadata_template ="""<ImageMetadata>
 <HardwareSetting>
 <ParameterCollection Id="MTBRLTLSwitch">
@@ -1008,6 +1498,8 @@ def images_download(opts, config):
         return
     if opts.dir:
         os.makedirs(opts.dir, exist_ok=True)
+    # file names of images to download, keyed by type then image ID
+    to_download = {}
     for v in image_result:
         extension = '.jpg'
         if v['format'] == 'P':
@@ -1023,7 +1515,11 @@ def images_download(opts, config):
         file_name = f'{prefix}Stack{index_text}{extension}'
         if opts.dir:
             file_name = os.path.join(opts.dir, file_name)
-        download_image(opts, config, v.get('id'), file_name)
+        sha256 = v.get('sha256')
+        if sha256 is not None and file_sha256(file_name) == sha256:
+            print(f'Already have {file_name}')
+        else:
+            to_download.setdefault(v.get('ft_type'), {})[v.get('id')] = file_name
         # make a metadata file if applicable
         if v.get('focus') and v.get('light_path'):
             with open(file_name + '_metadata.xml', 'w') as fh:
@@ -1031,6 +1527,8 @@ def images_download(opts, config):
                     skeleton_metadata_template.format(**v, **grain_stats),
                     file=fh,
                 )
+    for (ft_type, file_names) in to_download.items():
+        download_image_bundle(opts, config, ft_type, file_names)
     file_name = 'rois.json'
     if opts.dir:
         file_name = os.path.join(opts.dir, file_name)
@@ -1051,13 +1549,200 @@ def get_sample_and_index_from_path(path):
     return (p0, None)
 
 
+class UploadManifest:
+    """
+    The record, kept in a file in the directory being uploaded, of
+    what has been uploaded from it: for each grain directory, the
+    ID of the grain made from it, the hash of each file as uploaded
+    and the IDs of its images. Running the upload again then skips
+    what is already on the server instead of duplicating it.
+
+    The file is rewritten after every change, so that the record is
+    complete however the upload is stopped.
+    """
+    file_name = 'gah-manifest.json'
+
+    def __init__(self, dir, url, fresh=False):
+        self.path = os.path.join(dir, self.file_name)
+        self.dir = dir
+        self.url = url
+        self.lock = threading.Lock()
+        self.grains = {}
+        if fresh:
+            return
+        try:
+            with open(self.path) as fh:
+                manifest = json.load(fh)
+        except FileNotFoundError:
+            return
+        # IDs from a different server mean nothing here
+        if manifest.get('url') == url:
+            self.grains = manifest.get('grains', {})
+
+    def key(self, root):
+        return os.path.relpath(root, self.dir).replace(os.sep, '/')
+
+    def grain(self, root):
+        """
+        Returns (a copy of) the record for grain directory `root`
+        """
+        with self.lock:
+            return copy.deepcopy(self.grains.get(self.key(root), {}))
+
+    def update(self, root, **kwargs):
+        with self.lock:
+            self.grains.setdefault(self.key(root), {}).update(kwargs)
+            self.save()
+
+    def set_image(self, root, image, **kwargs):
+        with self.lock:
+            grain = self.grains.setdefault(self.key(root), {})
+            grain.setdefault('images', {})[os.path.basename(image)] = kwargs
+            self.save()
+
+    def save(self):
+        # Write a temporary file and rename it, so that being stopped
+        # halfway does not lose the old manifest
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump({ 'url': self.url, 'grains': self.grains }, fh, indent=1)
+        os.replace(tmp, self.path)
+
+
+def cached_sha256(file_name, cache):
+    """
+    Returns the SHA-256 hash of a file, taking it from `cache` (a dict
+    of file names to [size, modification time, hash]) if the size and
+    modification time have not changed since, and updating `cache`
+    otherwise.
+    """
+    st = os.stat(file_name)
+    name = os.path.basename(file_name)
+    c = cache.get(name)
+    if c and c[0] == st.st_size and c[1] == st.st_mtime_ns:
+        return c[2]
+    sha256 = file_sha256(file_name)
+    cache[name] = [st.st_size, st.st_mtime_ns, sha256]
+    return sha256
+
+
+@token_refresh
+def grain_update_rois(opts, config, grain):
+    with api_upload_verb(
+        'PATCH', config, 'grain', grain, rois=open(opts.rois, 'rb')
+    ) as response:
+        response.read()
+        report("Updated the regions of grain", grain)
+
+
+@token_refresh
+def grain_exists(opts, config, grain):
+    """
+    Returns True if the grain with ID `grain` is on the server.
+    """
+    try:
+        with api_get(config, 'grain', grain) as response:
+            response.read()
+            return True
+    except HTTPError as e:
+        if e.code == 404:
+            return False
+        raise e
+
+
+def upload_grain(opts, config, image_jobs):
+    """
+    Creates the grain described by opts (or updates the one the
+    manifest opts.manifest says was made from it before) and uploads
+    its images, image_jobs at once, skipping any the manifest says are
+    uploaded already. Returns (number of images uploaded, list of
+    images that failed).
+    """
+    manifest = opts.manifest
+    record = manifest.grain(opts.root)
+    files = os.listdir(opts.root)
+    images = [os.path.join(opts.root, f) for f in files if os.path.splitext(f)[1] in ('.jpg', '.jpeg', '.png')]
+    cache = record.get('files', {})
+    rois_sha256 = cached_sha256(opts.rois, cache)
+    shas = { i: cached_sha256(i, cache) for i in images }
+    # the metadata is uploaded with its image, so a change to it must
+    # upload the image again
+    metas = {
+        i: cached_sha256(i + '_metadata.xml', cache)
+        for i in images if os.path.isfile(i + '_metadata.xml')
+    }
+    manifest.update(opts.root, files=cache)
+    content = hashlib.sha256(rois_sha256.encode('ascii'))
+    for i in sorted(images):
+        content.update('\0{0}\0{1}'.format(os.path.basename(i), shas[i]).encode())
+        if i in metas:
+            content.update('\0{0}'.format(metas[i]).encode())
+    content = content.hexdigest()
+    grain = record.get('grain')
+    if grain is not None and record.get('sample') != str(opts.sample):
+        grain = None
+    if grain is not None and record.get('content') == content:
+        report("Grain", grain, "is already uploaded from", opts.root)
+        return (0, [])
+    uploaded_images = record.get('images', {}) if grain is not None else {}
+    if grain is not None and record.get('rois') != rois_sha256:
+        try:
+            grain_update_rois(opts, config, grain)
+        except HTTPError as e:
+            if e.code != 404:
+                raise e
+            # the grain has been deleted from the server
+            grain = None
+            uploaded_images = {}
+    elif grain is not None and not grain_exists(opts, config, grain):
+        report("Grain", grain, "is no longer on the server; creating it again")
+        grain = None
+        uploaded_images = {}
+    if grain is None:
+        grain = grain_new_with_id(opts, config)
+        manifest.update(
+            opts.root, sample=str(opts.sample), grain=grain, images={}
+        )
+    manifest.update(opts.root, rois=rois_sha256)
+    to_upload = []
+    existing = {}
+    for i in images:
+        u = uploaded_images.get(os.path.basename(i))
+        if u is None:
+            to_upload.append(i)
+        elif u['sha256'] != shas[i] or u.get('metadata') != metas.get(i):
+            to_upload.append(i)
+            existing[i] = u['id']
+    image_opts = argparse.Namespace(grain=grain, image=to_upload, jobs=image_jobs)
+    failed = upload_images(
+        image_opts,
+        config,
+        existing=existing,
+        uploaded=lambda i, id: manifest.set_image(
+            opts.root, i, id=id, sha256=shas[i], metadata=metas.get(i)
+        )
+    )
+    if not failed:
+        manifest.update(opts.root, content=content)
+    return (len(to_upload) - len(failed), failed)
+
+
+def try_upload_grain(opts, config, image_jobs):
+    try:
+        return (upload_grain(opts, config, image_jobs), None)
+    except HTTPError as e:
+        return (None, e)
+
+
 @token_refresh
 def grain_upload(opts, config, make_sample_fn=None, explicit_sample_name=None):
-    n = 0
-    successful = 0
     new_samples = []
     detect_sample = not opts.sample
     metadata_by_dir = find_grains_in_directories(opts.dir)
+    opts.manifest = UploadManifest(opts.dir, get_url(config), opts.fresh)
+    # Work out each grain's options (and make any new samples) first,
+    # so that only the uploads themselves run in parallel
+    grains = []
     for root,m in metadata_by_dir.items():
         opts.rois = m.get('rois')
         if (m.get('rois') or opts.genrois == 'yes'):
@@ -1076,36 +1761,248 @@ def grain_upload(opts, config, make_sample_fn=None, explicit_sample_name=None):
                     opts.sample_name = explicit_sample_name or sample
                     if make_sample_fn(opts, config):
                         new_samples.append(sample)
-            try:
-                n += 1
-                grain = grain_new_with_id(opts, config)
-                files = os.listdir(root)
-                images = [os.path.join(root, f) for f in files if os.path.splitext(f)[1] in ('.jpg', '.jpeg', '.png')]
-                image_opts = argparse.Namespace(grain=grain, image=images)
-                images_upload(image_opts, config)
+            grains.append(argparse.Namespace(**vars(opts), root=root))
+        else:
+            print("rois: {0} genrois: {1} metadata: {2}".format(opts.rois, opts.genrois, m))
+    # With --whole-grains, run opts.jobs grains at once (each uploading
+    # one image at a time), otherwise upload opts.jobs images at once
+    grain_jobs = opts.jobs if opts.whole_grains else 1
+    image_jobs = 1 if opts.whole_grains else opts.jobs
+    successful = 0
+    image_count = 0
+    failed_grains = []
+    failed_images = []
+    with ThreadPoolExecutor(max_workers=grain_jobs) as pool:
+        if grain_jobs == 1:
+            # Don't start one grain before the last has succeeded
+            outcomes = (try_upload_grain(g, config, image_jobs) for g in grains)
+        else:
+            futures = [
+                pool.submit(try_upload_grain, g, config, image_jobs)
+                for g in grains
+            ]
+            outcomes = (f.result() for f in futures)
+        for (n, (g, (result, e))) in enumerate(zip(grains, outcomes), 1):
+            if e is None:
                 successful += 1
-            except HTTPError as e:
-                print("Failed to upload grain {0} because of error {1} ({2})".format(
+                image_count += result[0]
+                failed_images += result[1]
+            else:
+                report("Failed to upload grain {0} because of error {1} ({2})".format(
                     n, e.code, e.reason
                 ))
-                print(opts)
+                report(g)
+                failed_grains.append(g.root)
                 if not opts.keepgoing or e.code < 500:
+                    pool.shutdown(cancel_futures=True)
                     raise e
-        else:
-            print("rois: {0} genrois: {1} metadata: {2}".format(opts.rois, opts.genrois, m))
     if 0 < len(new_samples):
         print("New samples created:")
         for ns in new_samples:
             print("  {0}".format(ns))
     print("Uploaded grain count:", successful)
+    print("Uploaded image count:", image_count)
+    if failed_grains:
+        print("Grains that failed:")
+        for fg in failed_grains:
+            print("  {0}".format(fg))
+    if failed_images:
+        print("Images that failed:")
+        for fi in failed_images:
+            print("  {0}".format(fi))
+
+
+# The names the server gives images (see ftc/parse_image_name.py)
+IMAGE_NAME_RE = re.compile(
+    r"(?P<mica>mica)?(?P<refl>refl)?stack((-(?P<z>-?\d\d?))|(?P<flat>flat))"
+    r"\.(jpg|jpeg|png)",
+    re.IGNORECASE
+)
+
+
+def image_name_key(name):
+    """
+    Returns the (fission track type, index) that the server would
+    give an image file called `name`, or None if it would not accept
+    it as an image.
+    """
+    m = IMAGE_NAME_RE.fullmatch(name)
+    if m is None:
+        return None
+    if m.group('flat'):
+        index = -1 if m.group('refl') else 0
+    else:
+        index = int(m.group('z')) - (100 if m.group('refl') else 0)
+    return ('I' if m.group('mica') else 'S', index)
+
+
+def local_inventory(opts):
+    """
+    Finds the grains under opts.dir, returning a dict of sample names
+    (or opts.sample) to dicts of grain indices to dicts with the
+    grain's 'root' directory, 'rois' file (possibly None), 'metadata'
+    from find_grains_in_directories and 'images', a dict of (fission
+    track type, index) to image path.
+    """
+    samples = {}
+    for (root, m) in find_grains_in_directories(opts.dir).items():
+        (sample, index) = get_sample_and_index_from_path(root)
+        if index is None:
+            report("Cannot sync {0}; it is not named Grain<nn>".format(root))
+            continue
+        images = {}
+        for f in os.listdir(root):
+            key = image_name_key(f)
+            if key is not None:
+                images[key] = os.path.join(root, f)
+        samples.setdefault(opts.sample or sample, {})[int(index)] = {
+            'root': root,
+            'rois': m.get('rois'),
+            'metadata': m,
+            'images': images,
+        }
+    return samples
 
 
 @token_refresh
-def image_update(opts, config):
+def sample_inventory(opts, config, sample):
+    with api_get(config, 'sample', sample, 'inventory') as response:
+        return json.loads(response.read())
+
+
+def try_sample_inventory(opts, config, sample):
+    """
+    Returns the server's inventory of the sample (see
+    get_sample_inventory in ftc/apiviews.py) or None if there is no
+    such sample.
+    """
     try:
-        extras = parse_metadata_image(opts.image + '_metadata.xml')
-    except OSError:
-        extras = {}
+        return sample_inventory(opts, config, sample)
+    except HTTPError as e:
+        if e.code == 404:
+            return None
+        raise e
+
+
+def sync_grain_new(opts, config, sample, index, grain):
+    rois = grain['rois']
+    if rois is None:
+        m = grain['metadata']
+        rois = generate_rois_file(
+            grain['root'],
+            m.get('metadata'),
+            m.get('mica_metadata'),
+            m.get('mica_transformation')
+        )
+    return grain_new_with_id(
+        argparse.Namespace(sample=sample, rois=rois, index=index), config
+    )
+
+
+def sync(opts, config):
+    """
+    Uploads the grains and images under opts.dir that are not on the
+    server, replaces those whose contents differ from the server's
+    and reports those only on the server.
+    """
+    local = local_inventory(opts)
+    with ThreadPoolExecutor(max_workers=opts.jobs) as pool:
+        # Hash the local images while the inventories are fetched
+        paths = [
+            p for grains in local.values()
+            for g in grains.values() for p in g['images'].values()
+        ]
+        hashes = dict(zip(paths, pool.map(file_sha256, paths)))
+        remote = dict(zip(
+            local.keys(),
+            pool.map(lambda s: try_sample_inventory(opts, config, s), local.keys())
+        ))
+    new_grains = []
+    to_upload = []
+    existing = {}
+    only_on_server = []
+    for (sample, grains) in local.items():
+        inventory = remote[sample]
+        if inventory is None:
+            report("Sample {0} is not on the server; use 'gah sample upload'".format(sample))
+            continue
+        server_grains = { g['index']: g for g in inventory['grains'] }
+        for (index, grain) in sorted(grains.items()):
+            server_grain = server_grains.pop(index, None)
+            if server_grain is None:
+                new_grains.append((inventory['id'], index, grain))
+                continue
+            server_images = {
+                (i['ft_type'], i['index']): i for i in server_grain['images']
+            }
+            for (key, path) in sorted(grain['images'].items()):
+                server_image = server_images.pop(key, None)
+                if server_image is None:
+                    to_upload.append((server_grain['id'], path))
+                elif server_image['sha256'] != hashes[path]:
+                    to_upload.append((server_grain['id'], path))
+                    existing[path] = server_image['id']
+            for i in server_images.values():
+                only_on_server.append('image {0} ({1} {2}) of {3}/Grain{4:02}'.format(
+                    i['id'], i['ft_type'], i['index'], sample, index
+                ))
+        for g in server_grains.values():
+            only_on_server.append('grain {0} ({1}/Grain{2:02})'.format(
+                g['id'], sample, g['index']
+            ))
+    for (sample, index, grain) in new_grains:
+        report("New grain:", grain['root'])
+    for (grain, path) in to_upload:
+        report("Changed image:" if path in existing else "New image:", path)
+    if only_on_server:
+        report("Only on the server:")
+        for s in only_on_server:
+            report("  {0}".format(s))
+    if opts.dry_run:
+        return
+    with ThreadPoolExecutor(max_workers=opts.jobs) as pool:
+        ids = pool.map(
+            lambda g: sync_grain_new(opts, config, g[0], g[1], g[2]),
+            new_grains
+        )
+        for ((sample, index, grain), id) in zip(new_grains, ids):
+            to_upload += [(id, p) for p in sorted(grain['images'].values())]
+    failed = upload_image_files(to_upload, opts.jobs, config, existing)
+    print("Uploaded grain count:", len(new_grains))
+    print("Uploaded image count:", len(to_upload) - len(failed))
+    if failed:
+        print("Images that failed:")
+        for fi in failed:
+            print("  {0}".format(fi))
+
+
+def add_sync_subparser(subparsers):
+    sync_parser = subparsers.add_parser(
+        'sync',
+        help='upload the grains and images in a directory that are'
+        + ' missing from or different on the server'
+    )
+    sync_parser.set_defaults(func=sync)
+    sync_parser.add_argument(
+        '--sample',
+        help='Sample ID (or name) the grains are in (default is to guess based on the directory)'
+    )
+    sync_parser.add_argument(
+        '-n',
+        '--dry-run',
+        dest='dry_run',
+        action='store_true',
+        help='only report the differences'
+    )
+    add_jobs_options(sync_parser, whole_grains=False)
+    sync_parser.add_argument(
+        'dir',
+        help='directory containing directories containing rois.json files and z-stack images'
+    )
+
+
+@token_refresh
+def image_update(opts, config):
     with api_upload_verb(
         'PATCH',
         config,
@@ -1113,7 +2010,7 @@ def image_update(opts, config):
         opts.id,
         data=open(opts.image, 'rb'),
         grain=opts.grain,
-        **extras
+        **image_extras(opts.image)
     ) as response:
         print(response.read())
 
@@ -1157,6 +2054,7 @@ def add_image_subparser(subparsers):
         help='Paths to image files (PNG or JPG)',
         nargs='+',
     )
+    add_jobs_options(upload, whole_grains=False)
     download = verbs.add_parser('download', help='download images of a grain')
     download.set_defaults(func=images_download)
     download.add_argument('id', help='Grain ID')
@@ -1216,8 +2114,7 @@ def output_as_csv(xs):
         print(*row, sep=',')
 
 
-@token_refresh
-def count_list(opts, config):
+def count_filters(opts):
     kwargs = {}
     if opts.all:
         kwargs['all'] = True
@@ -1227,6 +2124,11 @@ def count_list(opts, config):
         kwargs['grain'] = opts.grain
     if opts.user:
         kwargs['user'] = opts.user
+    return kwargs
+
+@token_refresh
+def count_list(opts, config):
+    kwargs = count_filters(opts)
     with api_get(config, 'count', **kwargs) as response:
         body = response.read()
         result = json.loads(body)
@@ -1297,6 +2199,24 @@ def count_upload(opts, config):
             else:
                 count_post(config, j)
 
+EXPORT_EXTENSIONS = {
+    'npz': 'npz',
+    'parquet': 'parquet.zip',
+}
+
+@token_refresh
+def count_export(opts, config):
+    kwargs = count_filters(opts)
+    args = ['count', 'export', opts.format]
+    if kwargs:
+        # the query string must follow the trailing slash
+        args.append('')
+    output = opts.output or 'counts.' + EXPORT_EXTENSIONS[opts.format]
+    with api_get(config, *args, **kwargs) as response:
+        with open(output, 'wb') as fh:
+            shutil.copyfileobj(response, fh)
+    print('wrote {0}'.format(output))
+
 
 def add_count_subparser(subparsers):
     # count only has list for now
@@ -1318,6 +2238,33 @@ def add_count_subparser(subparsers):
         action='store_true',
         help='report results as json (instead of CSV)'
     )
+    export_counts = verbs.add_parser(
+        'export',
+        help='download count results, grains, points and contained tracks as columnar files'
+    )
+    export_counts.set_defaults(func=count_export)
+    export_counts.add_argument(
+        '--format',
+        choices=EXPORT_EXTENSIONS.keys(),
+        default='npz',
+        help=(
+            'npz for a NumPy .npz file (the default)'
+            ' or parquet for a zip of Parquet files'
+        )
+    )
+    export_counts.add_argument(
+        '--all',
+        action='store_true',
+        help='export unfinished counts as well'
+    )
+    export_counts.add_argument('--sample', help='only export the sample with this ID or name')
+    export_counts.add_argument('--grain', help='only export the grain with this index')
+    export_counts.add_argument('--user', help='only export counts made by the user with this username')
+    export_counts.add_argument(
+        '-o',
+        '--output',
+        help='file to write (default counts.npz or counts.parquet.zip)'
+    )
     upload_count = verbs.add_parser(
         'upload',
         help='upload csv count'
@@ -1366,6 +2313,12 @@ def parse_argv():
         dest='config',
         metavar='FILE'
     )
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        help='report how many connections were made to the server'
+    )
     parser.set_defaults(func=None)
     subparsers = parser.add_subparsers(dest='command')
     subparsers.required = True
@@ -1379,6 +2332,7 @@ def parse_argv():
     add_image_subparser(subparsers)
     add_count_subparser(subparsers)
     add_genrois_subparser(subparsers)
+    add_sync_subparser(subparsers)
     return parser.parse_args()
 
 def open_config(options):
@@ -1425,6 +2379,10 @@ def perform_action(options):
             render_json(j)
         except:
             print(str(body)[:1000])
+    finally:
+        transport.close()
+        if options.verbose:
+            transport.report()
 
 def main():
     options = parse_argv()
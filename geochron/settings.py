@@ -258,7 +258,35 @@ LOGGING = {
 }
 
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
-IMAGE_UPLOAD_SIZE_LIMIT = os.getenv('IMAGE_UPLOAD_SIZE_LIMIT') or 256 * 1024
+IMAGE_UPLOAD_SIZE_LIMIT = int(os.getenv('IMAGE_UPLOAD_SIZE_LIMIT') or 256 * 1024)
+# Grain archives (see ftc/grain_archive.py) with more files than this,
+# or whose files add up to more bytes than this, are refused
+GRAIN_ARCHIVE_MAX_FILES = int(os.getenv('GRAIN_ARCHIVE_MAX_FILES') or 100)
+GRAIN_ARCHIVE_SIZE_LIMIT = int(
+    os.getenv('GRAIN_ARCHIVE_SIZE_LIMIT') or 32 * IMAGE_UPLOAD_SIZE_LIMIT
+)
+# Image files are stored in this directory, each named by its SHA-256 hash
+IMAGE_STORE = os.getenv('IMAGE_STORE') or 'ftc.image_store.FileSystemImageStore'
+IMAGE_STORE_ROOT = os.getenv('IMAGE_STORE_ROOT') or os.path.join(BASE_DIR, 'user_upload', 'image_store')
+# If set, image files are sent by nginx from this internal location
+# (mapped to IMAGE_STORE_ROOT) rather than by Django; see nginx/conf.d
+IMAGE_ACCEL_REDIRECT = os.getenv('IMAGE_ACCEL_REDIRECT') or None
+# When to make the tile pyramids that the counting viewer loads
+# images from: 'background' (in a thread after each image is saved),
+# 'queue' (as a job for the runworkers command), 'immediate' (before
+# the saving request returns) or 'off'; images without tiles are
+# shown whole
+IMAGE_TILES = os.getenv('IMAGE_TILES') or 'background'
+# Background jobs (see ftc/jobs.py) that fail are retried after
+# JOB_RETRY_DELAY seconds, doubling each time, until they have been
+# tried JOB_MAX_ATTEMPTS times. Workers say every JOB_TIMEOUT/4
+# seconds that they are still running their jobs; a running job not
+# heard of for JOB_TIMEOUT seconds is assumed to have lost its worker
+# and is run again.
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS') or 3)
+JOB_RETRY_DELAY = float(os.getenv('JOB_RETRY_DELAY') or 30)
+JOB_TIMEOUT = float(os.getenv('JOB_TIMEOUT') or 3600)
+TEST_RUNNER = 'ftc.test_runner.ImageStoreTestRunner'
 PROMETHEUS_EXPORT_MIGRATIONS = False
 prom_port_range = os.getenv('PROMETHEUS_METRICS_EXPORT_PORT_RANGE')
 if prom_port_range is not None: